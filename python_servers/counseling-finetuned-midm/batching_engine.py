@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+연속 배칭(continuous batching) 생성 엔진
+여러 /chat 요청을 하나의 배치로 묶어 한 토큰씩 함께 디코딩합니다.
+끝난 시퀀스는 즉시 배치에서 빠지고, 새 요청은 디코딩 도중에도 합류합니다.
+다중 LoRA 모델(model_host.py)이면 요청마다 어댑터를 지정할 수 있고, 서로 다른 어댑터 요청도 한 배치로 묶습니다.
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+import torch.nn.functional as F
+from transformers import (
+    LogitsProcessorList,
+    NoRepeatNGramLogitsProcessor,
+    RepetitionPenaltyLogitsProcessor,
+    TemperatureLogitsWarper,
+    TopKLogitsWarper,
+    TopPLogitsWarper,
+)
+from transformers.cache_utils import DynamicCache
+
+logger = logging.getLogger(__name__)
+
+
+def build_logits_processors(temperature=1.0, top_p=1.0, top_k=0, do_sample=True,
+                            repetition_penalty=1.0, no_repeat_ngram_size=0):
+    """요청별 샘플링 파라미터로 logits 처리기 구성 (model.generate와 같은 순서)"""
+    processors = LogitsProcessorList()
+    if repetition_penalty and repetition_penalty != 1.0:
+        processors.append(RepetitionPenaltyLogitsProcessor(penalty=repetition_penalty))
+    if no_repeat_ngram_size and no_repeat_ngram_size > 0:
+        processors.append(NoRepeatNGramLogitsProcessor(no_repeat_ngram_size))
+    if do_sample:
+        if temperature and temperature != 1.0:
+            processors.append(TemperatureLogitsWarper(temperature))
+        if top_k and top_k > 0:
+            processors.append(TopKLogitsWarper(top_k=top_k))
+        if top_p is not None and top_p < 1.0:
+            processors.append(TopPLogitsWarper(top_p=top_p))
+    return processors
+
+
+class GenerationRequest:
+    """배치에 참여하는 단일 생성 요청"""
+
+    def __init__(self, input_ids, max_new_tokens=150, eos_token_id=None, do_sample=True,
+                 streamer=None, past_key_values=None, cache_callback=None, adapter=None, on_finish=None,
+                 **sampling):
+        self.input_ids = list(input_ids)
+        # PEFT 어댑터 이름 (None이면 모델의 활성 어댑터)
+        self.adapter = adapter
+        # 정상 종료 시 호출 (없으면 엔진의 on_finish)
+        self.on_finish = on_finish
+        # input_ids 앞부분에 대해 미리 계산된 KV (레이어별 (key, value), prefix 캐시 재사용)
+        self.past_key_values = past_key_values
+        # 종료 시 (처리된 토큰 id, 해당 KV)를 받는 콜백 (세션 KV 캐시 저장용)
+        self.cache_callback = cache_callback
+        self.max_new_tokens = max_new_tokens
+        if eos_token_id is None:
+            eos_token_id = []
+        elif isinstance(eos_token_id, int):
+            eos_token_id = [eos_token_id]
+        self.eos_token_ids = set(eos_token_id)
+        self.do_sample = do_sample
+        self.processors = build_logits_processors(do_sample=do_sample, **sampling)
+        self.streamer = streamer
+        self.generated = []
+        # logits 처리기에 넘길 (1, 용량) 토큰 id 텐서 - 한 번 만든 뒤 새 토큰만 채움 (용량이 차면 두 배로)
+        self._ids = None
+        self._ids_filled = 0
+        self.future = Future()
+        # 단계별 시각 (perf_counter): 등록 → 배치 합류(prefill 시작) → 첫 토큰 → 종료
+        self.submitted_at = time.perf_counter()
+        self.admitted_at = None
+        self.first_token_at = None
+        self.finished_at = None
+        # 실제로 prefill한 토큰 수 (캐시된 앞부분 제외)
+        self.prefill_tokens = len(self.input_ids)
+
+    def _token_ids(self, device):
+        """지금까지의 토큰 id (1, L) 텐서 (스텝마다 전체 리스트를 다시 옮기지 않고 새 토큰만 기록)"""
+        length = len(self.input_ids) + len(self.generated)
+        if self._ids is None or self._ids.shape[1] < length:
+            ids = torch.empty((1, max(2 * length, 64)), dtype=torch.long, device=device)
+            if self._ids is None:
+                ids[0, :len(self.input_ids)] = torch.tensor(self.input_ids, device=device)
+                self._ids_filled = len(self.input_ids)
+            else:
+                ids[:, :self._ids_filled] = self._ids[:, :self._ids_filled]
+            self._ids = ids
+        if self._ids_filled < length:
+            new = self.generated[self._ids_filled - len(self.input_ids):]
+            self._ids[0, self._ids_filled:length] = torch.tensor(new, device=device)
+            self._ids_filled = length
+        return self._ids[:, :length]
+
+    def sample(self, logits):
+        """마지막 위치 logits(1, vocab)에서 다음 토큰 선택"""
+        # 처리기(반복 패널티 등)가 없으면 이전 토큰 id가 필요 없음
+        ids = self._token_ids(logits.device) if self.processors else None
+        scores = self.processors(ids, logits.float())
+        if self.do_sample:
+            probs = torch.softmax(scores, dim=-1)
+            return int(torch.multinomial(probs, num_samples=1)[0, 0])
+        return int(torch.argmax(scores, dim=-1)[0])
+
+    def push(self, token):
+        """생성된 토큰 추가 후 종료 여부 반환"""
+        if not self.generated:
+            self.first_token_at = time.perf_counter()
+        self.generated.append(token)
+        if self.streamer is not None:
+            self.streamer.put(torch.tensor([token]))
+        return token in self.eos_token_ids or len(self.generated) >= self.max_new_tokens
+
+    def finish(self, error=None):
+        if self.future.done():
+            return
+        self.finished_at = time.perf_counter()
+        if self.streamer is not None:
+            self.streamer.end()
+        if error is not None:
+            self.future.set_exception(error)
+        else:
+            self.future.set_result(self.input_ids + self.generated)
+
+
+def _to_legacy(cache):
+    if hasattr(cache, "to_legacy_cache"):
+        return cache.to_legacy_cache()
+    return tuple(cache)
+
+
+def _left_pad(tensor, pad, dim):
+    """dim 축 왼쪽에 pad 칸 0 채우기"""
+    if pad <= 0:
+        return tensor
+    padding = [0, 0] * (tensor.dim() - dim - 1) + [pad, 0]
+    return F.pad(tensor, padding)
+
+
+class ContinuousBatchingEngine:
+    """스케줄러 스레드 하나가 공유 모델로 반복 단위(iteration-level) 배칭을 수행"""
+
+    def __init__(self, model, pad_token_id, max_batch_size=8, idle_wait=0.05, on_finish=None):
+        self.model = model
+        self.pad_token_id = pad_token_id
+        self.max_batch_size = max_batch_size
+        self.idle_wait = idle_wait
+        # 요청이 정상 종료될 때마다 호출 (지표 수집용, request의 *_at 시각 참고)
+        self.on_finish = on_finish
+
+        self._pending = queue.Queue()
+        self._calls = queue.Queue()  # 스케줄러 스레드에서 실행할 기타 모델 호출 (fn, Future)
+        self._thread = None
+        self._running = False
+        self._stopped = False
+
+        # 진행 중인 배치 상태 (스케줄러 스레드 전용)
+        self._rows = []
+        self._cache = None        # 레이어별 (key, value), shape (B, H, L, D)
+        self._mask = None         # (B, L) 왼쪽 패딩 attention mask
+        self._next_tokens = None  # (B,) 다음 스텝에 넣을 토큰
+
+        self.stats = {"requests": 0, "tokens": 0, "steps": 0, "max_batch": 0}
+
+    # -----------------------------
+    # 외부 API
+    # -----------------------------
+    def start(self):
+        if self._thread is not None:
+            return self
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, name="batching-engine", daemon=True)
+        self._thread.start()
+        logger.info(f"연속 배칭 엔진 시작 (최대 배치 {self.max_batch_size})")
+        return self
+
+    def stop(self):
+        """스케줄러 종료 - 대기·진행 중인 요청과 모델 호출은 오류로 끝냄 (generate 호출자가 멈춰 있지 않도록)"""
+        self._running = False
+        self._stopped = True
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        error = self._stopped_error()
+        self._fail_all(error)
+        self._fail_pending(error)
+        while True:
+            try:
+                _, future = self._calls.get_nowait()
+            except queue.Empty:
+                break
+            future.set_exception(error)
+
+    def submit(self, input_ids, **generation_kwargs):
+        """요청 등록 후 Future 반환 (결과: 프롬프트 + 생성 토큰 id 리스트)"""
+        generation_kwargs.pop("pad_token_id", None)
+        request = GenerationRequest(input_ids, **generation_kwargs)
+        self._pending.put(request)
+        if self._stopped:
+            # stop() 이후(또는 정리와 동시에) 들어온 요청
+            self._fail_pending(self._stopped_error())
+        return request.future
+
+    def generate(self, input_ids, timeout=None, **generation_kwargs):
+        return self.submit(input_ids, **generation_kwargs).result(timeout=timeout)
+
+    def call(self, fn):
+        """fn()을 스케줄러 스레드에서 디코딩 스텝 사이에 실행하고 Future 반환
+        (다중 LoRA 모델은 어댑터 선택 hook이 스레드 안전하지 않아 모든 forward를 이 스레드에서 실행)"""
+        future = Future()
+        self._calls.put((fn, future))
+        return future
+
+    @property
+    def queue_depth(self):
+        return self._pending.qsize()
+
+    @property
+    def batch_size(self):
+        """현재 함께 디코딩 중인 요청 수"""
+        return len(self._rows)
+
+    # -----------------------------
+    # 스케줄러
+    # -----------------------------
+    def _loop(self):
+        while self._running:
+            admitted = []
+            self._run_calls()
+            try:
+                admitted = self._admit()
+                if admitted:
+                    self._prefill(admitted)
+                if self._rows:
+                    self._decode_step()
+            except Exception as e:
+                logger.error(f"배칭 엔진 오류: {e}")
+                for r in admitted:
+                    r.finish(e)
+                self._fail_all(e)
+
+    def _run_calls(self):
+        while True:
+            try:
+                fn, future = self._calls.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                future.set_result(fn())
+            except Exception as e:
+                future.set_exception(e)
+
+    def _admit(self):
+        """빈 자리만큼 대기 요청을 꺼냄 (배치가 비어 있으면 잠시 대기)"""
+        admitted = []
+        free = self.max_batch_size - len(self._rows)
+        if free <= 0:
+            return admitted
+        if not self._rows:
+            try:
+                admitted.append(self._pending.get(timeout=self.idle_wait))
+            except queue.Empty:
+                return admitted
+        while len(admitted) < free:
+            try:
+                admitted.append(self._pending.get_nowait())
+            except queue.Empty:
+                break
+        return admitted
+
+    def _adapter_kwargs(self, requests):
+        """행별 어댑터가 모두 활성 어댑터면 그대로, 아니면 PEFT adapter_names로 행마다 지정"""
+        active = getattr(self.model, "active_adapter", None)
+        names = [r.adapter or active for r in requests]
+        if all(name == active for name in names):
+            return {}
+        return {"adapter_names": names}
+
+    def _forward(self, requests, input_ids, attention_mask, position_ids, cache=None):
+        past = DynamicCache.from_legacy_cache(cache) if cache is not None else None
+        with torch.no_grad():
+            outputs = self.model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=past,
+                use_cache=True,
+                **self._adapter_kwargs(requests)
+            )
+        return outputs.logits[:, -1, :], _to_legacy(outputs.past_key_values)
+
+    def _prefill(self, requests):
+        """새 요청을 prefill 한 뒤 진행 중인 배치에 합류 (캐시된 앞부분이 없는 요청은 왼쪽 패딩으로 한 번에)"""
+        now = time.perf_counter()
+        for r in requests:
+            r.admitted_at = now
+        plain = [r for r in requests if r.past_key_values is None]
+        if plain:
+            self._admit_group(plain, *self._prefill_padded(plain))
+        for r in requests:
+            if r.past_key_values is not None:
+                self._admit_group([r], *self._prefill_cached(r))
+
+    def _prefill_padded(self, requests):
+        device = self.model.device
+        width = max(len(r.input_ids) for r in requests)
+        ids = torch.full((len(requests), width), self.pad_token_id, dtype=torch.long)
+        mask = torch.zeros((len(requests), width), dtype=torch.long)
+        for i, r in enumerate(requests):
+            ids[i, width - len(r.input_ids):] = torch.tensor(r.input_ids)
+            mask[i, width - len(r.input_ids):] = 1
+        ids, mask = ids.to(device), mask.to(device)
+        position_ids = (mask.cumsum(-1) - 1).clamp(min=0)
+
+        logits, cache = self._forward(requests, ids, mask, position_ids)
+        return logits, cache, mask
+
+    def _prefill_cached(self, request):
+        """캐시된 앞부분 뒤의 토큰만 prefill"""
+        device = self.model.device
+        cached = request.past_key_values[0][0].shape[2]
+        request.prefill_tokens = len(request.input_ids) - cached
+        ids = torch.tensor([request.input_ids[cached:]], device=device)
+        mask = torch.ones((1, len(request.input_ids)), dtype=torch.long, device=device)
+        position_ids = torch.arange(cached, len(request.input_ids), device=device)[None, :]
+
+        logits, cache = self._forward([request], ids, mask, position_ids, request.past_key_values)
+        request.past_key_values = None
+        return logits, cache, mask
+
+    def _admit_group(self, requests, logits, cache, mask):
+        self.stats["requests"] += len(requests)
+
+        next_tokens, done = [], []
+        for i, r in enumerate(requests):
+            if r.streamer is not None:
+                r.streamer.put(torch.tensor([r.input_ids]))
+            token = r.sample(logits[i:i + 1])
+            next_tokens.append(token)
+            done.append(r.push(token))
+        next_tokens = torch.tensor(next_tokens, device=mask.device)
+
+        self._merge(requests, cache, mask, next_tokens)
+        self._retire(done_rows=[len(self._rows) - len(requests) + i for i, d in enumerate(done) if d])
+
+    def _merge(self, requests, cache, mask, next_tokens):
+        if not self._rows:
+            self._rows, self._cache, self._mask, self._next_tokens = list(requests), cache, mask, next_tokens
+            return
+        # 두 배치의 길이를 왼쪽 패딩으로 맞춘 뒤 배치 축으로 이어붙임
+        cur_len, new_len = self._mask.shape[1], mask.shape[1]
+        length = max(cur_len, new_len)
+        self._cache = tuple(
+            (torch.cat([_left_pad(k0, length - cur_len, 2), _left_pad(k1, length - new_len, 2)]),
+             torch.cat([_left_pad(v0, length - cur_len, 2), _left_pad(v1, length - new_len, 2)]))
+            for (k0, v0), (k1, v1) in zip(self._cache, cache)
+        )
+        self._mask = torch.cat([_left_pad(self._mask, length - cur_len, 1),
+                                _left_pad(mask, length - new_len, 1)])
+        self._next_tokens = torch.cat([self._next_tokens, next_tokens])
+        self._rows.extend(requests)
+
+    def _decode_step(self):
+        batch = len(self._rows)
+        self.stats["steps"] += 1
+        self.stats["max_batch"] = max(self.stats["max_batch"], batch)
+
+        self._mask = torch.cat([self._mask, self._mask.new_ones((batch, 1))], dim=1)
+        position_ids = self._mask.sum(dim=1, keepdim=True) - 1
+        logits, self._cache = self._forward(self._rows, self._next_tokens[:, None], self._mask, position_ids,
+                                            self._cache)
+
+        next_tokens, done_rows = [], []
+        for i, r in enumerate(self._rows):
+            token = r.sample(logits[i:i + 1])
+            next_tokens.append(token)
+            if r.push(token):
+                done_rows.append(i)
+        self._next_tokens = torch.tensor(next_tokens, device=self._mask.device)
+        self._retire(done_rows)
+
+    def _retire(self, done_rows):
+        """끝난 시퀀스를 배치에서 제거하고 결과 전달"""
+        if not done_rows:
+            return
+        done = set(done_rows)
+        for i in sorted(done):
+            r = self._rows[i]
+            self.stats["tokens"] += len(r.generated)
+            if r.cache_callback is not None:
+                self._export_cache(i, r)
+            r.finish()
+            on_finish = r.on_finish or self.on_finish
+            if on_finish is not None:
+                try:
+                    on_finish(r)
+                except Exception as e:
+                    logger.warning(f"on_finish 콜백 실패: {e}")
+
+        keep = [i for i in range(len(self._rows)) if i not in done]
+        if not keep:
+            self._reset()
+            return
+
+        index = torch.tensor(keep, device=self._mask.device)
+        self._rows = [self._rows[i] for i in keep]
+        self._mask = self._mask.index_select(0, index)
+        self._next_tokens = self._next_tokens.index_select(0, index)
+        self._cache = tuple((k.index_select(0, index), v.index_select(0, index)) for k, v in self._cache)
+
+        # 남은 모든 행에서 패딩뿐인 앞쪽 열 잘라내기
+        offset = int((self._mask.sum(dim=0) == 0).long().cumprod(dim=0).sum())
+        if offset:
+            self._mask = self._mask[:, offset:]
+            self._cache = tuple((k[:, :, offset:], v[:, :, offset:]) for k, v in self._cache)
+
+    def _export_cache(self, row, request):
+        """배치에서 한 행의 KV(패딩 제외)를 떼어 콜백에 전달"""
+        try:
+            width = self._mask.shape[1]
+            length = int(self._mask[row].sum())
+            cache = tuple((k[row:row + 1, :, width - length:], v[row:row + 1, :, width - length:])
+                          for k, v in self._cache)
+            request.cache_callback((request.input_ids + request.generated)[:length], cache)
+        except Exception as e:
+            logger.warning(f"KV 캐시 내보내기 실패: {e}")
+
+    @staticmethod
+    def _stopped_error():
+        return RuntimeError("연속 배칭 엔진이 중지되었습니다.")
+
+    def _fail_pending(self, error):
+        while True:
+            try:
+                self._pending.get_nowait().finish(error)
+            except queue.Empty:
+                return
+
+    def _fail_all(self, error):
+        for r in self._rows:
+            if not r.future.done():
+                r.finish(error)
+        self._reset()
+
+    def _reset(self):
+        self._rows, self._cache, self._mask, self._next_tokens = [], None, None, None
@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+"""
+상담 서버 성능 벤치마크 (CPU에서 작은 causal LM으로 실행 가능)
+
+사용 예:
+    python benchmark.py batching --requests 32 --batch 8
+    python benchmark.py prefix --prefix_len 600 --suffix_len 60
+    python benchmark.py session_kv --turns 8
+    python benchmark.py sessions --sessions 1000000 --store memory
+    python benchmark.py keywords --text_kb 100 --hit_rate 0.01
+    python benchmark.py cleanup --golden cleanup_golden.jsonl --adversarial_kb 100
+    python benchmark.py rag --chunks 20000 --embed_ms 20
+    python benchmark.py reports --burst 64 --unique 24 --workers 1 --queue 16
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import time
+
+# torch·transformers·numpy(와 이를 쓰는 모듈)는 필요한 벤치마크 안에서 임포트 (sessions·keywords·cleanup은 순수 Python)
+from keyword_matcher import KeywordMatcher
+from report_jobs import QueueFull, ReportJobQueue
+import response_cleanup
+from session_store import create_session_store
+
+
+def make_tiny_model(vocab_size=512, hidden_size=128, layers=4, seed=0):
+    """벤치마크용 작은 랜덤 Llama 모델"""
+    import torch
+    from transformers import LlamaConfig, LlamaForCausalLM
+
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=vocab_size,
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 2,
+        num_hidden_layers=layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        pad_token_id=0,
+        bos_token_id=1,
+        eos_token_id=2,
+    )
+    return LlamaForCausalLM(config).eval()
+
+
+def make_prompts(n, vocab_size, min_len=64, max_len=256, seed=0):
+    rng = random.Random(seed)
+    return [[1] + [rng.randrange(3, vocab_size) for _ in range(rng.randint(min_len, max_len))]
+            for _ in range(n)]
+
+
+SAMPLING = {
+    "temperature": 0.7,
+    "top_p": 0.8,
+    "top_k": 50,
+    "do_sample": True,
+    "repetition_penalty": 1.2,
+    "no_repeat_ngram_size": 3,
+}
+
+
+def bench_batching(args):
+    """요청별 model.generate(직렬) vs 연속 배칭 엔진의 누적 tokens/sec 비교"""
+    import torch
+    from batching_engine import ContinuousBatchingEngine
+
+    model = make_tiny_model(vocab_size=args.vocab)
+    prompts = make_prompts(args.requests, args.vocab)
+
+    # 직렬 경로: 기존 서버처럼 요청마다 model.generate
+    start = time.perf_counter()
+    serial_tokens = 0
+    for p in prompts:
+        ids = torch.tensor([p])
+        with torch.no_grad():
+            out = model.generate(ids, attention_mask=torch.ones_like(ids), max_new_tokens=args.new_tokens,
+                                 min_new_tokens=args.new_tokens, pad_token_id=0, **SAMPLING)
+        serial_tokens += out.shape[1] - ids.shape[1]
+    serial_time = time.perf_counter() - start
+
+    # 연속 배칭 경로: 모든 요청을 동시에 제출
+    engine = ContinuousBatchingEngine(model, pad_token_id=0, max_batch_size=args.batch).start()
+    start = time.perf_counter()
+    futures = [engine.submit(p, max_new_tokens=args.new_tokens, eos_token_id=None, **SAMPLING) for p in prompts]
+    batched_tokens = sum(len(f.result()) - len(p) for f, p in zip(futures, prompts))
+    batched_time = time.perf_counter() - start
+    engine.stop()
+
+    return {
+        "requests": args.requests,
+        "max_batch_size": args.batch,
+        "serial_tokens_per_sec": round(serial_tokens / serial_time, 1),
+        "batched_tokens_per_sec": round(batched_tokens / batched_time, 1),
+        "speedup": round((batched_tokens / batched_time) / (serial_tokens / serial_time), 2),
+        "engine_stats": engine.stats,
+    }
+
+
+def first_token(model, ids, past=None):
+    """ids 다음 토큰 (greedy, past: 앞부분 KV)"""
+    import torch
+    from kv_cache import to_dynamic_cache
+
+    start = past[0][0].shape[2] if past is not None else 0
+    x = torch.tensor([ids[start:]])
+    with torch.no_grad():
+        out = model(
+            input_ids=x,
+            attention_mask=torch.ones((1, len(ids)), dtype=torch.long),
+            position_ids=torch.arange(start, len(ids))[None, :],
+            past_key_values=to_dynamic_cache(past) if past is not None else None,
+            use_cache=True,
+        )
+    return int(out.logits[0, -1].argmax())
+
+
+def bench_prefix(args):
+    """고정 시스템 프롬프트 prefix KV 재사용 여부에 따른 TTFT(첫 토큰까지 시간) 비교"""
+    from kv_cache import crop_cache, prefill
+
+    model = make_tiny_model(vocab_size=args.vocab, hidden_size=256, layers=8)
+    rng = random.Random(0)
+    prefix = [1] + [rng.randrange(3, args.vocab) for _ in range(args.prefix_len)]
+    cached = prefill(model, prefix)
+
+    full, reused = [], []
+    for _ in range(args.repeats):
+        ids = prefix + [rng.randrange(3, args.vocab) for _ in range(args.suffix_len)]
+        t0 = time.perf_counter()
+        a = first_token(model, ids)
+        full.append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        b = first_token(model, ids, crop_cache(cached, len(prefix)))
+        reused.append(time.perf_counter() - t0)
+        assert a == b, "prefix 캐시 사용 시 첫 토큰이 달라졌습니다"
+
+    full_ms = 1000 * sorted(full)[len(full) // 2]
+    reused_ms = 1000 * sorted(reused)[len(reused) // 2]
+    return {
+        "prefix_tokens": len(prefix),
+        "suffix_tokens": args.suffix_len,
+        "prefill_tokens_saved_ratio": round(len(prefix) / (len(prefix) + args.suffix_len), 3),
+        "ttft_full_prefill_ms": round(full_ms, 2),
+        "ttft_prefix_cached_ms": round(reused_ms, 2),
+        "speedup": round(full_ms / reused_ms, 2),
+    }
+
+
+def bench_session_kv(args):
+    """
+    세션 KV 캐시의 턴별 재사용 토큰 수 - 생성한 토큰의 KV를 그대로 저장 vs 다음 턴 렌더링 형태로 맞춰 저장
+    실제 토크나이저·chat template·ContextBuilder로 대화를 진행하고, 턴마다 메모(감정·참고 자료)와
+    생성 토큰과 다른 정리된 응답을 사용합니다.
+    """
+    import torch
+    from transformers import AutoTokenizer
+    from context_builder import ContextBuilder
+    from kv_cache import SessionKVCache, replay_cache, to_dynamic_cache, to_legacy_cache
+
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+    model = make_tiny_model(vocab_size=len(tokenizer))
+    builder = ContextBuilder(tokenizer, budget=args.budget, max_turns=args.turns)
+    system = "상담 답변을 2~4문장 이내로 작성하세요. 공감 능력이 뛰어나고 전문적인 심리상담사입니다.\n" * 8
+
+    result = {}
+    for mode in ("generated", "replayed"):
+        rng = random.Random(0)  # 두 방식 모두 같은 대화
+        cache = SessionKVCache()
+        history, prompt_tokens, reused_tokens = [], [], []
+        for _ in range(args.turns):
+            user = random_hangul(rng, 20)
+            notes = [f"사용자가 느끼는 주요 감정: {rng.choice(['불안', '우울', '분노', '외로움'])}",
+                     f"참고 자료:\n{random_hangul(rng, 40)}"]
+            _, inputs, context = builder.build(system, history, user, notes)
+            ids = inputs["input_ids"][0].tolist()
+            past, reused = cache.lookup("session", ids)
+            if past is not None:
+                assert first_token(model, ids, past) == first_token(model, ids), "세션 KV 사용 시 첫 토큰이 달라졌습니다"
+
+            kwargs = {"past_key_values": to_dynamic_cache(past)} if past is not None else {}
+            with torch.no_grad():
+                out = model.generate(**inputs, max_new_tokens=args.new_tokens, min_new_tokens=args.new_tokens,
+                                     do_sample=False, pad_token_id=0, return_dict_in_generate=True, **kwargs)
+            legacy = to_legacy_cache(out.past_key_values)
+            token_ids = out.sequences[0][:legacy[0][0].shape[2]].tolist()
+
+            reply = random_hangul(rng, 30)  # 정리·페르소나 후처리를 거쳐 저장되는 응답 (생성 토큰과 다름)
+            record = {"user": user, "assistant": reply, "context": builder.annotate(user, reply, "불안")}
+            if mode == "generated":
+                cache.store("session", token_ids, legacy)
+            else:
+                replay_ids = builder.replay_ids(ids, context["history_tokens"], context["turns"], record["context"])
+                cache.store("session", replay_ids, replay_cache(model, token_ids, legacy, replay_ids))
+            history.append(record)
+            prompt_tokens.append(len(ids))
+            reused_tokens.append(reused)
+
+        result["prompt_tokens"] = prompt_tokens
+        result[f"reused_tokens_{mode}"] = reused_tokens
+        result[f"reuse_ratio_{mode}"] = round(sum(reused_tokens) / sum(prompt_tokens), 3)
+    return result
+
+
+def current_rss_mb():
+    """현재 RSS (Linux는 /proc, 그 외에는 최대 RSS)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_sessions(args):
+    """세션 저장소 부하 테스트 - 세션 수가 늘어도 메모리가 상한 안에 머무는지 확인"""
+    kwargs = {"max_sessions": args.max_sessions} if args.store == "memory" else {}
+    store = create_session_store(args.store, **kwargs)
+    record = {"user": "요즘 잠을 잘 못 자요. " * 4, "assistant": "많이 지치셨겠어요. " * 6}
+
+    samples = []
+    baseline = current_rss_mb()
+    start = time.perf_counter()
+    checkpoint = max(1, args.sessions // 10)
+    for i in range(args.sessions):
+        session_id = f"load-{i}"
+        store.save_session(session_id, {"stage": "initial", "turn_count": 1, "emotions": ["불안"],
+                                        "persona": "empathetic"})
+        for _ in range(args.turns):
+            store.append_turn(session_id, record)
+        store.recent_turns(session_id, 6)
+        if (i + 1) % checkpoint == 0:
+            samples.append({"sessions": i + 1, "rss_mb": round(current_rss_mb() - baseline, 1)})
+    elapsed = time.perf_counter() - start
+
+    return {
+        "store": args.store,
+        "sessions_written": args.sessions,
+        "sessions_retained": len(store),
+        "ops_per_sec": round(args.sessions * (args.turns + 2) / elapsed, 1),
+        "rss_growth_mb": samples,
+    }
+
+
+def random_hangul(rng, length):
+    return "".join(chr(0xAC00 + rng.randrange(11172)) for _ in range(length))
+
+
+def bench_keywords(args):
+    """카테고리별 `keyword in text` 반복 vs 단일 패스 KeywordMatcher (상담 기록 약 text_kb KB)"""
+    rng = random.Random(0)
+    # 리포트 서버 사전과 같은 규모: 12개 카테고리, 카테고리당 3~7개, 1~5글자
+    categories = {f"category-{i}": [random_hangul(rng, rng.randint(1, 5)) for _ in range(rng.randint(3, 7))]
+                  for i in range(args.categories)}
+    keywords = [k for words in categories.values() for k in words]
+
+    chunks, size = [], 0
+    while size < args.text_kb * 1024:
+        chunk = rng.choice(keywords) if rng.random() < args.hit_rate else random_hangul(rng, 8) + " "
+        chunks.append(chunk)
+        size += len(chunk.encode("utf-8"))
+    text = "".join(chunks)
+
+    def legacy(text):
+        return [c for c, words in categories.items() if any(k in text for k in words)]
+
+    def legacy_counts(text):
+        return {c: sum(text.count(k) for k in words) for c, words in categories.items()}
+
+    matcher = KeywordMatcher(categories)
+    assert legacy(text) == list(matcher.scan(text)), "매칭된 카테고리가 기존 방식과 다릅니다"
+
+    def timed(fn):
+        samples = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            fn(text)
+            samples.append(time.perf_counter() - start)
+        return round(1000 * sorted(samples)[len(samples) // 2], 3)
+
+    hits = matcher.scan(text)
+    return {
+        "text_bytes": len(text.encode("utf-8")),
+        "keywords": len(keywords),
+        "keyword_occurrences": sum(h["count"] for h in hits.values()),
+        "legacy_presence_ms": timed(legacy),
+        "legacy_counts_ms": timed(legacy_counts),
+        "matcher_scan_ms": timed(matcher.scan),
+    }
+
+
+CLEANUP_FUNCTIONS = ["simple_clean_response", "remove_unwanted_patterns", "remove_client_dialogue", "clean_response"]
+
+
+def adversarial_inputs(size):
+    """역추적을 유도하는 긴 입력 (숫자 나열 뒤 줄바꿈, 닫히지 않은 괄호, 마침표 없는 문장 등)"""
+    n = size // 2
+    return {
+        "number_run_then_newline": ("1 " * n)[:size] + "\nx",
+        "dash_digits_then_newline": ("- 1" * n)[:size] + "\nx",
+        "long_number_then_newline": "1" * size + " 2\nx",
+        "whitespace_run": " " * size + "x\ny",
+        "unclosed_angle": "<" * size,
+        "unclosed_bracket": "[" * size,
+        "client_no_period": ("사용자 " * n)[:size] + "속으로는",
+        "no_repetition": "".join(chr(0xAC00 + (i * 7919) % 11172) for i in range(size)),
+    }
+
+
+def bench_cleanup(args):
+    """응답 후처리: 골든 코퍼스 결과 일치 확인, 응답당 비용, 긴 악성 입력 최악 시간"""
+    with open(args.golden, encoding="utf-8") as f:
+        corpus = [json.loads(line) for line in f]
+
+    mismatches = [(case["input"], name) for case in corpus for name in CLEANUP_FUNCTIONS
+                  if getattr(response_cleanup, name)(case["input"]) != case[name]]
+    assert not mismatches, f"골든 코퍼스와 다른 결과: {mismatches[:3]}"
+
+    per_response = {}
+    for name in CLEANUP_FUNCTIONS:
+        fn = getattr(response_cleanup, name)
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            for case in corpus:
+                fn(case["input"])
+        per_response[name] = round(1e6 * (time.perf_counter() - start) / (args.repeats * len(corpus)), 1)
+
+    worst = {}
+    for label, text in adversarial_inputs(args.adversarial_kb * 1024).items():
+        for name in CLEANUP_FUNCTIONS:
+            start = time.perf_counter()
+            getattr(response_cleanup, name)(text)
+            elapsed = 1000 * (time.perf_counter() - start)
+            if elapsed > worst.get(name, (0, None))[0]:
+                worst[name] = (round(elapsed, 2), label)
+
+    return {
+        "golden_cases": len(corpus),
+        "golden_identical": True,
+        "per_response_us": per_response,
+        "adversarial_chars": args.adversarial_kb * 1024,
+        "worst_case_ms": {name: {"ms": ms, "input": label} for name, (ms, label) in worst.items()},
+    }
+
+
+class InMemoryCollection:
+    """Chroma 컬렉션의 get/query 중 RAGRetriever가 쓰는 부분만 흉내 낸 메모리 컬렉션"""
+
+    def __init__(self, embeddings, metadatas):
+        import torch
+        from rag_retriever import RELEVANCE_KEY
+
+        self.embeddings = embeddings
+        self.metadatas = metadatas
+        self.relevant = torch.tensor([m[RELEVANCE_KEY] for m in metadatas])
+
+    def get(self, where, limit, include):
+        import torch
+
+        return {"ids": [str(i) for i in torch.nonzero(self.relevant).flatten()[:limit].tolist()]}
+
+    def query(self, query_embeddings, n_results, where, include):
+        import torch
+
+        scores = self.embeddings @ torch.tensor(query_embeddings[0])
+        scores[~self.relevant] = float("-inf")
+        top = torch.topk(scores, n_results).indices.tolist()
+        return {"ids": [[str(i) for i in top]], "metadatas": [[self.metadatas[i] for i in top]]}
+
+
+def bench_rag(args):
+    """RAG 검색: 처음 질문 vs 반복 질문 vs 표기만 다른 질문 지연 (임베딩은 embed_ms 지연으로 대체)"""
+    import torch
+    from rag_retriever import CONTEXT_KEY, RELEVANCE_KEY, RAGRetriever
+
+    torch.manual_seed(0)
+    embeddings = torch.nn.functional.normalize(torch.randn(args.chunks, args.dim), dim=1)
+    metadatas = [{RELEVANCE_KEY: i % 3 != 0, CONTEXT_KEY: f"상담 발췌 {i}"} for i in range(args.chunks)]
+    collection = InMemoryCollection(embeddings, metadatas)
+
+    def embed_query(text):
+        time.sleep(args.embed_ms / 1000)
+        generator = torch.Generator().manual_seed(hash(text) % (2 ** 31))
+        return torch.randn(args.dim, generator=generator).tolist()
+
+    retriever = RAGRetriever(collection, embed_query, top_k=args.top_k)
+    questions = [f"요즘 {i}번째 고민 때문에 잠을 잘 못 자요" for i in range(args.questions)]
+    variants = {
+        "cold": questions,
+        "repeat": questions,
+        "near_repeat": [f"  {q.replace(' ', '  ')}!! " for q in questions],
+    }
+
+    latency = {}
+    for label, batch in variants.items():
+        samples = []
+        for question in batch:
+            start = time.perf_counter()
+            retriever.retrieve(question)
+            samples.append(time.perf_counter() - start)
+        samples.sort()
+        latency[label] = {"p50_us": round(1e6 * samples[len(samples) // 2], 1),
+                          "p99_us": round(1e6 * samples[int(len(samples) * 0.99)], 1)}
+
+    return {"chunks": args.chunks, "dim": args.dim, "embed_ms": args.embed_ms,
+            "latency": latency, "cache": retriever.stats()}
+
+
+def bench_reports(args):
+    """리포트 작업 큐: 동시 버스트 요청의 중복 병합·거부(429) 수, 처리량, 완료 지연 p50/p99 (작은 모델로 대체)"""
+    import torch
+
+    model = make_tiny_model(vocab_size=args.vocab)
+    histories = make_prompts(args.unique, args.vocab)
+
+    def generate_report(payload):
+        ids = torch.tensor([histories[payload["history"]]])
+        with torch.no_grad():
+            model.generate(ids, attention_mask=torch.ones_like(ids), max_new_tokens=args.new_tokens,
+                           min_new_tokens=args.new_tokens, pad_token_id=0, **SAMPLING)
+        return {"success": True}
+
+    jobs = ReportJobQueue(generate_report, workers=args.workers, max_queue=args.queue)
+    rng = random.Random(0)
+    accepted, rejected = {}, 0
+    start = time.perf_counter()
+    for _ in range(args.burst):
+        history = rng.randrange(args.unique)
+        try:
+            job, _ = jobs.submit(("2026-01-01", history), {"history": history})
+            accepted[job.job_id] = job
+        except QueueFull:
+            rejected += 1
+    for job in accepted.values():
+        job.finished.wait()
+    elapsed = time.perf_counter() - start
+    jobs.stop()
+
+    latencies = sorted(job.finished_at - job.submitted_at for job in accepted.values())
+    return {
+        "burst_requests": args.burst,
+        "unique_histories": args.unique,
+        "workers": args.workers,
+        "max_queue": args.queue,
+        "generated": len(accepted),
+        "rejected_429": rejected,
+        "reports_per_sec": round(len(accepted) / elapsed, 2),
+        "latency_p50_s": round(latencies[len(latencies) // 2], 3),
+        "latency_p99_s": round(latencies[int(len(latencies) * 0.99)], 3),
+        "queue_stats": jobs.stats(),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("batching", help="연속 배칭 처리량 비교")
+    p.add_argument("--requests", type=int, default=32)
+    p.add_argument("--batch", type=int, default=8)
+    p.add_argument("--new_tokens", type=int, default=64)
+    p.add_argument("--vocab", type=int, default=512)
+    p.set_defaults(func=bench_batching)
+
+    p = sub.add_parser("prefix", help="prefix KV 캐시 TTFT 비교")
+    p.add_argument("--prefix_len", type=int, default=600)
+    p.add_argument("--suffix_len", type=int, default=60)
+    p.add_argument("--repeats", type=int, default=10)
+    p.add_argument("--vocab", type=int, default=512)
+    p.set_defaults(func=bench_prefix)
+
+    p = sub.add_parser("session_kv", help="세션 KV 캐시 턴별 재사용 토큰 수 (생성 토큰 저장 vs 다음 턴 형태로 저장)")
+    p.add_argument("--turns", type=int, default=8)
+    p.add_argument("--new_tokens", type=int, default=16)
+    p.add_argument("--budget", type=int, default=2048)
+    p.add_argument("--tokenizer", default=os.path.dirname(os.path.abspath(__file__)))
+    p.set_defaults(func=bench_session_kv)
+
+    p = sub.add_parser("sessions", help="세션 저장소 메모리 상한 부하 테스트")
+    p.add_argument("--store", default="memory", help="memory | sqlite:///경로")
+    p.add_argument("--sessions", type=int, default=200000)
+    p.add_argument("--turns", type=int, default=3)
+    p.add_argument("--max_sessions", type=int, default=10000)
+    p.set_defaults(func=bench_sessions)
+
+    p = sub.add_parser("keywords", help="감정/위험/동기 키워드 매칭 속도 비교")
+    p.add_argument("--text_kb", type=int, default=100)
+    p.add_argument("--hit_rate", type=float, default=0.01, help="토막당 키워드가 들어갈 확률")
+    p.add_argument("--categories", type=int, default=12)
+    p.add_argument("--repeats", type=int, default=20)
+    p.set_defaults(func=bench_keywords)
+
+    p = sub.add_parser("cleanup", help="응답 후처리 골든 코퍼스 확인 및 속도 측정")
+    p.add_argument("--golden", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "cleanup_golden.jsonl"))
+    p.add_argument("--repeats", type=int, default=20)
+    p.add_argument("--adversarial_kb", type=int, default=100)
+    p.set_defaults(func=bench_cleanup)
+
+    p = sub.add_parser("rag", help="RAG 질의 임베딩/검색 결과 캐시 지연 비교")
+    p.add_argument("--chunks", type=int, default=20000)
+    p.add_argument("--dim", type=int, default=768)
+    p.add_argument("--embed_ms", type=float, default=20, help="질의 임베딩 1회 지연 (모델 대신 sleep)")
+    p.add_argument("--top_k", type=int, default=2)
+    p.add_argument("--questions", type=int, default=200)
+    p.set_defaults(func=bench_rag)
+
+    p = sub.add_parser("reports", help="리포트 작업 큐 버스트 부하 (처리량, p99, 429)")
+    p.add_argument("--burst", type=int, default=64, help="동시에 들어오는 리포트 요청 수")
+    p.add_argument("--unique", type=int, default=24, help="서로 다른 (날짜, 채팅 내역) 수")
+    p.add_argument("--workers", type=int, default=1)
+    p.add_argument("--queue", type=int, default=16)
+    p.add_argument("--new_tokens", type=int, default=64)
+    p.add_argument("--vocab", type=int, default=512)
+    p.set_defaults(func=bench_reports)
+
+    args = ap.parse_args()
+    result = args.func(args)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+BM25 희소 색인 조회 (dont/ingest.py가 만든 색인을 메모리 매핑으로 읽기)
+색인 형식과 토큰화는 dont/bm25.py와 동일해야 하며, meta.json의 format/tokenizer로 확인합니다.
+"""
+
+import bisect
+import json
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import numpy as np
+
+# dont/bm25.py와 동일해야 함
+FORMAT_VERSION = 1
+TOKENIZER = "hangul-bigram-v1"
+MAX_TOKEN_LENGTH = 32
+RRF_K = 60
+
+TOKEN_PATTERN = re.compile(r"[가-힣]+|[^\W_가-힣]+")
+
+
+def tokenize(text):
+    """한글 구간은 음절 bigram, 그 외(영문·숫자)는 단어 그대로"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    tokens = []
+    for run in TOKEN_PATTERN.findall(text):
+        if "가" <= run[0] <= "힣" and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run[:MAX_TOKEN_LENGTH])
+    return tokens
+
+
+def rrf_fuse(rankings, top_k, k=RRF_K):
+    """reciprocal-rank fusion: 각 순위 목록에서 1 / (k + 순위)를 더해 정렬"""
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, 1):
+            fused[chunk_id] += 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: -item[1])[:top_k]
+
+
+class TermTable:
+    """terms.bin을 메모리 매핑해 i번째 용어(UTF-8 바이트)를 돌려주는 정렬된 시퀀스 (bisect용)"""
+
+    def __init__(self, path):
+        self.offsets = np.load(Path(path) / "term_offsets.npy", mmap_mode="r")
+        size = int(self.offsets[-1])
+        self.blob = np.memmap(Path(path) / "terms.bin", dtype=np.uint8, mode="r") if size else np.zeros(0, np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+
+class BM25Index:
+    """메모리 매핑한 BM25 색인 (allowed_ids를 주면 그 청크만 검색)"""
+
+    def __init__(self, index_dir, allowed_ids=None):
+        index_dir = Path(index_dir)
+        pointer = index_dir / "CURRENT"
+        if not pointer.exists():
+            raise FileNotFoundError(f"BM25 색인이 없습니다: {index_dir}")
+        path = index_dir / pointer.read_text(encoding="utf-8").strip()
+        with open(path / "meta.json", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta["format"] != FORMAT_VERSION or self.meta["tokenizer"] != TOKENIZER:
+            raise ValueError(f"BM25 색인 형식이 다릅니다 ({self.meta['format']}, {self.meta['tokenizer']})")
+
+        self.path = path
+        self.terms = TermTable(path)
+        self.offsets = np.load(path / "offsets.npy", mmap_mode="r")
+        self.docs = np.load(path / "docs.npy", mmap_mode="r")
+        self.tfs = np.load(path / "tfs.npy", mmap_mode="r")
+        self.norms = np.load(path / "norms.npy", mmap_mode="r")
+        self.ids = np.load(path / "ids.npy", mmap_mode="r")
+        self.n_docs = self.meta["n_docs"]
+
+        self.allowed = None
+        if allowed_ids is not None:
+            self.allowed = np.isin(self.ids, np.asarray([i.encode("ascii") for i in allowed_ids], dtype=np.bytes_))
+
+    def term_id(self, term):
+        key = term.encode("utf-8")
+        i = bisect.bisect_left(self.terms, key)
+        return i if i < len(self.terms) and self.terms[i] == key else -1
+
+    def search(self, query, top_k):
+        """(청크 id, BM25 점수) 목록 (점수 순)"""
+        if not self.n_docs:
+            return []
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        k1 = self.meta["k1"]
+        for term, qtf in Counter(tokenize(query)).items():
+            i = self.term_id(term)
+            if i < 0:
+                continue
+            start, end = self.offsets[i], self.offsets[i + 1]
+            docs = self.docs[start:end]
+            tfs = self.tfs[start:end].astype(np.float32)
+            df = end - start
+            idf = np.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5))
+            scores[docs] += qtf * idf * tfs * (k1 + 1) / (tfs + self.norms[docs])
+        if self.allowed is not None:
+            scores[~self.allowed] = 0.0
+
+        hits = np.flatnonzero(scores)
+        if len(hits) > top_k:
+            hits = hits[np.argpartition(-scores[hits], top_k)[:top_k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [(self.ids[d].decode("ascii"), float(scores[d])) for d in hits]
+
+    def stats(self):
+        return {key: self.meta[key] for key in ("n_docs", "n_terms", "n_postings", "tokenizer")}
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+토큰 예산 기반 상담 프롬프트 구성
+시스템 프롬프트 + 들어가는 만큼의 최근 대화 + 현재 사용자 메시지를 토큰 예산 안에 채웁니다.
+- 저장하는 대화 기록마다 토큰 id(와 요약 한 줄)를 계산해 기록에 함께 보관하고, 시스템 프롬프트 구간의 토큰 id는
+  페르소나·단계별로 캐시하므로 턴마다 새로 토큰화하는 것은 메모와 이번 메시지뿐입니다
+  (input_ids는 시스템 프롬프트 + 이전 대화 + 이번 메시지 구간의 id를 이어 붙여 만듦)
+- 예산에서 밀려난 오래된 대화는 선택적으로 요약 줄로 대신합니다 (summary_tokens > 0)
+- 턴마다 달라지는 내용(요약, 감정, 참고 자료 등 메모)은 이전 대화 뒤, 마지막 사용자 메시지 앞에 붙여
+  시스템 프롬프트와 이전 대화 구간은 다음 턴에도 같은 토큰으로 렌더링됩니다 (세션 KV 캐시 재사용)
+- 오른쪽을 자르는 truncation을 쓰지 않고, 넘치면 요약 → 오래된 대화 → 사용자 메시지 앞부분 순으로 줄여
+  생성 프롬프트(끝부분)는 항상 남깁니다
+"""
+
+import logging
+import re
+
+from transformers import BatchEncoding
+
+logger = logging.getLogger(__name__)
+
+# 대화 구간의 토큰 id는 고정된 앞부분 뒤에 붙여 토큰화한 뒤 앞부분을 떼어 계산 (경계에서 합쳐지는 토큰까지 실제와 같게)
+# - 이전 턴 뒤에 오는 구간: ANCHOR_TURN 뒤, 시스템 프롬프트 바로 뒤에 오는 첫 턴: ANCHOR_SYSTEM 시스템 프롬프트 뒤
+ANCHOR_TURN = [{"role": "user", "content": "."}, {"role": "assistant", "content": "."}]
+ANCHOR_SYSTEM = "."
+PLACEHOLDER = "<<MESSAGE>>"
+MAX_PREFIXES = 64
+SUMMARY_HEADER = "이전 대화 요약 (오래된 순):"
+MESSAGE_HEADER = "내담자 메시지:"
+SUMMARY_CHARS = 60
+FIRST_SENTENCE = re.compile(r'(?<=[.!?])\s+|\n+')
+
+
+def summarize_turn(user_message, emotion):
+    """요약 한 줄 (내담자 메시지 첫 문장 + 감지된 감정, 모델 호출 없음)"""
+    first = FIRST_SENTENCE.split(user_message.strip(), maxsplit=1)[0]
+    if len(first) > SUMMARY_CHARS:
+        first = first[:SUMMARY_CHARS].rstrip() + "…"
+    return f"내담자({emotion}): {first}"
+
+
+class ContextBuilder:
+    """토큰 예산 안에서 chat 메시지 구성 (프롬프트 토큰 수는 항상 budget 이하)"""
+
+    def __init__(self, tokenizer, budget=2048, max_turns=6, summary_tokens=0, summary_turns=20):
+        self.tokenizer = tokenizer
+        self.budget = budget
+        self.max_turns = max_turns
+        self.summary_tokens = summary_tokens
+        self.summary_turns = summary_turns
+        self._prefixes = {}  # system_message -> 시스템 프롬프트 구간 토큰 id
+        self._turn_anchor = len(self.tokenizer(self._render(ANCHOR_TURN))["input_ids"])
+        self._first_anchor = len(self.tokenizer(self.system_prefix(ANCHOR_SYSTEM))["input_ids"])
+
+    @property
+    def scan_turns(self):
+        """세션 저장소에서 읽을 최근 기록 수 (요약을 쓰면 그만큼 더 읽음)"""
+        return self.max_turns + (self.summary_turns if self.summary_tokens > 0 else 0)
+
+    def _render(self, messages, add_generation_prompt=False):
+        return self.tokenizer.apply_chat_template(messages, tokenize=False,
+                                                  add_generation_prompt=add_generation_prompt)
+
+    def _count(self, text):
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def system_prefix(self, system_message):
+        """렌더링된 프롬프트에서 첫 사용자 메시지 앞까지의 텍스트 (시스템 프롬프트 구간)"""
+        text = self._render([{"role": "system", "content": system_message}, {"role": "user", "content": PLACEHOLDER}])
+        return text[:text.index(PLACEHOLDER)]
+
+    def _prefix_ids(self, system_message):
+        ids = self._prefixes.get(system_message)
+        if ids is None:
+            if len(self._prefixes) >= MAX_PREFIXES:
+                self._prefixes.clear()
+            ids = self._prefixes[system_message] = self.tokenizer(self.system_prefix(system_message))["input_ids"]
+        return ids
+
+    def _segment_ids(self, messages, first, add_generation_prompt=False):
+        """messages 구간이 시스템 프롬프트 바로 뒤(first) 또는 이전 턴 뒤에 렌더링될 때의 토큰 id"""
+        if first:
+            anchor, messages = self._first_anchor, [{"role": "system", "content": ANCHOR_SYSTEM}] + messages
+        else:
+            anchor, messages = self._turn_anchor, ANCHOR_TURN + messages
+        return self.tokenizer(self._render(messages, add_generation_prompt))["input_ids"][anchor:]
+
+    def turn_ids(self, user_message, assistant_message, first=False):
+        """대화 한 턴(사용자 + 상담사)이 프롬프트에서 차지하는 토큰 id"""
+        turn = [{"role": "user", "content": user_message}, {"role": "assistant", "content": assistant_message}]
+        return self._segment_ids(turn, first)
+
+    def annotate(self, user_message, assistant_message, emotion):
+        """대화 기록에 함께 저장할 토큰 id·요약 (저장 시 한 번만 계산, first_ids는 시스템 프롬프트 바로 뒤에 올 때)"""
+        ids = self.turn_ids(user_message, assistant_message)
+        summary = summarize_turn(user_message, emotion)
+        return {
+            "tokens": len(ids),
+            "ids": ids,
+            "first_ids": self.turn_ids(user_message, assistant_message, first=True),
+            "summary": summary,
+            "summary_tokens": self._count(f"- {summary}\n")
+        }
+
+    def _context(self, record):
+        # 이 기능 이전에 저장된 기록(토큰 id 없음)은 그때그때 계산
+        context = record.get("context")
+        if context is None or "ids" not in context:
+            context = self.annotate(record["user"], record["assistant"], record.get("detected_emotion", "혼란스러운"))
+        return context
+
+    def _user_content(self, user_message, notes):
+        if notes:
+            return "\n\n".join(notes) + f"\n\n{MESSAGE_HEADER}\n{user_message}"
+        return user_message
+
+    def _messages(self, system_message, turns, user_message, notes=()):
+        messages = [{"role": "system", "content": system_message}]
+        for record in turns:
+            messages.append({"role": "user", "content": record["user"]})
+            messages.append({"role": "assistant", "content": record["assistant"]})
+        messages.append({"role": "user", "content": self._user_content(user_message, notes)})
+        return messages
+
+    def _message_ids(self, user_message, notes, first):
+        """메모 + 이번 사용자 메시지 + 생성 프롬프트 구간의 토큰 id"""
+        message = [{"role": "user", "content": self._user_content(user_message, notes)}]
+        return self._segment_ids(message, first, add_generation_prompt=True)
+
+    def _summary_lines(self, dropped, available):
+        """밀려난 기록 중 최근 것부터 요약 예산 안에 드는 만큼 (오래된 순으로 반환)"""
+        limit = min(self.summary_tokens, available) - self._count(SUMMARY_HEADER)
+        lines, used = [], 0
+        for record in reversed(dropped):
+            context = self._context(record)
+            if used + context["summary_tokens"] > limit:
+                break
+            lines.insert(0, context["summary"])
+            used += context["summary_tokens"]
+        return lines
+
+    def build(self, system_message, history, user_message, notes=()):
+        """
+        history(오래된 순 기록)에서 예산 안에 드는 최근 대화를 골라 (formatted_prompt, inputs, 통계) 반환
+        notes: 이번 턴에만 쓰는 메모 문단들 (마지막 사용자 메시지 앞에 붙음)
+        통계의 history_tokens·turns는 replay_ids에 넘길 이전 대화 구간 정보 (시스템 프롬프트 포함 토큰 수, 턴 수)
+        """
+        notes = list(notes)
+        # 새로 토큰화하는 것은 메모 + 현재 메시지 구간뿐 (시스템 프롬프트는 캐시, 이전 대화는 기록에 저장된 id)
+        prefix_ids = self._prefix_ids(system_message)
+        available = self.budget - len(prefix_ids) - len(self._message_ids(user_message, notes, first=False))
+
+        turns = []
+        for record in reversed(history[-self.max_turns:] if self.max_turns > 0 else []):
+            tokens = self._context(record)["tokens"]
+            if tokens > available:
+                break
+            turns.insert(0, record)
+            available -= tokens
+
+        dropped = history[:len(history) - len(turns)]
+        summary = self._summary_lines(dropped, available) if self.summary_tokens > 0 and dropped else []
+
+        # 첫 턴은 시스템 프롬프트 바로 뒤라 토큰이 조금 다를 수 있어 최종 길이로 확인 (넘치면 요약 → 오래된 대화 → 메시지 앞부분)
+        user_ids, keep, trimmed = None, None, False
+        while True:
+            prompt_notes = notes
+            if summary:
+                prompt_notes = [f"{SUMMARY_HEADER}\n" + "\n".join(f"- {line}" for line in summary)] + notes
+            input_ids = list(prefix_ids)
+            for i, record in enumerate(turns):
+                input_ids += self._context(record)["first_ids" if i == 0 else "ids"]
+            history_tokens = len(input_ids)
+            input_ids += self._message_ids(user_message, prompt_notes, first=not turns)
+            excess = len(input_ids) - self.budget
+            if excess <= 0:
+                break
+            if summary:
+                summary.pop(0)
+            elif turns:
+                turns.pop(0)
+            else:
+                if user_ids is None:
+                    user_ids = self.tokenizer(user_message, add_special_tokens=False)["input_ids"]
+                    keep = len(user_ids)
+                keep -= excess
+                if keep <= 0:
+                    raise ValueError(f"시스템 프롬프트와 메모만으로 토큰 예산({self.budget})을 넘습니다.")
+                user_message = self.tokenizer.decode(user_ids[-keep:], skip_special_tokens=True)
+                trimmed = True
+
+        if trimmed:
+            logger.warning(f"사용자 메시지가 토큰 예산({self.budget})을 넘어 앞부분을 잘랐습니다.")
+        messages = self._messages(system_message, turns, user_message, prompt_notes)
+        formatted_prompt = self._render(messages, add_generation_prompt=True)
+        if logger.isEnabledFor(logging.DEBUG):
+            # 디버그 확인: 이어 붙인 id가 전체 프롬프트를 한 번에 토큰화한 결과와 같은지
+            full_ids = self.tokenizer(formatted_prompt)["input_ids"]
+            if full_ids != input_ids:
+                logger.warning(f"구간별 토큰 id가 전체 토큰화와 다릅니다 ({len(input_ids)} vs {len(full_ids)}) - 전체 토큰화 결과 사용")
+                input_ids = full_ids
+        inputs = BatchEncoding({"input_ids": [input_ids], "attention_mask": [[1] * len(input_ids)]}, tensor_type="pt")
+        return formatted_prompt, inputs, {
+            "prompt_tokens": len(input_ids),
+            "turns": len(turns),
+            "summarized": len(summary),
+            "trimmed": trimmed,
+            "history_tokens": history_tokens
+        }
+
+    def replay_ids(self, input_ids, history_tokens, turns, context):
+        """
+        이번 턴이 다음 턴 프롬프트에서 이전 대화로 렌더링될 토큰 id (다시 토큰화하지 않음)
+        = 이번 프롬프트의 이전 대화 구간(build 통계의 history_tokens) + 저장한 기록(annotate 결과)의 턴 토큰 id
+        """
+        return list(input_ids[:history_tokens]) + context["first_ids" if turns == 0 else "ids"]
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+LoRA 병합 모델 내보내기 (선택: int8 / int4 가중치 전용 양자화)
+
+서버는 부팅할 때마다 베이스 모델을 올린 뒤 PeftModel로 어댑터를 감싸고, 병합하지 않은 LoRA는
+디코딩 스텝마다 q/v/o_proj에 어댑터 행렬곱을 더합니다. 이 스크립트는 어댑터를 베이스 가중치에 합쳐
+safetensors 체크포인트 + 토크나이저 + export_metadata.json으로 한 번만 저장합니다.
+서버는 CHAT_MERGED_MODEL / REPORT_MERGED_MODEL에 이 경로를 주면 PEFT 없이 safetensors를 메모리 매핑으로 바로 읽습니다.
+
+- --quantize int8 | int4: bitsandbytes 가중치 전용 양자화 (CUDA 필요, 메모리 절감용)
+- --verify: CPU float32로 원본(베이스 + 어댑터)과 내보낸 모델의 logits·greedy 토큰을 비교하고
+  로딩 시간과 토큰당 디코딩 시간을 함께 출력
+- --tiny: 작은 랜덤 모델 + 랜덤 LoRA를 만들어 내보내기 (CPU에서 --verify 확인용)
+
+사용 예:
+    python export_model.py --output exported/midm-merged
+    python export_model.py --output exported/midm-merged-int4 --quantize int4
+    python export_model.py --tiny --output /tmp/tiny-merged --dtype float32 --verify
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+from report_cache import adapter_fingerprint
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+METADATA_FILE = "export_metadata.json"
+DTYPES = ("float16", "bfloat16", "float32")
+
+VERIFY_PROMPTS = [
+    "요즘 잠을 잘 못 자요. 밤마다 생각이 많아져요.",
+    "회사 일 때문에 너무 지쳐서 이야기하고 싶었어요.",
+    "내담자는 현재 불안감 상태를 주로 나타내며",
+]
+
+
+# -----------------------------
+# 서버용 로딩 (torch·transformers·peft는 함수 안에서 임포트 - 서버 모듈 임포트를 가볍게)
+# -----------------------------
+def read_export_metadata(path):
+    with open(os.path.join(path, METADATA_FILE), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def exported_adapter_version(path):
+    """내보낸 모델의 어댑터 버전 (리포트 캐시 키용, 양자화하면 결과가 달라지므로 구분)"""
+    metadata = read_export_metadata(path)
+    version = metadata["adapter_fingerprint"]
+    return version if metadata["quantize"] == "none" else f"{version}-{metadata['quantize']}"
+
+
+def load_exported_model(path):
+    """export_model.py로 저장한 병합 모델 (model, tokenizer) - PEFT 래핑·어댑터 로딩 없음"""
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    metadata = read_export_metadata(path)
+    tokenizer = AutoTokenizer.from_pretrained(path, trust_remote_code=True)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    # safetensors는 메모리 매핑으로 읽고, 양자화 설정은 config.json에 저장되어 있음
+    model = AutoModelForCausalLM.from_pretrained(
+        path,
+        torch_dtype=getattr(torch, metadata["dtype"]),
+        device_map="auto",
+        trust_remote_code=True
+    )
+    model.eval()
+    return model, tokenizer
+
+
+# -----------------------------
+# 내보내기
+# -----------------------------
+def quantization_config(kind, dtype):
+    from transformers import BitsAndBytesConfig
+
+    if kind == "int8":
+        return BitsAndBytesConfig(load_in_8bit=True)
+    if kind == "int4":
+        return BitsAndBytesConfig(load_in_4bit=True, bnb_4bit_quant_type="nf4", bnb_4bit_compute_dtype=dtype,
+                                  bnb_4bit_use_double_quant=True)
+    raise ValueError(f"지원하지 않는 양자화 방식입니다: {kind}")
+
+
+def merge_adapter(base_model, adapter, dtype):
+    """베이스 모델에 LoRA를 합친 일반 transformers 모델 (CPU에서 병합)"""
+    from peft import PeftModel
+    from transformers import AutoModelForCausalLM
+
+    base = AutoModelForCausalLM.from_pretrained(base_model, torch_dtype=dtype, trust_remote_code=True,
+                                                low_cpu_mem_usage=True)
+    return PeftModel.from_pretrained(base, adapter, torch_dtype=dtype).merge_and_unload()
+
+
+def export_model(base_model, adapter, output, quantize="none", dtype="float16", max_shard_size="5GB"):
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    torch_dtype = getattr(torch, dtype)
+    start = time.perf_counter()
+    print(f"[export] 병합 중: {base_model} + {adapter} ({dtype})", flush=True)
+    tokenizer = AutoTokenizer.from_pretrained(base_model, trust_remote_code=True)
+    merged = merge_adapter(base_model, adapter, torch_dtype)
+
+    os.makedirs(output, exist_ok=True)
+    if quantize == "none":
+        merged.save_pretrained(output, safe_serialization=True, max_shard_size=max_shard_size)
+    else:
+        if not torch.cuda.is_available():
+            raise SystemExit("bitsandbytes 양자화에는 CUDA가 필요합니다.")
+        # 병합한 가중치를 임시로 저장한 뒤 양자화 설정으로 다시 읽어 저장
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output))) as tmp:
+            merged.save_pretrained(tmp, safe_serialization=True, max_shard_size=max_shard_size)
+            del merged
+            quantized = AutoModelForCausalLM.from_pretrained(
+                tmp,
+                torch_dtype=torch_dtype,
+                quantization_config=quantization_config(quantize, torch_dtype),
+                device_map="auto",
+                trust_remote_code=True
+            )
+            quantized.save_pretrained(output, safe_serialization=True, max_shard_size=max_shard_size)
+    tokenizer.save_pretrained(output)
+
+    with open(os.path.join(adapter, "adapter_config.json"), encoding="utf-8") as f:
+        lora = json.load(f)
+    metadata = {
+        "base_model": base_model,
+        "adapter": os.path.abspath(adapter),
+        "adapter_fingerprint": adapter_fingerprint(adapter),
+        "lora": {"r": lora["r"], "lora_alpha": lora["lora_alpha"], "target_modules": lora["target_modules"]},
+        "quantize": quantize,
+        "dtype": dtype,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "torch": torch.__version__,
+    }
+    with open(os.path.join(output, METADATA_FILE), "w", encoding="utf-8") as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+    size_mb = sum(os.path.getsize(os.path.join(output, name)) for name in os.listdir(output)
+                  if name.endswith(".safetensors")) / 1024 / 1024
+    print(f"[export] 저장 완료: {output} ({size_mb:.1f}MB, {time.perf_counter() - start:.1f}초)", flush=True)
+    return metadata
+
+
+# -----------------------------
+# 검증 (CPU)
+# -----------------------------
+def decode_ms_per_token(model, input_ids, new_tokens):
+    """greedy 생성 new_tokens개와 1개의 시간 차이로 prefill을 뺀 토큰당 디코딩 시간"""
+    import torch
+
+    def run(n):
+        start = time.perf_counter()
+        with torch.no_grad():
+            out = model.generate(input_ids, attention_mask=torch.ones_like(input_ids), do_sample=False,
+                                 max_new_tokens=n, min_new_tokens=n, pad_token_id=0)
+        return time.perf_counter() - start, out[0, input_ids.shape[1]:].tolist()
+
+    run(1)  # 워밍업
+    one, _ = run(1)
+    total, tokens = run(new_tokens)
+    return (total - one) / max(1, new_tokens - 1) * 1000, tokens
+
+
+def verify_export(base_model, adapter, output, new_tokens=32, rtol=1e-2):
+    """원본(베이스 + 어댑터, 병합 안 함)과 내보낸 모델을 CPU float32로 비교"""
+    import torch
+    from peft import PeftModel
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    metadata = read_export_metadata(output)
+    torch.set_grad_enabled(False)
+
+    start = time.perf_counter()
+    base = AutoModelForCausalLM.from_pretrained(base_model, torch_dtype=torch.float32, trust_remote_code=True)
+    reference = PeftModel.from_pretrained(base, adapter).eval()
+    reference_load = time.perf_counter() - start
+
+    start = time.perf_counter()
+    exported = AutoModelForCausalLM.from_pretrained(output, torch_dtype=torch.float32, trust_remote_code=True).eval()
+    exported_load = time.perf_counter() - start
+
+    tokenizer = AutoTokenizer.from_pretrained(output, trust_remote_code=True)
+    rows = []
+    for prompt in VERIFY_PROMPTS:
+        ids = tokenizer(prompt, return_tensors="pt", return_token_type_ids=False)["input_ids"]
+        ref_logits = reference(input_ids=ids).logits
+        exp_logits = exported(input_ids=ids).logits
+        max_abs = float((ref_logits - exp_logits).abs().max())
+        ref_ms, ref_tokens = decode_ms_per_token(reference, ids, new_tokens)
+        exp_ms, exp_tokens = decode_ms_per_token(exported, ids, new_tokens)
+        rows.append({"max_abs_diff": max_abs, "rel_diff": max_abs / float(ref_logits.abs().max()),
+                     "greedy_match": ref_tokens == exp_tokens,
+                     "decode_ms_per_token": {"lora": ref_ms, "merged": exp_ms}})
+
+    worst = max(r["rel_diff"] for r in rows)
+    lora_ms = sum(r["decode_ms_per_token"]["lora"] for r in rows) / len(rows)
+    merged_ms = sum(r["decode_ms_per_token"]["merged"] for r in rows) / len(rows)
+    print(f"[verify] 최대 logits 차이 {max(r['max_abs_diff'] for r in rows):.2e} (상대 {worst:.2e}), "
+          f"greedy 일치 {sum(r['greedy_match'] for r in rows)}/{len(rows)}", flush=True)
+    print(f"[verify] 로딩 {reference_load:.2f}초(베이스+어댑터) → {exported_load:.2f}초(병합), "
+          f"디코딩 {lora_ms:.2f} → {merged_ms:.2f} ms/토큰", flush=True)
+
+    # 양자화 모델은 근사라 수치 비교 대신 결과만 출력
+    if metadata["quantize"] == "none" and worst > rtol:
+        raise SystemExit(f"[verify] 실패: 상대 logits 차이 {worst:.2e} > {rtol}")
+    return rows
+
+
+def make_tiny_checkpoint(workdir, seed=0):
+    """이 디렉토리의 토크나이저를 쓰는 작은 랜덤 Llama + 0이 아닌 랜덤 LoRA (실제 어댑터와 같은 rank·대상 모듈)"""
+    from peft import LoraConfig, get_peft_model
+    from transformers import AutoTokenizer
+
+    from benchmark import make_tiny_model
+
+    base_dir, adapter_dir = os.path.join(workdir, "base"), os.path.join(workdir, "adapter")
+    tokenizer = AutoTokenizer.from_pretrained(HERE)
+    model = make_tiny_model(vocab_size=len(tokenizer), seed=seed)
+    model.save_pretrained(base_dir)
+    tokenizer.save_pretrained(base_dir)
+
+    with open(os.path.join(HERE, "adapter_config.json"), encoding="utf-8") as f:
+        reference = json.load(f)
+    # init_lora_weights=False: B도 랜덤으로 초기화해 병합이 실제로 가중치를 바꾸도록
+    lora = LoraConfig(r=reference["r"], lora_alpha=reference["lora_alpha"], target_modules=reference["target_modules"],
+                      init_lora_weights=False, task_type="CAUSAL_LM")
+    get_peft_model(model, lora).save_pretrained(adapter_dir)
+    return base_dir, adapter_dir
+
+
+def main():
+    ap = argparse.ArgumentParser(description="LoRA 병합 (+ 양자화) 모델 내보내기")
+    ap.add_argument("--base_model", default="K-intelligence/Midm-2.0-Base-Instruct")
+    ap.add_argument("--adapter", default=HERE, help="LoRA 어댑터 경로 (기본: 이 디렉토리)")
+    ap.add_argument("--output", required=True)
+    ap.add_argument("--quantize", choices=["none", "int8", "int4"], default="none")
+    ap.add_argument("--dtype", choices=list(DTYPES), default="float16")
+    ap.add_argument("--max_shard_size", default="5GB")
+    ap.add_argument("--verify", action="store_true", help="CPU float32로 원본과 수치 비교")
+    ap.add_argument("--verify_tokens", type=int, default=32)
+    ap.add_argument("--rtol", type=float, default=1e-2, help="허용 상대 logits 차이 (양자화하지 않은 경우)")
+    ap.add_argument("--tiny", action="store_true", help="작은 랜덤 모델 + LoRA로 내보내기 (CPU 확인용)")
+    args = ap.parse_args()
+
+    workdir = None
+    if args.tiny:
+        workdir = tempfile.mkdtemp(prefix="tiny_export_")
+        args.base_model, args.adapter = make_tiny_checkpoint(workdir)
+    try:
+        export_model(args.base_model, args.adapter, args.output, args.quantize, args.dtype, args.max_shard_size)
+        if args.verify:
+            verify_export(args.base_model, args.adapter, args.output, args.verify_tokens, args.rtol)
+    finally:
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
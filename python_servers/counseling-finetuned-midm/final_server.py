@@ -1,20 +1,24 @@
 #!/usr/bin/env python3
 import os
-import sys
 import logging
-import torch
-from flask import Flask, request, jsonify
-from transformers import AutoTokenizer, AutoModelForCausalLM
-from peft import PeftModel, PeftConfig
+import threading
+import time
+from flask import Flask, request, jsonify, Response, stream_with_context
 import re
 import json
+from contextlib import nullcontext
 from datetime import datetime
 
-# RAG 관련 임포트
-from llama_index.core import VectorStoreIndex, StorageContext, load_index_from_storage
-from llama_index.vector_stores.chroma import ChromaVectorStore
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-import chromadb
+# torch·transformers·peft·llama_index·chromadb는 무거워서 로딩 함수 안에서 임포트 (모듈 임포트는 1초 미만)
+from keyword_matcher import KeywordMatcher
+from response_cleanup import clean_fragment, finish_response, simple_clean_response
+from rag_retriever import RELEVANCE_KEY, EmbeddingMismatch, RAGRetriever, recorded_embedding
+from bm25_index import BM25Index
+from metrics import (CONTENT_TYPE, REGISTRY, Counter, Gauge, GenerationTimer, Histogram, cache_lookup_function,
+                     cache_ratio_function)
+from session_store import create_session_store
+from startup import StartupTracker
+from context_builder import ContextBuilder
 
 # 로깅 설정
 logging.basicConfig(
@@ -29,9 +33,141 @@ app = Flask(__name__)
 # 전역 변수들
 model = None
 tokenizer = None
-conversation_history = {}
-session_data = {}  # 세션별 상담 진행 단계 저장
-query_engine = None  # RAG 시스템
+# 세션별 상담 진행 단계·대화 기록 저장소 (SESSION_STORE=memory | sqlite:///경로)
+session_store = create_session_store(
+    os.getenv("SESSION_STORE", "memory"),
+    ttl=float(os.getenv("SESSION_TTL", "86400"))
+)
+rag_retriever = None  # RAG 검색기 (서버 시작 시 한 번 로드)
+generation_engine = None  # 연속 배칭 엔진 (None이면 요청별 model.generate)
+prefix_cache = None  # 페르소나×단계별 시스템 프롬프트 prefix KV 캐시
+session_kv_cache = None  # 세션별 직전 턴 KV 캐시
+model_host = None  # 공유 모델 호스트 (inference_server.py로 실행할 때만, 단독 실행이면 None)
+chat_adapter = None  # 채팅 기본 PEFT 어댑터 이름 (None이면 모델의 활성 어댑터)
+context_builder = None  # 토큰 예산 기반 프롬프트 구성 (토크나이저 로딩 후 생성)
+speculative = None  # draft 모델 기반 speculative decoding (CHAT_DRAFT_MODEL 설정 시)
+
+# 구성 요소별 로딩 상태 (HTTP 서버는 바로 열고 백그라운드에서 로딩, /health/live·/health/ready)
+startup = StartupTracker(["model", "engine", "kv_cache", "draft", "rag"], required=["model", "engine"])
+
+# 모델 경로 (부하 테스트 등에서는 작은 로컬 모델·어댑터로 바꿔 실행)
+BASE_MODEL_NAME = os.getenv("CHAT_BASE_MODEL", "K-intelligence/Midm-2.0-Base-Instruct")
+ADAPTER_PATH = os.getenv("CHAT_ADAPTER_PATH", "/home/kwy00/dd0nw/counseling-finetuned-midm")  # LoRA 어댑터 경로
+CHAT_PORT = int(os.getenv("CHAT_PORT", "5003"))
+# export_model.py로 LoRA를 병합해 저장한 모델 (지정하면 베이스 + 어댑터 대신 PEFT 없이 바로 로딩)
+MERGED_MODEL_PATH = os.getenv("CHAT_MERGED_MODEL", "")
+
+# 연속 배칭 설정
+USE_BATCHING = os.getenv("CHAT_BATCHING", "1") == "1"
+MAX_BATCH_SIZE = int(os.getenv("CHAT_MAX_BATCH_SIZE", "8"))
+
+# LoRA 모델에 최적화된 생성 파라미터 (요청별로 엔진에 전달)
+GENERATION_KWARGS = {
+    "max_new_tokens": 150,     # 토큰 수 줄임
+    "temperature": 0.7,        # 온도 낮춤
+    "top_p": 0.8,              # top_p 낮춤
+    "top_k": 50,               # top_k 추가
+    "do_sample": True,
+    "repetition_penalty": 1.2,  # 반복 페널티 증가
+    "no_repeat_ngram_size": 3   # n-gram 반복 방지
+}
+
+# prefix KV 캐시 설정
+USE_PREFIX_CACHE = os.getenv("CHAT_PREFIX_CACHE", "1") == "1"
+PREFIX_STAGES = ("initial", "exploration", "goal_setting", "intervention")
+PREFIX_CACHE_MB = float(os.getenv("CHAT_PREFIX_CACHE_MB", "1024"))
+
+# 세션별 KV 캐시 설정 (기본 비활성화)
+USE_SESSION_KV_CACHE = os.getenv("CHAT_SESSION_KV_CACHE", "0") == "1"
+SESSION_KV_MAX_SESSIONS = int(os.getenv("CHAT_SESSION_KV_MAX_SESSIONS", "64"))
+SESSION_KV_MB = float(os.getenv("CHAT_SESSION_KV_MB", "4096"))
+SESSION_KV_TTL = float(os.getenv("CHAT_SESSION_KV_TTL", "1800"))
+SESSION_KV_OFFLOAD_AFTER = float(os.getenv("CHAT_SESSION_KV_OFFLOAD_AFTER", "60"))
+SESSION_KV_CPU_MB = float(os.getenv("CHAT_SESSION_KV_CPU_MB", "16384"))
+
+# speculative decoding (기본 비활성화) - draft 모델이 후보 토큰을 만들고 본 모델이 한 번에 검증
+# draft는 본 모델과 토크나이저가 같아야 함 (예: K-intelligence/Midm-2.0-Mini-Instruct, Modelfile의 gemma2:2b는 어휘가 달라 불가)
+# 배칭 엔진이 한가할 때만 요청별 생성으로 사용하고, 최근 수락률이 기준보다 낮으면 일반 디코딩으로 폴백
+DRAFT_MODEL = os.getenv("CHAT_DRAFT_MODEL", "")
+DRAFT_TOKENS = int(os.getenv("CHAT_DRAFT_TOKENS", "5"))  # 검증 1회당 시작 후보 수 (수락 결과에 따라 조절)
+SPECULATIVE_MIN_ACCEPTANCE = float(os.getenv("CHAT_SPECULATIVE_MIN_ACCEPTANCE", "0.3"))
+SPECULATIVE_WINDOW = int(os.getenv("CHAT_SPECULATIVE_WINDOW", "20"))  # 수락률을 평균할 최근 응답 수
+SPECULATIVE_RETRY_AFTER = int(os.getenv("CHAT_SPECULATIVE_RETRY_AFTER", "50"))  # 폴백 후 재측정 간격(응답 수)
+
+# 프롬프트 토큰 예산 (시스템 프롬프트 + 이전 대화 + 현재 메시지, 생성 토큰 제외)
+CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "2048"))
+CONTEXT_MAX_TURNS = int(os.getenv("CHAT_CONTEXT_MAX_TURNS", "6"))  # 예산 안에서 넣을 최근 대화 턴 상한
+# 예산에서 밀려난 이전 대화를 요약 줄로 대신 (0이면 사용 안 함, 최근 CHAT_CONTEXT_SUMMARY_TURNS개 기록까지)
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CHAT_CONTEXT_SUMMARY_TOKENS", "0"))
+CONTEXT_SUMMARY_TURNS = int(os.getenv("CHAT_CONTEXT_SUMMARY_TURNS", "20"))
+
+# 스트리밍 설정
+STREAM_TIMEOUT = float(os.getenv("CHAT_STREAM_TIMEOUT", "120"))
+
+# RAG 설정 (임베딩 모델은 dont/ingest.py 적재 시 사용한 모델과 같아야 함)
+USE_RAG = os.getenv("CHAT_RAG", "1") == "1"
+RAG_CHROMA_PATH = os.getenv("RAG_CHROMA_PATH", "/home/kwy00/dd0nw/dont/storage/chroma")
+RAG_COLLECTION = os.getenv("RAG_COLLECTION", "midm_docs")
+# 비워 두면 컬렉션에 기록된 적재 모델 사용 (기록이 없는 이전 컬렉션은 ingest.py 기본 모델)
+RAG_EMBED_MODEL = os.getenv("RAG_EMBED_MODEL", "")
+RAG_DEFAULT_EMBED_MODEL = "intfloat/multilingual-e5-large"
+RAG_EMBED_DEVICE = os.getenv("RAG_EMBED_DEVICE", "auto")  # auto | cuda | cpu
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "2"))
+# 하이브리드 검색: dont/ingest.py가 만든 BM25 색인과 벡터 결과를 RRF로 합침 (색인이 없으면 벡터만)
+RAG_HYBRID = os.getenv("RAG_HYBRID", "1") == "1"
+RAG_BM25_PATH = os.getenv("RAG_BM25_PATH", os.path.join(os.path.dirname(RAG_CHROMA_PATH), "bm25"))
+RAG_CANDIDATES = int(os.getenv("RAG_CANDIDATES", "10"))
+RAG_EMBEDDING_CACHE_SIZE = int(os.getenv("RAG_EMBEDDING_CACHE_SIZE", "4096"))
+RAG_RESULT_CACHE_SIZE = int(os.getenv("RAG_RESULT_CACHE_SIZE", "4096"))
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+|\n+')
+
+# Prometheus 지표 (/metrics)
+# 단계: rag, tokenize, kv_lookup, queue(배칭 대기), prefill, decode, detokenize, cleanup, finalize
+STAGE_SECONDS = Histogram("chat_stage_seconds", "상담 응답 생성 단계별 소요 시간(초)", ["stage"])
+REQUEST_SECONDS = Histogram("chat_request_seconds", "엔드포인트별 전체 처리 시간(초)", ["endpoint"])
+FIRST_DELTA_SECONDS = Histogram("chat_stream_first_delta_seconds", "/chat/stream 첫 문장 전송까지 시간(초)")
+TOKENS = Counter("chat_tokens_total", "토큰 수 (in: 프롬프트, prefill: 캐시 제외 실제 prefill, out: 생성)",
+                 ["direction"])
+QUEUE_DEPTH = Gauge("chat_generation_queue_depth", "연속 배칭 엔진 대기 요청 수").set_function(
+    lambda: generation_engine.queue_depth if generation_engine is not None else 0)
+BATCH_SIZE = Gauge("chat_generation_batch_size", "함께 디코딩 중인 요청 수").set_function(
+    lambda: generation_engine.batch_size if generation_engine is not None else 0)
+
+def _hits_misses(stats):
+    return (stats["hits"], stats["misses"]) if stats is not None else None
+
+CACHE_SOURCES = {
+    "prefix_kv": lambda: _hits_misses(prefix_cache.stats if prefix_cache is not None else None),
+    "session_kv": lambda: _hits_misses(session_kv_cache.stats if session_kv_cache is not None else None),
+    "rag_embedding": lambda: _hits_misses(rag_retriever.embeddings.stats() if rag_retriever is not None else None),
+    "rag_result": lambda: _hits_misses(rag_retriever.results.stats() if rag_retriever is not None else None),
+}
+CACHE_HIT_RATIO = Gauge("chat_cache_hit_ratio", "캐시별 누적 적중률", ["cache"]).set_function(
+    cache_ratio_function(CACHE_SOURCES))
+CACHE_LOOKUPS = Counter("chat_cache_lookups_total", "캐시별 조회 수", ["cache", "result"]).set_function(
+    cache_lookup_function(CACHE_SOURCES))
+
+def _speculative_stat(name):
+    """speculative decoding 통계 한 항목을 읽는 수집 함수 (비활성화면 None)"""
+    def collect():
+        return speculative.stats()[name] if speculative is not None else None
+    return collect
+
+def _speculative_tokens():
+    if speculative is None:
+        return None
+    stats = speculative.stats()
+    return {("proposed",): stats["proposed"], ("accepted",): stats["accepted"]}
+
+SPECULATIVE_TOKENS = Counter("chat_speculative_tokens_total",
+                             "speculative decoding 토큰 수 (proposed: draft 후보, accepted: 본 모델이 수락)",
+                             ["kind"]).set_function(_speculative_tokens)
+SPECULATIVE_ACCEPTANCE = Gauge("chat_speculative_acceptance_ratio", "최근 응답들의 평균 draft 후보 수락률").set_function(
+    _speculative_stat("recent_acceptance_rate"))
+SPECULATIVE_ACTIVE = Gauge("chat_speculative_active", "speculative decoding 사용 여부 (0이면 수락률 저하로 폴백 중)").set_function(
+    _speculative_stat("active"))
+SPECULATIVE_FALLBACKS = Counter("chat_speculative_fallbacks_total", "수락률 저하로 일반 디코딩으로 전환한 횟수").set_function(
+    _speculative_stat("fallbacks"))
 
 # 공통 상담 원칙
 BASE_COUNSELING_PROMPT = (
@@ -108,6 +244,7 @@ EMOTION_KEYWORDS = {
     "외로움": ["외로움", "고립", "혼자", "소외", "쓸쓸"],
     "트라우마": ["트라우마", "사고", "충격", "악몽", "플래시백"]
 }
+EMOTION_MATCHER = KeywordMatcher(EMOTION_KEYWORDS)
 
 # 상담 기법별 응답 패턴
 COUNSELING_TECHNIQUES = {
@@ -119,99 +256,121 @@ COUNSELING_TECHNIQUES = {
 }
 
 def load_rag_system():
-    """RAG 시스템 로딩"""
-    global query_engine
+    """RAG 검색기 로딩 (Chroma 컬렉션과 질의 임베딩 모델을 한 번만 준비)"""
+    global rag_retriever
+    
+    if not USE_RAG:
+        logger.info("CHAT_RAG=0 - RAG 시스템을 로드하지 않습니다.")
+        return False
     
     try:
-        logger.info("RAG 시스템 로딩 시작...")
+        import chromadb
+        import torch
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
         
-        # ChromaDB 클라이언트 생성
-        chroma_client = chromadb.PersistentClient(path="/home/kwy00/dd0nw/dont/storage/chroma")
-        chroma_collection = chroma_client.get_collection("midm_docs")
+        logger.info("RAG 시스템 로딩 시작...")
         
-        # 벡터 스토어 설정
-        vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-        storage_context = StorageContext.from_defaults(vector_store=vector_store)
+        # ChromaDB 컬렉션 (llama_index 인덱스 없이 직접 조회)
+        startup.progress("rag", "Chroma 컬렉션 열기")
+        chroma_client = chromadb.PersistentClient(path=RAG_CHROMA_PATH)
+        chroma_collection = chroma_client.get_collection(RAG_COLLECTION)
         
-        # 임베딩 모델 설정
+        # 임베딩 모델 설정 (적재한 모델과 다르면 검색하지 않음)
+        recorded_model, _ = recorded_embedding(chroma_collection)
+        embed_model_name = RAG_EMBED_MODEL or recorded_model or RAG_DEFAULT_EMBED_MODEL
+        if recorded_model and embed_model_name != recorded_model:
+            logger.error(f"RAG_EMBED_MODEL({embed_model_name})이 컬렉션 적재 모델({recorded_model})과 다릅니다. RAG를 끕니다.")
+            return False
+        device = RAG_EMBED_DEVICE
+        if device == "auto":
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        startup.progress("rag", f"임베딩 모델 로딩 중 ({embed_model_name}, {device})")
         embed_model = HuggingFaceEmbedding(
-            model_name="jhgan/ko-sroberta-multitask",
+            model_name=embed_model_name,
+            device=device,
             trust_remote_code=True
         )
         
-        # 인덱스 로드
-        index = VectorStoreIndex.from_vector_store(
-            vector_store=vector_store,
-            storage_context=storage_context,
-            embed_model=embed_model
-        )
+        # BM25 색인 (상담 관련 청크만 검색하도록 제한)
+        bm25 = None
+        if RAG_HYBRID:
+            startup.progress("rag", "BM25 색인 열기")
+            try:
+                relevant_ids = chroma_collection.get(where={RELEVANCE_KEY: True}, include=[])["ids"]
+                bm25 = BM25Index(RAG_BM25_PATH, allowed_ids=relevant_ids)
+            except (FileNotFoundError, ValueError) as e:
+                logger.warning(f"BM25 색인을 사용할 수 없어 벡터 검색만 합니다: {e}")
         
-        # 쿼리 엔진 생성
-        query_engine = index.as_retriever(similarity_top_k=2)
+        retriever = RAGRetriever(
+            chroma_collection,
+            embed_model.get_query_embedding,
+            top_k=RAG_TOP_K,
+            embedding_cache_size=RAG_EMBEDDING_CACHE_SIZE,
+            result_cache_size=RAG_RESULT_CACHE_SIZE,
+            bm25=bm25,
+            candidates=RAG_CANDIDATES
+        )
+        if not retriever.check_embedding(embed_model_name):
+            logger.warning(f"'{RAG_COLLECTION}' 컬렉션에 임베딩 모델 기록이 없습니다. dont/ingest.py를 다시 실행하면 기록됩니다.")
+        if not retriever.has_relevance_metadata():
+            logger.warning(f"'{RAG_COLLECTION}' 컬렉션에 상담 관련 메타데이터가 없습니다. dont/ingest.py로 다시 적재하세요.")
+            return False
         
-        logger.info("RAG 시스템 로딩 완료!")
+        rag_retriever = retriever
+        logger.info(f"RAG 시스템 로딩 완료! (임베딩: {embed_model_name}, device={device}, top_k={RAG_TOP_K}, "
+                    f"{'hybrid' if bm25 is not None else 'dense'})")
         return True
         
+    except EmbeddingMismatch as e:
+        logger.error(f"RAG 임베딩 불일치: {e}")
+        startup.fail("rag", e)
+        return False
     except Exception as e:
         logger.error(f"RAG 시스템 로딩 실패: {e}")
+        startup.fail("rag", e)
         return False
 
+@STAGE_SECONDS.time(stage="rag")
 def get_rag_context(question):
-    """RAG에서 상담 관련 컨텍스트 검색"""
-    global query_engine
-    
-    if query_engine is None:
+    """RAG에서 상담 관련 컨텍스트 검색 (가장 관련성 높은 발췌 하나)"""
+    if rag_retriever is None:
         return None
     
     try:
-        # RAG에서 관련 정보 검색
-        nodes = query_engine.retrieve(question)
-        
-        if nodes:
-            # 상담에 유용한 정보만 추출
-            context_parts = []
-            for node in nodes[:2]:  # 상위 2개만
-                text = node.node.text[:300]  # 300자로 제한
-                
-                # 학술적 내용 필터링
-                if any(unwanted in text for unwanted in ['참고문헌', '출처:', '연구', '논문', '년도', 'p.']):
-                    continue
-                
-                # 상담 관련 핵심 내용만
-                if any(keyword in text for keyword in ['상담', '치료', '심리', '감정', '대처', '방법']):
-                    # 인용이나 저자 정보 제거
-                    clean_text = re.sub(r'\d{4}년?|\d{4}\s*,\s*p.*|저자.*|출처.*', '', text)
-                    clean_text = clean_text.strip()
-                    if len(clean_text) > 50:
-                        context_parts.append(clean_text[:200])
-            
-            if context_parts:
-                return context_parts[0]  # 가장 관련성 높은 것 하나만
-        
-        return None
+        contexts = rag_retriever.retrieve(question)
+        return contexts[0] if contexts else None
         
     except Exception as e:
         logger.error(f"RAG 검색 오류: {e}")
         return None
 
-
-
 def load_model():
     """모델 로딩 - 양자화 없이 LoRA 파인튜닝된 모델 사용"""
     global model, tokenizer
     
     try:
-        logger.info("LoRA 파인튜닝된 상담 모델 로딩 시작 (양자화 없음)...")
+        startup.progress("model", "torch / transformers 임포트")
+        import torch
+        from peft import PeftModel
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        
+        if MERGED_MODEL_PATH:
+            from export_model import load_exported_model
+            
+            startup.progress("model", f"LoRA 병합 모델 로딩 중 ({MERGED_MODEL_PATH})")
+            model, tokenizer = load_exported_model(MERGED_MODEL_PATH)
+            start_context_builder()
+            logger.info("LoRA 병합 모델 로딩 완료!")
+            return True
         
-        # GPU 설정
-        os.environ["CUDA_VISIBLE_DEVICES"] = "0"
-        device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+        logger.info("LoRA 파인튜닝된 상담 모델 로딩 시작 (양자화 없음)...")
         
         # 모델 경로
-        base_model_name = "K-intelligence/Midm-2.0-Base-Instruct"
-        peft_model_path = "/home/kwy00/dd0nw/counseling-finetuned-midm"  # LoRA 어댑터 경로
+        base_model_name = BASE_MODEL_NAME
+        peft_model_path = ADAPTER_PATH
         
         # 토크나이저 로드
+        startup.progress("model", "토크나이저 로딩 중")
         tokenizer = AutoTokenizer.from_pretrained(
             base_model_name,
             trust_remote_code=True
@@ -221,7 +380,7 @@ def load_model():
             tokenizer.pad_token = tokenizer.eos_token
         
         # 베이스 모델 로드 (양자화 없이)
-        logger.info("베이스 모델 로딩 중 (float16)...")
+        startup.progress("model", "베이스 모델 로딩 중 (float16)")
         base_model = AutoModelForCausalLM.from_pretrained(
             base_model_name,
             torch_dtype=torch.float16,  # 양자화 대신 float16 사용
@@ -230,7 +389,7 @@ def load_model():
         )
         
         # LoRA 어댑터 로드
-        logger.info("LoRA 어댑터 로딩 중...")
+        startup.progress("model", "LoRA 어댑터 로딩 중")
         model = PeftModel.from_pretrained(
             base_model,
             peft_model_path,
@@ -239,78 +398,108 @@ def load_model():
         
         # 추론을 위한 모델 준비
         model.eval()
+        start_context_builder()
         
         logger.info("LoRA 파인튜닝된 상담 모델 로딩 완료 (양자화 없음)!")
         return True
         
     except Exception as e:
         logger.error(f"모델 로딩 실패: {e}")
+        startup.fail("model", e)
         return False
 
 def detect_emotion(text):
-    """텍스트에서 감정 키워드 감지"""
-    detected_emotions = []
-    for emotion, keywords in EMOTION_KEYWORDS.items():
-        for keyword in keywords:
-            if keyword in text:
-                detected_emotions.append(emotion)
-                break
-    return detected_emotions[0] if detected_emotions else "혼란스러운"
+    """텍스트에서 감정 키워드 감지 (사전 순서상 처음 매칭된 감정)"""
+    return EMOTION_MATCHER.first_match(text, "혼란스러운")
+
+def new_session_data():
+    return {
+        "stage": "initial",
+        "turn_count": 0,
+        "identified_issues": [],
+        "emotions": [],
+        "persona": "empathetic"  # 기본 페르소나
+    }
 
 def get_counseling_stage(session_id):
     """현재 상담 단계 확인"""
-    if session_id not in session_data:
-        session_data[session_id] = {
-            "stage": "initial",
-            "turn_count": 0,
-            "identified_issues": [],
-            "emotions": [],
-            "persona": "empathetic"  # 기본 페르소나
-        }
-    return session_data[session_id]
-
-def update_session_data(session_id, user_message, emotion):
-    """세션 데이터 업데이트"""
-    data = get_counseling_stage(session_id)
-    data["turn_count"] += 1
-    
-    if emotion not in data["emotions"]:
-        data["emotions"].append(emotion)
-    
-    # 단계 자동 진행
-    if data["turn_count"] >= 3 and data["stage"] == "initial":
-        data["stage"] = "exploration"
-    elif data["turn_count"] >= 6 and data["stage"] == "exploration":
-        data["stage"] = "goal_setting"
-    elif data["turn_count"] >= 9 and data["stage"] == "goal_setting":
-        data["stage"] = "intervention"
+    data = session_store.get_session(session_id)
+    if data is None:
+        # 없을 때만 새로 만듦 (동시에 도착한 요청의 갱신을 덮어쓰지 않도록 저장소에서 원자적으로)
+        data = session_store.update_session(session_id, lambda data: None, default=new_session_data)
+    return data
 
-def generate_professional_response(prompt, session_id, persona=None):
-    """전문적인 상담 응답 생성 (chat template 사용)"""
-    try:
-        # 감정 감지
-        emotion = detect_emotion(prompt)
+def update_session_data(session_id, user_message, emotion, persona=None):
+    """세션 데이터 업데이트 (턴 수 증가·단계 진행을 저장소에서 원자적으로 수행, 갱신된 상태 반환)"""
+    def advance(data):
+        data["turn_count"] += 1
         
-        # 세션 데이터 업데이트
-        update_session_data(session_id, prompt, emotion)
-        data = get_counseling_stage(session_id)
+        if emotion not in data["emotions"]:
+            data["emotions"].append(emotion)
+        
+        # 단계 자동 진행
+        if data["turn_count"] >= 3 and data["stage"] == "initial":
+            data["stage"] = "exploration"
+        elif data["turn_count"] >= 6 and data["stage"] == "exploration":
+            data["stage"] = "goal_setting"
+        elif data["turn_count"] >= 9 and data["stage"] == "goal_setting":
+            data["stage"] = "intervention"
         
         # 페르소나 설정
         if persona and persona in COUNSELOR_PERSONAS:
             data["persona"] = persona
-        current_persona = COUNSELOR_PERSONAS[data["persona"]]
-        
-        # 단계별 프롬프트 구성
-        stage = data["stage"]
-        turn_count = data["turn_count"]
-        
-        # 페르소나 기반 시스템 프롬프트 (공통 원칙 + 페르소나 특성)
-        combined_prompt = f"{BASE_COUNSELING_PROMPT}\n\n{current_persona['prompt_prefix']}"
-        persona_style = current_persona["style"]
-        
-        if stage == "initial":
-            # 라포 형성 단계
-            system_message = f"""{combined_prompt}
+    
+    return session_store.update_session(session_id, advance, default=new_session_data)
+
+def attach_model_host(host, alias="chat"):
+    """공유 모델 호스트의 모델·토크나이저 사용 (load_model 대신, 채팅 기본 어댑터는 alias)"""
+    global model, tokenizer, model_host, chat_adapter
+    
+    model_host = host
+    model = host.model
+    tokenizer = host.tokenizer
+    chat_adapter = host.adapter_name(alias)
+    start_context_builder()
+    logger.info(f"공유 모델 사용: 채팅 기본 어댑터 '{alias}' → '{chat_adapter}'")
+
+def start_context_builder():
+    """토큰 예산 기반 프롬프트 구성기 생성 (토크나이저 로딩 후)"""
+    global context_builder
+    context_builder = ContextBuilder(
+        tokenizer,
+        budget=CONTEXT_TOKENS,
+        max_turns=CONTEXT_MAX_TURNS,
+        summary_tokens=CONTEXT_SUMMARY_TOKENS,
+        summary_turns=CONTEXT_SUMMARY_TURNS
+    )
+    return context_builder
+
+def resolve_adapter(alias):
+    """요청의 adapter 값 → PEFT 어댑터 이름 (생략하면 채팅 기본 어댑터, 알 수 없으면 ValueError)"""
+    if alias is None:
+        return chat_adapter
+    if model_host is None:
+        raise ValueError("어댑터 선택은 공유 모델 서버(inference_server.py)에서만 지원합니다.")
+    try:
+        return model_host.adapter_name(alias)
+    except KeyError as e:
+        raise ValueError(e.args[0])
+
+def prefix_key(persona_key, stage):
+    """prefix KV 캐시 키 (같은 시스템 프롬프트를 쓰는 단계는 같은 키)"""
+    return persona_key, stage if stage in PREFIX_STAGES else "intervention"
+
+def build_system_message(persona_key, stage):
+    """페르소나·상담 단계별 시스템 프롬프트 (턴마다 달라지는 내용 없음 → prefix KV 캐시 단위)"""
+    current_persona = COUNSELOR_PERSONAS[persona_key]
+    
+    # 페르소나 기반 시스템 프롬프트 (공통 원칙 + 페르소나 특성)
+    combined_prompt = f"{BASE_COUNSELING_PROMPT}\n\n{current_persona['prompt_prefix']}"
+    persona_style = current_persona["style"]
+    
+    if stage == "initial":
+        # 라포 형성 단계
+        system_message = f"""{combined_prompt}
 
 {persona_style}
 
@@ -321,15 +510,13 @@ def generate_professional_response(prompt, session_id, persona=None):
 - 완전하고 자연스러운 문장으로 응답
 - 절대로 사용자 역할을 하지 마세요
 - 상담사 응답만 생성하세요"""
-            
-        elif stage == "exploration":
-            # 문제 탐색 단계
-            system_message = f"""{combined_prompt}
+        
+    elif stage == "exploration":
+        # 문제 탐색 단계
+        system_message = f"""{combined_prompt}
 
 {persona_style}
 
-사용자가 느끼는 주요 감정: {emotion}
-
 다음 지침을 따라 {current_persona["name"]}의 특성에 맞게 응답하세요:
 - 사용자의 감정을 정확히 반영하고 공감
 - {current_persona["name"]}의 접근 방식으로 탐색
@@ -337,143 +524,475 @@ def generate_professional_response(prompt, session_id, persona=None):
 - 완전하고 자연스러운 문장으로 응답
 - 절대로 사용자 역할을 하지 마세요
 - 상담사 응답만 생성하세요"""
-            
-        elif stage == "goal_setting":
-            # 목표 설정 단계
-            system_message = f"""{combined_prompt}
+        
+    elif stage == "goal_setting":
+        # 목표 설정 단계
+        system_message = f"""{combined_prompt}
 
 {persona_style}
 
-주요 감정들: {', '.join(data['emotions'])}
-
 다음 지침을 따라 {current_persona["name"]}의 특성에 맞게 응답하세요:
 1. 현재 상황을 {current_persona["name"]}의 관점에서 요약
 2. 변화하고 싶은 부분 확인
 3. {current_persona["name"]}의 접근법으로 목표 제시
 4. 절대로 사용자 역할을 하지 마세요
 5. 상담사 응답만 생성하세요"""
-            
-        else:  # intervention 단계
-            # 개입 단계
-            system_message = f"""{combined_prompt}
+        
+    else:  # intervention 단계
+        # 개입 단계
+        system_message = f"""{combined_prompt}
 
 {persona_style}
 
-주요 감정들: {', '.join(data['emotions'])}
-
 다음 지침을 따라 {current_persona["name"]}의 특성에 맞게 응답하세요:
 1. {current_persona["name"]}의 접근법으로 개입 제공
 2. 페르소나에 맞는 대처 방법 제안
 3. 구체적인 실천 방안
 4. 절대로 사용자 역할을 하지 마세요
 5. 상담사 응답만 생성하세요"""
+    
+    return system_message
 
-        # Chat template 사용 (이전 대화 기록 포함)
-        messages = [
-            {"role": "system", "content": system_message}
-        ]
-        
-        # 이전 대화 내역 추가 (최근 3턴, 6개 메시지)
-        if session_id in conversation_history:
-            recent_history = conversation_history[session_id][-6:]  # 최근 3턴
-            for record in recent_history:
-                messages.append({"role": "user", "content": record['user']})
-                messages.append({"role": "assistant", "content": record['assistant']})
-        
-        # 현재 메시지 추가
-        messages.append({"role": "user", "content": prompt})
-        
-        # Chat template 적용
-        formatted_prompt = tokenizer.apply_chat_template(
-            messages, 
-            tokenize=False, 
-            add_generation_prompt=True
-        )
+def prepare_counseling_turn(prompt, session_id, persona=None, adapter=None):
+    """감정 감지·세션 갱신·프롬프트 구성·토큰화까지 수행 (생성 직전 상태 반환)"""
+    # 감정 감지
+    emotion = detect_emotion(prompt)
+    
+    # 세션 데이터·페르소나 업데이트
+    data = update_session_data(session_id, prompt, emotion, persona)
+    current_persona = COUNSELOR_PERSONAS[data["persona"]]
+    
+    # 단계별 프롬프트 구성
+    stage = data["stage"]
+    turn_count = data["turn_count"]
+    system_message = build_system_message(data["persona"], stage)
+
+    # 턴마다 달라지는 감정·참고 자료는 시스템 프롬프트가 아니라 이전 대화 뒤(마지막 사용자 메시지 앞)에 붙임
+    # → 시스템 프롬프트는 페르소나·단계별로 고정 (prefix KV), 이전 대화 구간은 턴 사이에 그대로 (세션 KV)
+    notes = []
+    if stage == "exploration":
+        notes.append(f"사용자가 느끼는 주요 감정: {emotion}")
+    elif stage != "initial":
+        notes.append(f"주요 감정들: {', '.join(data['emotions'])}")
+    
+    rag_context = get_rag_context(prompt)
+    if rag_context:
+        notes.append(f"""참고 자료 (도움이 될 때만 쉬운 말로 자연스럽게 활용하고, 출처나 연구를 언급하지 마세요):
+{rag_context}""")
+    
+    # 이전 대화 기록 (저장된 턴별 토큰 수로 예산 안에 드는 최근 대화만 포함)
+    recent_history = session_store.recent_turns(session_id, context_builder.scan_turns)
+    
+    with STAGE_SECONDS.time(stage="tokenize"):
+        # Chat template 적용 + 토큰화 (CHAT_CONTEXT_TOKENS 이하, 끝부분은 자르지 않음)
+        formatted_prompt, inputs, context = context_builder.build(system_message, recent_history, prompt, notes)
+        inputs = inputs.to(model.device)
+    
+    if context["turns"] < len(recent_history):
+        logger.debug(f"이전 대화 {context['turns']}/{len(recent_history)}턴 포함 (요약 {context['summarized']}줄, "
+                     f"{context['prompt_tokens']}토큰)")
+    
+    return {
+        "prompt": prompt,
+        "session_id": session_id,
+        "emotion": emotion,
+        "stage": stage,
+        "persona": current_persona,
+        "inputs": inputs,
+        "prefix_key": prefix_key(data["persona"], stage),
+        "prefix_text": context_builder.system_prefix(system_message),
+        "history_tokens": context["history_tokens"],
+        "history_turns": context["turns"],
+        "rag_used": rag_context is not None,
+        "adapter": adapter if adapter is not None else chat_adapter
+    }
+
+@STAGE_SECONDS.time(stage="finalize")
+def finalize_counseling_turn(turn, response):
+    """정리된 응답에 페르소나 후처리 적용 후 상담 기록 저장"""
+    response = apply_persona_style(response, turn["persona"])
+    context = save_counseling_record(turn["session_id"], turn["prompt"], response, turn["emotion"], turn["stage"],
+                                     turn["rag_used"])
+    store_session_kv(turn, context)
+    return response
+
+def generate_professional_response(prompt, session_id, persona=None, adapter=None):
+    """전문적인 상담 응답 생성 (chat template 사용)"""
+    try:
+        turn = prepare_counseling_turn(prompt, session_id, persona, adapter)
         
-        # 토큰화 (더 긴 컨텍스트 허용)
-        inputs = tokenizer(
-            formatted_prompt,
-            return_tensors="pt",
-            truncation=True,
-            max_length=2048,  # 이전 대화 포함으로 길이 증가
-            return_token_type_ids=False
-        ).to(model.device)
-        
-        # LoRA 모델에 최적화된 생성 파라미터
-        with torch.no_grad():
-            outputs = model.generate(
-                **inputs,
-                max_new_tokens=150,  # 토큰 수 줄임
-                temperature=0.7,     # 온도 낮춤
-                top_p=0.8,          # top_p 낮춤
-                top_k=50,           # top_k 추가
-                do_sample=True,
-                pad_token_id=tokenizer.pad_token_id,
-                eos_token_id=tokenizer.eos_token_id,
-                repetition_penalty=1.2,  # 반복 페널티 증가
-                no_repeat_ngram_size=3   # n-gram 반복 방지
-            )
+        # 생성 (배칭 엔진 사용 시 다른 요청과 함께 디코딩)
+        output_ids = run_generation(turn["inputs"], lookup_kv_cache(turn), session_cache_writer(turn), turn["adapter"])
         
         # 응답 추출 및 정리
-        response = tokenizer.decode(outputs[0], skip_special_tokens=True)
-        
-        # 프롬프트 부분 제거 (chat template 형식)
-        if "<|im_start|>assistant\n" in response:
-            response = response.split("<|im_start|>assistant\n")[-1].strip()
-        elif "assistant\n" in response:
-            response = response.split("assistant\n")[-1].strip()
-        
-        # 간단한 정리만 수행
-        response = simple_clean_response(response)
+        with STAGE_SECONDS.time(stage="detokenize"):
+            response = tokenizer.decode(output_ids, skip_special_tokens=True)
         
-        # 페르소나에 맞는 후처리
-        response = apply_persona_style(response, current_persona)
+        with STAGE_SECONDS.time(stage="cleanup"):
+            # 프롬프트 부분 제거 (chat template 형식)
+            if "<|im_start|>assistant\n" in response:
+                response = response.split("<|im_start|>assistant\n")[-1].strip()
+            elif "assistant\n" in response:
+                response = response.split("assistant\n")[-1].strip()
+            
+            # 간단한 정리만 수행
+            response = simple_clean_response(response)
         
-        # 상담 기록 저장
-        save_counseling_record(session_id, prompt, response, emotion, stage)
+        # 페르소나 후처리 및 상담 기록 저장
+        response = finalize_counseling_turn(turn, response)
         
-        return response, stage, emotion, False, current_persona["name"]
+        return response, turn["stage"], turn["emotion"], turn["rag_used"], turn["persona"]["name"]
         
     except Exception as e:
         logger.error(f"전문 상담 응답 생성 오류: {e}")
         return "죄송합니다. 조금 더 자세히 말씀해주실 수 있을까요?", "initial", "혼란스러운", False, "공감형 상담사"
 
-def simple_clean_response(response):
-    """LoRA 모델 응답 정리 - 파인튜닝된 모델에 최적화"""
-    # 기본적인 정리
-    response = response.strip()
-    
-    # LoRA 모델 특성상 나타날 수 있는 패턴 제거
-    response = re.sub(r'[-\s]*\d+(?:\s+\d+){2,}.*$', '', response)  # 숫자 나열 제거
-    response = re.sub(r'<[^>]*>', '', response)  # 특수 토큰 제거
-    response = re.sub(r'\[.*?\]', '', response)  # 대괄호 내용 제거
-    
-    # 이상한 문자 조합만 제거 (영어는 유지)
-    response = re.sub(r'[^\w\s가-힣A-Za-z.,!?]+', '', response)
-    
-    # 연속된 공백 정리
-    response = re.sub(r'\s+', ' ', response)
-    
-    # 문장 끝 정리 - 자연스러운 상담 응답 형태로
-    if response and not response.endswith(('.', '요', '다', '네요', '어요', '까요', '?', '습니다')):
-        # 상담 응답에 맞는 자연스러운 끝맺음
-        if '어떻게' in response or '무엇' in response:
-            response += '?'
-        elif '습니' not in response:
-            response += '요'
-        else:
-            response += '.'
+@STAGE_SECONDS.time(stage="kv_lookup")
+def lookup_kv_cache(turn):
+    """재사용 가능한 앞부분 KV 조회 - 세션 KV와 prefix KV 중 더 긴 쪽 (없으면 None)"""
+    # 캐시된 KV는 기본 어댑터로 계산한 값이라 다른 어댑터 요청에는 쓰지 않음
+    if turn["adapter"] != chat_adapter:
+        return None
+    input_ids = turn["inputs"]["input_ids"][0].tolist()
+    past_key_values, reused = None, 0
     
-    # 너무 짧으면 기본 응답
-    if len(response.strip()) < 15:
-        response = "말씀해주신 내용을 잘 들었습니다. 좀 더 자세히 이야기해주실 수 있을까요?"
+    try:
+        if session_kv_cache is not None:
+            past_key_values, reused = session_kv_cache.lookup(turn["session_id"], input_ids)
+        
+        if prefix_cache is not None:
+            prefix_kv, prefix_reused = prefix_cache.lookup(turn["prefix_key"], turn["prefix_text"], input_ids)
+            if prefix_reused > reused:
+                past_key_values, reused = prefix_kv, prefix_reused
+    except Exception as e:
+        logger.warning(f"KV 캐시 조회 실패 - 전체 prefill로 진행: {e}")
+        return None
+    
+    return past_key_values
+
+def session_cache_writer(turn):
+    """생성 종료 시 이번 턴의 KV를 받아 두는 콜백 (비활성화 또는 기본 어댑터가 아니면 None, 저장은 store_session_kv)"""
+    if session_kv_cache is None or turn["adapter"] != chat_adapter:
+        return None
     
-    # 문장이 중간에 끊어진 경우 처리
-    sentences = response.split('.')
-    if len(sentences) > 1 and len(sentences[-1].strip()) < 5:
-        response = '.'.join(sentences[:-1]) + '.'
+    def _keep(token_ids, past_key_values):
+        # 배칭 엔진이 넘기는 KV는 배치 텐서의 뷰 - 응답 정리 직후 store_session_kv에서 사본으로 저장하고 놓음
+        turn["generated_kv"] = (token_ids, past_key_values)
     
-    return response
+    return _keep
+
+def store_session_kv(turn, context):
+    """
+    다음 턴 프롬프트에 이전 대화로 렌더링될 형태(메모 없는 메시지 + 저장된 응답)로 세션 KV 저장
+    context: 저장한 상담 기록의 토큰 id (save_counseling_record 반환값)
+    생성한 토큰과 정리된 응답이 달라지는 지점부터만 이어서 prefill 합니다.
+    """
+    from kv_cache import replay_cache
+    
+    generated = turn.pop("generated_kv", None)
+    if generated is None or context is None:
+        return
+    try:
+        replay_ids = context_builder.replay_ids(turn["inputs"]["input_ids"][0].tolist(), turn["history_tokens"],
+                                                turn["history_turns"], context)
+        cache = replay_cache(model, *generated, replay_ids, run=run_on_engine if model_host is not None else None)
+        if cache is not None:
+            session_kv_cache.store(turn["session_id"], replay_ids, cache)
+    except Exception as e:
+        logger.warning(f"세션 KV 저장 실패 - 다음 턴은 전체 prefill: {e}")
+
+def observe_generation(queue_seconds, prefill_seconds, decode_seconds, prompt_tokens, prefill_tokens, new_tokens):
+    """생성 한 건의 대기·prefill·decode 시간과 토큰 수 기록"""
+    if queue_seconds is not None:
+        STAGE_SECONDS.observe(queue_seconds, stage="queue")
+    STAGE_SECONDS.observe(prefill_seconds, stage="prefill")
+    STAGE_SECONDS.observe(decode_seconds, stage="decode")
+    TOKENS.inc(prompt_tokens, direction="in")
+    TOKENS.inc(prefill_tokens, direction="prefill")
+    TOKENS.inc(new_tokens, direction="out")
+
+def observe_engine_request(request):
+    """연속 배칭 엔진 on_finish 콜백 (요청별 단계 시각으로 지표 기록)"""
+    first_token_at = request.first_token_at or request.finished_at
+    observe_generation(
+        request.admitted_at - request.submitted_at,
+        first_token_at - request.admitted_at,
+        request.finished_at - first_token_at,
+        len(request.input_ids),
+        request.prefill_tokens,
+        len(request.generated)
+    )
+
+def generate_with_cache(inputs, past_key_values=None, on_cache=None, draft=False, **kwargs):
+    """model.generate 래퍼 - 캐시된 앞부분 KV 사용 및 종료 후 KV 전달 (draft: speculative decoding 사용)"""
+    import torch
+    from kv_cache import to_dynamic_cache, to_legacy_cache
+    
+    prompt_tokens = inputs["input_ids"].shape[1]
+    cached_tokens = past_key_values[0][0].shape[2] if past_key_values is not None else 0
+    if past_key_values is not None:
+        inputs = dict(inputs, past_key_values=to_dynamic_cache(past_key_values))
+    
+    # prefill / decode 시간 측정 (스트리밍이면 원래 streamer로 그대로 전달)
+    timer = GenerationTimer(kwargs.pop("streamer", None))
+    if draft:
+        kwargs.update(speculative.generate_kwargs())
+    with torch.no_grad(), speculative.measure(timer) if draft else nullcontext():
+        outputs = model.generate(
+            **inputs,
+            pad_token_id=tokenizer.pad_token_id,
+            eos_token_id=tokenizer.eos_token_id,
+            return_dict_in_generate=True,
+            streamer=timer,
+            **GENERATION_KWARGS,
+            **kwargs
+        )
+    observe_generation(None, *timer.timings(), prompt_tokens, prompt_tokens - cached_tokens, timer.new_tokens)
+    
+    if on_cache is not None and outputs.past_key_values is not None:
+        cache = to_legacy_cache(outputs.past_key_values)
+        on_cache(outputs.sequences[0][:cache[0][0].shape[2]].tolist(), cache)
+    return outputs.sequences[0]
+
+def use_speculative():
+    """
+    이번 응답에 speculative decoding 사용 여부 (배칭 엔진이 한가하고, 진행 중인 speculative 생성이 없고,
+    수락률이 기준 이상일 때). True면 generate_with_cache(draft=True) 호출 전체를 speculative.slot()으로 감쌀 것
+    """
+    if speculative is None:
+        return False
+    # 동시 요청이 있으면 연속 배칭이 더 효율적
+    if generation_engine is not None and (generation_engine.queue_depth or generation_engine.batch_size):
+        return False
+    return speculative.should_use()
+
+def run_generation(inputs, past_key_values=None, on_cache=None, adapter=None):
+    """토큰화된 입력으로 응답 생성 후 전체 토큰 id 반환 (past_key_values: 캐시된 앞부분 KV)"""
+    if use_speculative():
+        with speculative.slot():
+            return generate_with_cache(inputs, past_key_values, on_cache, draft=True)
+    
+    if generation_engine is not None:
+        return generation_engine.generate(
+            inputs["input_ids"][0].tolist(),
+            eos_token_id=tokenizer.eos_token_id,
+            past_key_values=past_key_values,
+            cache_callback=on_cache,
+            adapter=adapter,
+            **GENERATION_KWARGS
+        )
+    
+    return generate_with_cache(inputs, past_key_values, on_cache)
+
+def start_generation_engine():
+    """연속 배칭 엔진 시작"""
+    global generation_engine
+    from batching_engine import ContinuousBatchingEngine
+    
+    # 공유 모델은 어댑터 선택(PEFT forward hook)이 스레드 안전하지 않아 엔진 스레드에서만 생성
+    if not USE_BATCHING and model_host is None:
+        logger.info("연속 배칭 비활성화 - 요청별 생성 모드")
+        return None
+    
+    generation_engine = ContinuousBatchingEngine(
+        model,
+        pad_token_id=tokenizer.pad_token_id,
+        max_batch_size=MAX_BATCH_SIZE,
+        on_finish=observe_engine_request
+    ).start()
+    return generation_engine
+
+def start_streaming_generation(inputs, past_key_values=None, on_cache=None, adapter=None):
+    """TextIteratorStreamer로 생성 시작 후 텍스트 조각 이터레이터 반환"""
+    from transformers import TextIteratorStreamer
+    
+    streamer = TextIteratorStreamer(
+        tokenizer,
+        skip_prompt=True,
+        skip_special_tokens=True,
+        timeout=STREAM_TIMEOUT
+    )
+    
+    draft = use_speculative()
+    if generation_engine is not None and not draft:
+        generation_engine.submit(
+            inputs["input_ids"][0].tolist(),
+            eos_token_id=tokenizer.eos_token_id,
+            streamer=streamer,
+            past_key_values=past_key_values,
+            cache_callback=on_cache,
+            adapter=adapter,
+            **GENERATION_KWARGS
+        )
+        return streamer
+    
+    def _generate():
+        with speculative.slot() if draft else nullcontext():
+            try:
+                generate_with_cache(inputs, past_key_values, on_cache, draft=draft, streamer=streamer)
+            except Exception as e:
+                logger.error(f"스트리밍 생성 오류: {e}")
+                streamer.end()
+    
+    try:
+        threading.Thread(target=_generate, daemon=True).start()
+    except BaseException:
+        if draft:
+            speculative.release()  # 스레드가 시작되지 않아 slot 블록도 열리지 않음
+        raise
+    return streamer
+
+def stream_sentences(pieces):
+    """텍스트 조각을 모아 완성된 문장 단위로 반환"""
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        parts = SENTENCE_BOUNDARY.split(buffer)
+        for sentence in parts[:-1]:
+            if sentence.strip():
+                yield sentence
+        buffer = parts[-1]
+    if buffer.strip():
+        yield buffer
+
+def sse_event(payload, event=None):
+    """Server-Sent Events 형식 직렬화"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def stream_professional_response(prompt, session_id, persona=None, adapter=None):
+    """문장 단위로 정리된 응답을 SSE 이벤트로 생성 (마지막 이벤트에 /chat 메타데이터 포함)"""
+    start = time.perf_counter()
+    try:
+        turn = prepare_counseling_turn(prompt, session_id, persona, adapter)
+        streamer = start_streaming_generation(turn["inputs"], lookup_kv_cache(turn), session_cache_writer(turn),
+                                              turn["adapter"])
+        
+        streamed = ""
+        cleanup_seconds = 0.0
+        for sentence in stream_sentences(streamer):
+            cleanup_start = time.perf_counter()
+            chunk = clean_fragment(sentence).strip()
+            cleanup_seconds += time.perf_counter() - cleanup_start
+            if not chunk:
+                continue
+            if not streamed:
+                FIRST_DELTA_SECONDS.observe(time.perf_counter() - start)
+            delta = f" {chunk}" if streamed else chunk
+            streamed += delta
+            yield sse_event({"delta": delta})
+        
+        # 끝맺음·페르소나 후처리는 전체 응답 기준으로 한 번만 적용
+        cleanup_start = time.perf_counter()
+        finished = finish_response(streamed)
+        STAGE_SECONDS.observe(cleanup_seconds + time.perf_counter() - cleanup_start, stage="cleanup")
+        response = finalize_counseling_turn(turn, finished)
+        if response.startswith(streamed) and len(response) > len(streamed):
+            yield sse_event({"delta": response[len(streamed):]})
+        
+        yield sse_event(
+            build_chat_payload(response, session_id, turn["stage"], turn["emotion"], turn["rag_used"], turn["persona"]["name"]),
+            event="done"
+        )
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint="/chat/stream")
+        
+    except Exception as e:
+        logger.error(f"스트리밍 상담 응답 오류: {e}")
+        yield sse_event({"error": "서버 오류가 발생했습니다."}, event="error")
+
+def start_session_kv_cache():
+    """세션별 KV 캐시 생성 (CHAT_SESSION_KV_CACHE=1일 때만)"""
+    global session_kv_cache
+    from kv_cache import SessionKVCache
+    
+    if not USE_SESSION_KV_CACHE:
+        return None
+    
+    session_kv_cache = SessionKVCache(
+        max_sessions=SESSION_KV_MAX_SESSIONS,
+        max_mb=SESSION_KV_MB,
+        ttl=SESSION_KV_TTL,
+        offload_after=SESSION_KV_OFFLOAD_AFTER,
+        max_offload_mb=SESSION_KV_CPU_MB
+    )
+    logger.info(f"세션 KV 캐시 활성화 (최대 {SESSION_KV_MAX_SESSIONS}세션, {SESSION_KV_MB:.0f}MB)")
+    return session_kv_cache
+
+def start_prefix_cache():
+    """prefix KV 캐시 생성 (CHAT_PREFIX_CACHE=0이면 비활성화)"""
+    global prefix_cache
+    from kv_cache import PrefixKVCache
+    
+    if not USE_PREFIX_CACHE:
+        logger.info("prefix KV 캐시 비활성화")
+        return None
+    
+    prefix_cache = PrefixKVCache(model, tokenizer, max_mb=PREFIX_CACHE_MB,
+                                 run=run_on_engine if model_host is not None else None)
+    
+    # 페르소나 × 단계별 시스템 프롬프트 구간을 미리 prefill (로딩 중 들어온 요청은 해당 키만 바로 계산)
+    startup.progress("kv_cache", "prefix KV 캐시 준비 중")
+    try:
+        prefix_cache.warm({
+            prefix_key(persona_key, stage): context_builder.system_prefix(build_system_message(persona_key, stage))
+            for persona_key in COUNSELOR_PERSONAS
+            for stage in PREFIX_STAGES
+        })
+    except Exception as e:
+        logger.warning(f"prefix KV 미리 계산 실패 - 요청 시 계산: {e}")
+    return prefix_cache
+
+def load_draft_model():
+    """speculative decoding용 draft 모델 로딩 (본 모델과 같은 dtype·토크나이저)"""
+    global speculative
+    from transformers import AutoModelForCausalLM
+    from speculative import SpeculativeDecoder
+    
+    startup.progress("draft", f"draft 모델 로딩 중 ({DRAFT_MODEL})")
+    draft_model = AutoModelForCausalLM.from_pretrained(
+        DRAFT_MODEL,
+        torch_dtype=model.dtype,
+        device_map="auto",
+        trust_remote_code=True
+    ).eval()
+    speculative = SpeculativeDecoder(
+        model,
+        draft_model,
+        num_assistant_tokens=DRAFT_TOKENS,
+        min_acceptance=SPECULATIVE_MIN_ACCEPTANCE,
+        window=SPECULATIVE_WINDOW,
+        retry_after=SPECULATIVE_RETRY_AFTER
+    )
+    logger.info(f"speculative decoding 사용: draft {DRAFT_MODEL} (후보 {DRAFT_TOKENS}개, 최소 수락률 {SPECULATIVE_MIN_ACCEPTANCE})")
+    return speculative
+
+def start_kv_caches():
+    start_prefix_cache()
+    start_session_kv_cache()
+
+def load_components(model_steps=None):
+    """모델 → 배칭 엔진 → KV 캐시, RAG를 백그라운드 스레드 두 개에서 로딩 (진행 상태는 /health/ready)
+    model_steps: 모델·엔진 단계 교체 (통합 서버는 공유 모델 호스트 연결)"""
+    if not USE_RAG:
+        startup.skip("rag", "CHAT_RAG=0")
+        rag_chain = []
+    else:
+        rag_chain = [("rag", load_rag_system)]
+    steps = (model_steps or [("model", load_model), ("engine", start_generation_engine)]) + [("kv_cache", start_kv_caches)]
+    if not DRAFT_MODEL:
+        startup.skip("draft", "CHAT_DRAFT_MODEL 미설정")
+    elif model_steps is not None:
+        # 공유 모델은 모든 생성을 배칭 엔진 스레드에서 실행 (요청별 assisted generation 불가)
+        startup.skip("draft", "통합 추론 서버에서는 speculative decoding 미지원")
+    else:
+        steps.append(("draft", load_draft_model))
+    return startup.start(steps, rag_chain)
+
+def run_on_engine(fn):
+    """공유 모델의 forward는 배칭 엔진 스레드에서 실행 (엔진 시작 전이면 바로 실행)"""
+    if generation_engine is None:
+        return fn()
+    return generation_engine.call(fn).result()
 
 def apply_persona_style(response, persona):
     """페르소나에 맞는 스타일 적용"""
@@ -507,164 +1026,63 @@ def apply_persona_style(response, persona):
     
     return response
 
-def remove_unwanted_patterns(response):
-    """이상한 패턴, 숫자 나열, 토큰 잔여물 제거"""
-    import re
-    
-    # 연속된 숫자와 공백 패턴 제거 (예: "- 5 0 01 21 30 1 00 02 00 40 80...")
-    response = re.sub(r'[-\s]*\d+(?:\s+\d+){3,}.*$', '', response)
-    
-    # 더 강력한 숫자 패턴 제거
-    response = re.sub(r'\d+\s+\d+\s+\d+\s+\d+.*$', '', response)
-    response = re.sub(r'[-\s]*\d{1,3}(?:\s+\d{1,3}){2,}.*$', '', response)
-    
-    # 대시나 하이픈으로 시작하는 숫자 나열 패턴 강력 제거
-    response = re.sub(r'-\s*\d.*$', '', response)
-    
-    # 특수 토큰 패턴 제거
-    response = re.sub(r'<[^>]*>', '', response)  # <token> 형태
-    response = re.sub(r'\[.*?\]', '', response)  # [token] 형태
-    
-    # 반복되는 단일 문자나 숫자 제거
-    response = re.sub(r'(.)\1{3,}', '', response)  # 같은 문자 4개 이상 반복
-    
-    # 이상한 구두점 패턴 제거
-    response = re.sub(r'[.]{3,}', '.', response)  # 연속된 점들
-    response = re.sub(r'[-]{2,}', '', response)   # 연속된 대시들
-    
-    # 문장 끝에 붙은 이상한 패턴 제거 (더 강화)
-    response = re.sub(r'\s*[-\d\s.]*$', '', response)
-    response = re.sub(r'\s*\d+.*$', '', response)  # 숫자로 끝나는 모든 패턴 제거
-    
-    # 한글과 영어를 모두 허용하되 이상한 문자 조합만 제거
-    response = re.sub(r'[^\w\s가-힣A-Za-z.,!?]+', '', response)
-    
-    return response.strip()
-
-def remove_client_dialogue(response):
-    """사용자 대화 부분 제거"""
-    # 사용자 발화 패턴 제거 (내담자 -> 사용자로 변경)
-    patterns_to_remove = [
-        r'사용자\s*:\s*[^.]*',  # "사용자: ..." 패턴
-        r'내담자\s*:\s*[^.]*',  # "내담자: ..." 패턴 (기존)
-        r'사용자가\s*"[^"]*"[^.]*',  # "사용자가 "..." 패턴  
-        r'내담자가\s*"[^"]*"[^.]*',  # "내담자가 "..." 패턴 (기존)
-        r'[^.]*사용자[^.]*속으로는[^.]*',  # 사용자 언급이 있는 문장
-        r'[^.]*내담자[^.]*속으로는[^.]*',  # 내담자 언급이 있는 문장 (기존)
-        r'일상생활에서는[^.]*',  # 일상생활 관련 사용자 응답
-        r'그냥\s*참고\s*넘어가지만[^.]*',  # 특정 사용자 응답 패턴
-        r'제가\s*이상한\s*사람처럼[^.]*',  # 특정 사용자 응답 패턴
-    ]
-    
-    for pattern in patterns_to_remove:
-        response = re.sub(pattern, '', response, flags=re.IGNORECASE)
-    
-    # 문장 앞뒤 공백 정리
-    response = re.sub(r'\s+', ' ', response).strip()
-    
-    # 빈 문장이나 너무 짧은 응답 방지
-    if len(response.strip()) < 10:
-        response = "말씀해주신 내용을 잘 들었습니다."
-    
-    return response
-
-def clean_response(response):
-    """응답 정리 및 품질 향상"""
-    # 숫자만으로 이루어진 부분 제거 (영어는 유지)
-    response = re.sub(r'\b\d+\b', '', response)
-    
-    # 금지 단어 제거 (제공된 프롬프트 기준)
-    forbidden_words = ['상담실', '내담자', '환영', 'LLM', '안녕하세요', '만나서 반가워요', '마음자리에 오신 걸 환영합니다']
-    for word in forbidden_words:
-        response = response.replace(word, '')
-    
-    # 불완전한 단어나 어색한 표현 수정
-    corrections = {
-        '어주셔서': '와주셔서',
-        '전진히': '진지하게',
-        '함께 해나가면': '함께 나아가면',
-        '정말 용기있는': '정말 용기 있는',
-        '선택을 하신': '선택을 하신',
-        '거예요': '것이에요',
-        '해보시는': '해보시는',
-        '말씀해주시는': '말씀해주시는'
-    }
-    
-    for wrong, correct in corrections.items():
-        response = response.replace(wrong, correct)
-    
-    # 공백 정리
-    response = re.sub(r'\s+', ' ', response).strip()
-    
-    # 어색한 연결어 수정
-    response = re.sub(r'\.(\s*)앞으로', '. 앞으로', response)
-    response = re.sub(r'거예요\.(\s*)([가-힣])', r'것이에요. \2', response)
-    
-    # 이상한 패턴이나 불완전한 문장 제거
-    sentences = re.split(r'(?<=[.!?])\s+', response.strip())
-    valid_sentences = []
-    
-    for sentence in sentences:
-        sentence = sentence.strip()
-        # 한글이나 영어가 포함되고 의미있는 길이의 문장만 유지
-        if len(sentence) > 5 and re.search(r'[가-힣A-Za-z]', sentence):
-            # 숫자나 이상한 문자가 대부분인 문장 제외
-            if len(re.findall(r'[가-힣A-Za-z]', sentence)) >= len(sentence) * 0.3:
-                valid_sentences.append(sentence)
-    
-    # 2-4문장으로 제한
-    if len(valid_sentences) > 4:
-        valid_sentences = valid_sentences[:4]
-    elif len(valid_sentences) < 2:
-        # 너무 짧은 경우 기본 응답 추가
-        if valid_sentences:
-            valid_sentences.append("좀 더 자세히 말씀해주실 수 있을까요?")
-        else:
-            valid_sentences = ["말씀해주신 내용이 정말 중요하다고 생각해요.", "좀 더 자세히 이야기해주실 수 있을까요?"]
-    
-    # 문장 완성도 체크 및 자연스러운 마무리
-    complete_sentences = []
-    for sentence in valid_sentences:
-        if not sentence.endswith(('.', '요', '다', '네요', '어요', '까요', '?')):
-            if '습니다' not in sentence:
-                sentence += '요'
-        complete_sentences.append(sentence)
-    
-    response = ' '.join(complete_sentences)
-    
-    # 중복 표현 제거
-    response = re.sub(r'(.{3,}?)\1+', r'\1', response)
-    
-    # 최종 품질 체크 (한글 또는 영어 포함 확인)
-    if not response or len(response) < 20 or not re.search(r'[가-힣A-Za-z]', response):
-        response = "말씀해주신 내용이 정말 중요하다고 생각해요. 좀 더 자세히 이야기해주실 수 있을까요?"
-    
-    return response
-
 def save_counseling_record(session_id, user_message, bot_response, emotion, stage, rag_used=False):
-    """상담 기록 저장"""
-    if session_id not in conversation_history:
-        conversation_history[session_id] = []
-    
-    conversation_history[session_id].append({
+    """상담 기록 저장 (프롬프트 구성용 토큰 id·요약을 함께 저장하고 그 값을 반환)"""
+    context = context_builder.annotate(user_message, bot_response, emotion) if context_builder is not None else None
+    session_store.append_turn(session_id, {
         'timestamp': datetime.now().isoformat(),
         'user': user_message,
         'assistant': bot_response,
         'detected_emotion': emotion,
         'counseling_stage': stage,
-        'turn_number': len(conversation_history[session_id]) + 1,
-        'rag_enhanced': rag_used
+        'turn_number': session_store.turn_count(session_id) + 1,
+        'rag_enhanced': rag_used,
+        'context': context
     })
+    return context
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """서버 상태 확인"""
     return jsonify({
         'status': 'ok',
+        'ready': startup.ready,
         'model_loaded': model is not None,
+        'rag_loaded': rag_retriever is not None,
+        'rag_cache': rag_retriever.stats() if rag_retriever is not None else None,
+        'model_host': model_host.stats() if model_host is not None else None,
+        'speculative': speculative.stats() if speculative is not None else None,
         'service': 'Professional Counseling AI with Personas'
     })
 
+@app.route('/health/live', methods=['GET'])
+def health_live():
+    """프로세스 생존 확인 (로딩 중에도 200, 필수 구성 요소 로딩 실패 시 503)"""
+    snapshot = startup.snapshot()
+    failed = [name for name, c in snapshot['components'].items() if c['state'] == 'failed']
+    return jsonify({
+        'status': 'alive' if snapshot['live'] else 'failed',
+        'uptime_s': snapshot['uptime_s'],
+        'failed': failed
+    }), 200 if snapshot['live'] else 503
+
+@app.route('/health/ready', methods=['GET'])
+def health_ready():
+    """요청 처리 준비 여부 (구성 요소별 상태·진행 단계·소요 시간, 준비 전에는 503)"""
+    snapshot = startup.snapshot()
+    return jsonify(snapshot), 200 if snapshot['ready'] else 503
+
+def not_ready_response():
+    """모델 로딩 전 생성 요청 응답 (503 + Retry-After)"""
+    response = jsonify({'error': '모델을 불러오는 중입니다. 잠시 후 다시 시도해주세요.', 'startup': startup.snapshot()})
+    response.headers['Retry-After'] = '10'
+    return response, 503
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus 텍스트 형식 지표 (단계별 시간, 토큰 수, 대기열, 캐시 적중률)"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
 @app.route('/personas', methods=['GET'])
 def get_personas():
     """사용 가능한 상담사 페르소나 목록"""
@@ -681,9 +1099,29 @@ def get_personas():
         'default_persona': 'empathetic'
     })
 
+def build_chat_payload(response, session_id, stage, emotion, rag_used, persona_name):
+    """/chat 응답 본문 구성 (스트리밍 마지막 이벤트와 공유)"""
+    session_info = get_counseling_stage(session_id)
+    
+    return {
+        'response': response,
+        'session_id': session_id,
+        'counseling_stage': stage,
+        'detected_emotion': emotion,
+        'turn_count': session_info['turn_count'],
+        'stage_description': COUNSELING_STAGES.get(stage, "알 수 없음"),
+        'rag_enhanced': rag_used,
+        'persona': session_info['persona'],
+        'persona_name': persona_name
+    }
+
 @app.route('/chat', methods=['POST'])
+@REQUEST_SECONDS.time(endpoint="/chat")
 def professional_chat():
     """전문적인 심리상담 채팅 (페르소나 지원)"""
+    if not startup.ready:
+        return not_ready_response()
+    
     try:
         data = request.json
         message = data.get('message', '')
@@ -693,37 +1131,55 @@ def professional_chat():
         if not message.strip():
             return jsonify({'error': '메시지가 비어있습니다.'}), 400
         
+        try:
+            adapter = resolve_adapter(data.get('adapter'))  # 어댑터 선택 (공유 모델 서버)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         # 전문 상담 응답 생성 (페르소나 포함)
-        response, stage, emotion, rag_used, persona_name = generate_professional_response(message, session_id, persona)
+        response, stage, emotion, rag_used, persona_name = generate_professional_response(message, session_id, persona, adapter)
         
         # 세션 정보 포함해서 응답
-        session_info = get_counseling_stage(session_id)
-        
-        return jsonify({
-            'response': response,
-            'session_id': session_id,
-            'counseling_stage': stage,
-            'detected_emotion': emotion,
-            'turn_count': session_info['turn_count'],
-            'stage_description': COUNSELING_STAGES.get(stage, "알 수 없음"),
-            'rag_enhanced': rag_used,
-            'persona': session_info['persona'],
-            'persona_name': persona_name
-        })
+        return jsonify(build_chat_payload(response, session_id, stage, emotion, rag_used, persona_name))
         
     except Exception as e:
         logger.error(f"전문 상담 채팅 오류: {e}")
         return jsonify({'error': '서버 오류가 발생했습니다.'}), 500
 
+@app.route('/chat/stream', methods=['POST'])
+def professional_chat_stream():
+    """스트리밍 상담 채팅 (SSE: 문장 단위 delta 이벤트 → 마지막 done 이벤트)"""
+    if not startup.ready:
+        return not_ready_response()
+    
+    data = request.json or {}
+    message = data.get('message', '')
+    session_id = data.get('session_id', 'default')
+    persona = data.get('persona', None)
+    
+    if not message.strip():
+        return jsonify({'error': '메시지가 비어있습니다.'}), 400
+    
+    try:
+        adapter = resolve_adapter(data.get('adapter'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return Response(
+        stream_with_context(stream_professional_response(message, session_id, persona, adapter)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/session/<session_id>/analysis', methods=['GET'])
 def session_analysis(session_id):
     """세션 분석 정보"""
     try:
-        if session_id not in session_data:
+        data = session_store.get_session(session_id)
+        if data is None:
             return jsonify({'error': '세션을 찾을 수 없습니다.'}), 404
         
-        data = session_data[session_id]
-        history = conversation_history.get(session_id, [])
+        last_turn = session_store.recent_turns(session_id, 1)
         
         return jsonify({
             'session_id': session_id,
@@ -731,8 +1187,8 @@ def session_analysis(session_id):
             'current_stage': data['stage'],
             'stage_description': COUNSELING_STAGES.get(data['stage'], "알 수 없음"),
             'identified_emotions': data['emotions'],
-            'conversation_length': len(history),
-            'last_update': history[-1]['timestamp'] if history else None,
+            'conversation_length': session_store.turn_count(session_id),
+            'last_update': last_turn[-1]['timestamp'] if last_turn else None,
             'persona': data['persona'],
             'persona_name': COUNSELOR_PERSONAS[data['persona']]['name']
         })
@@ -744,25 +1200,13 @@ def session_analysis(session_id):
 if __name__ == "__main__":
     logger.info("LoRA 파인튜닝된 전문 심리상담 AI 서버 시작 (양자화 없음)...")
     
-    # 모델 로드
-    model_loaded = load_model()
-    
-    # RAG 시스템 로드
-    rag_loaded = load_rag_system()
-    
-    if model_loaded:
-        if rag_loaded:
-            logger.info("LoRA + RAG 통합 전문 심리상담 서버를 포트 5003에서 시작합니다...")
-            logger.info("상담 모델: LoRA 파인튜닝된 Midm-2.0-Base-Instruct (float16, 양자화 없음)")
-            logger.info("상담 단계: 라포형성 → 문제탐색 → 목표설정 → 개입단계")
-            logger.info("RAG 시스템: 전문 상담 지식 검색 활성화")
-        else:
-            logger.info("LoRA 파인튜닝된 전문 심리상담 서버를 포트 5003에서 시작합니다...")
-            logger.info("상담 모델: LoRA 파인튜닝된 Midm-2.0-Base-Instruct (float16, 양자화 없음)")
-            logger.info("상담 단계: 라포형성 → 문제탐색 → 목표설정 → 개입단계")
-            logger.warning("RAG 시스템 비활성화 - 기본 모드로 실행")
-        
-        app.run(host='0.0.0.0', port=5003, debug=False)
-    else:
-        logger.error("LoRA 모델 로딩 실패로 서버를 시작할 수 없습니다.")
-        sys.exit(1)
+    # GPU 설정 (RAG 임베딩 모델이 CUDA를 먼저 초기화할 수 있으므로 로딩 스레드 시작 전에)
+    os.environ["CUDA_VISIBLE_DEVICES"] = "0"
+    
+    # 모델·RAG는 백그라운드에서 로딩하고 HTTP 서버는 바로 시작 (준비 여부는 /health/ready)
+    load_components()
+    
+    logger.info(f"전문 심리상담 서버를 포트 {CHAT_PORT}에서 시작합니다 (모델 로딩은 백그라운드에서 진행)...")
+    logger.info("상담 모델: LoRA 파인튜닝된 Midm-2.0-Base-Instruct (float16, 양자화 없음)")
+    logger.info("상담 단계: 라포형성 → 문제탐색 → 목표설정 → 개입단계")
+    app.run(host='0.0.0.0', port=CHAT_PORT, debug=False)
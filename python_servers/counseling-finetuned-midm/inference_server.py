@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+채팅·리포트 통합 추론 서버 (포트 5003 + 5004, 프로세스 하나)
+베이스 모델을 한 번만 올리고 LoRA 어댑터를 이름별로 등록해 두 서버가 함께 씁니다.
+- 채팅(/chat, /chat/stream, ...)은 CHAT_PORT, 리포트(/report, /report/jobs, ...)는 REPORT_PORT로 기존과 같은 주소
+- 생성은 모두 연속 배칭 엔진 하나에서 실행되고, 채팅·리포트 요청이 어댑터가 달라도 한 배치로 묶입니다
+- /chat, /chat/stream 요청 본문에 "adapter"를 주면 등록된 다른 어댑터로 생성 (INFERENCE_ADAPTERS로 추가)
+- 두 포트는 바로 열고 모델은 백그라운드에서 로딩 (각 포트의 /health/ready로 준비 여부 확인)
+
+예)
+    python inference_server.py
+    INFERENCE_ADAPTERS="chat_v2=/models/counseling-v2" python inference_server.py
+"""
+
+import logging
+import os
+import threading
+
+from werkzeug.serving import make_server
+
+import final_server
+import report_server
+from model_host import ModelHost, parse_adapter_spec
+
+logger = logging.getLogger(__name__)
+
+
+def build_model_host():
+    """채팅·리포트 어댑터 (+ INFERENCE_ADAPTERS 추가 어댑터)를 등록한 모델 호스트"""
+    if final_server.MERGED_MODEL_PATH or report_server.merged_model_path:
+        logger.warning("통합 서버는 어댑터를 병합하지 않고 베이스 + 어댑터로 로딩합니다 (*_MERGED_MODEL 무시)")
+    if report_server.model_name != final_server.BASE_MODEL_NAME:
+        raise ValueError(f"채팅과 리포트의 베이스 모델이 다릅니다: "
+                         f"{final_server.BASE_MODEL_NAME} ≠ {report_server.model_name}")
+    adapters = {"chat": final_server.ADAPTER_PATH, "report": report_server.adapter_path}
+    adapters.update(parse_adapter_spec(os.getenv("INFERENCE_ADAPTERS", "")))
+    return ModelHost(final_server.BASE_MODEL_NAME, adapters, default_adapter="chat").load()
+
+
+def load_components():
+    """공유 모델 → 배칭 엔진(+ 리포트 연결) → KV 캐시, RAG를 백그라운드에서 로딩"""
+    shared = {}
+    report_server.startup.progress("model", "공유 모델 로딩 대기")
+    
+    def load_shared_model():
+        try:
+            shared["host"] = build_model_host()
+        except Exception as e:
+            report_server.startup.fail("model", e)  # 리포트는 기본 리포트 모드로
+            raise
+        final_server.attach_model_host(shared["host"], "chat")
+    
+    def start_engine():
+        try:
+            engine = final_server.start_generation_engine()
+        except Exception as e:
+            report_server.startup.fail("model", e)
+            raise
+        report_server.startup.run("model", lambda: report_server.attach_model_host(shared["host"], "report", engine))
+        return engine
+    
+    return final_server.load_components([("model", load_shared_model), ("engine", start_engine)])
+
+
+def serve(app, port, name):
+    server = make_server("0.0.0.0", port, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, name=f"{name}-http", daemon=True)
+    thread.start()
+    logger.info(f"{name} 서버를 포트 {port}에서 시작합니다...")
+    return server, thread
+
+
+if __name__ == "__main__":
+    logger.info("채팅·리포트 통합 추론 서버 시작 (베이스 모델 1회 로딩, 다중 LoRA 어댑터)...")
+
+    # 공유 모델 로딩이 실패하면 채팅 /health/live가 503 (리포트는 기본 리포트 모드)
+    load_components()
+
+    servers = [serve(final_server.app, final_server.CHAT_PORT, "채팅"),
+               serve(report_server.app, report_server.REPORT_PORT, "리포트")]
+    try:
+        for _, thread in servers:
+            thread.join()
+    except KeyboardInterrupt:
+        for server, _ in servers:
+            server.shutdown()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+다중 키워드 매처
+감정·위험·동기 키워드 사전 전체를 한 번 컴파일해 두고, 텍스트를 한 번만 훑어
+카테고리별 등장 횟수와 위치를 모두 반환합니다.
+
+여러 키워드를 하나의 정규식 alternation(긴 키워드 우선)으로 묶어 C 수준에서 한 번에 스캔하고,
+매칭된 키워드와 겹치는 다른 키워드는 컴파일 시 계산해 둔 관계로 보충합니다.
+- 포함: 매칭된 키워드 안에 들어 있는 키워드 (항상 함께 등장)
+- 걸침: 매칭된 키워드 끝부분에서 시작해 뒤로 이어지는 키워드 (해당 위치만 확인)
+결과는 Aho-Corasick의 전체 매칭 결과(겹치는 매칭 포함)와 같습니다.
+"""
+
+import re
+
+
+def _contained(keywords):
+    """키워드별로 그 안에 (다른 위치 포함) 등장하는 키워드와 오프셋 목록"""
+    contained = {}
+    for outer in keywords:
+        found = []
+        for inner in keywords:
+            start = outer.find(inner)
+            while start != -1:
+                if not (inner == outer and start == 0):
+                    found.append((start, inner))
+                start = outer.find(inner, start + 1)
+        contained[outer] = found
+    return contained
+
+
+def _straddling(keywords):
+    """키워드별로 그 끝부분(접미사)에서 시작하는 더 긴 키워드와 오프셋 목록"""
+    straddling = {}
+    for outer in keywords:
+        found = []
+        for inner in keywords:
+            for offset in range(max(1, len(outer) - len(inner) + 1), len(outer)):
+                if inner.startswith(outer[offset:]):
+                    found.append((offset, inner))
+        straddling[outer] = found
+    return straddling
+
+
+class KeywordMatcher:
+    """{라벨: [키워드, ...]} 사전을 한 번 컴파일해 단일 패스로 스캔"""
+
+    def __init__(self, categories):
+        self.labels = list(categories)
+        self._labels_by_keyword = {}
+        for label, words in categories.items():
+            for word in words:
+                self._labels_by_keyword.setdefault(word, []).append(label)
+
+        keywords = sorted(self._labels_by_keyword, key=len, reverse=True)
+        # 매칭 1건당 기록할 (오프셋, 키워드) 목록: 자기 자신 + 포함된 키워드
+        self._expansions = {k: [(0, k)] + found for k, found in _contained(keywords).items()}
+        self._straddling = {k: found for k, found in _straddling(keywords).items() if found}
+        self._pattern = re.compile("|".join(re.escape(k) for k in keywords))
+
+    def scan(self, text):
+        """
+        라벨별 매칭 결과 반환 (매칭된 라벨만, 선언 순서 유지)
+        {라벨: {"count": 등장 횟수, "positions": [(시작 위치, 키워드), ...]}}
+        """
+        occurrences = []
+        straddling = self._straddling
+        for m in self._pattern.finditer(text):
+            start, word = m.start(), m.group()
+            occurrences.extend((start + offset, inner) for offset, inner in self._expansions[word])
+            if word in straddling:
+                occurrences.extend((start + offset, inner) for offset, inner in straddling[word]
+                                   if text.startswith(inner, start + offset))
+        occurrences.sort()
+
+        hits = {}
+        for occurrence in occurrences:
+            for label in self._labels_by_keyword[occurrence[1]]:
+                hit = hits.get(label)
+                if hit is None:
+                    hit = hits[label] = {"count": 0, "positions": []}
+                hit["positions"].append(occurrence)
+        for hit in hits.values():
+            hit["count"] = len(hit["positions"])
+        return {label: hits[label] for label in self.labels if label in hits}
+
+    def first_match(self, text, default=None):
+        """선언 순서상 가장 먼저 정의된 라벨 중 매칭된 것"""
+        hits = self.scan(text)
+        return next(iter(hits), default)
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+KV 캐시 재사용 유틸리티
+페르소나×상담 단계별로 고정된 시스템 프롬프트의 past_key_values를 미리 계산해 두고,
+요청마다 달라지는 뒷부분(이전 대화, 메모, 사용자 메시지)만 prefill 합니다.
+세션 KV 캐시는 직전 턴까지의 대화를 다음 턴에 렌더링될 형태 그대로 보관해 새 메시지만 prefill 합니다.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+from transformers.cache_utils import DynamicCache
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+def to_legacy_cache(cache):
+    """Cache 객체/튜플을 레이어별 (key, value) 튜플로 변환"""
+    if hasattr(cache, "to_legacy_cache"):
+        return cache.to_legacy_cache()
+    return tuple(cache)
+
+
+def to_dynamic_cache(legacy):
+    """model.generate에 넘길 수 있는 DynamicCache로 변환"""
+    return DynamicCache.from_legacy_cache(legacy)
+
+
+def crop_cache(legacy, length):
+    """앞쪽 length 토큰까지만 남긴 뷰 (복사 없음, 원본은 생성 중 변경되지 않음)"""
+    return tuple((k[:, :, :length], v[:, :, :length]) for k, v in legacy)
+
+
+def cache_nbytes(legacy):
+    return sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in legacy)
+
+
+def common_prefix_length(a, b):
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+def prefill(model, input_ids):
+    """토큰 id 리스트를 한 번에 prefill 하고 레이어별 KV 반환"""
+    ids = torch.tensor([input_ids], device=model.device)
+    with torch.no_grad():
+        outputs = model(input_ids=ids, attention_mask=torch.ones_like(ids), use_cache=True)
+    return to_legacy_cache(outputs.past_key_values)
+
+
+def extend(model, legacy, input_ids):
+    """앞부분 KV 뒤에 토큰 id들을 이어서 prefill 하고 전체 KV 반환 (원본 KV는 변경하지 않음)"""
+    cached = legacy[0][0].shape[2]
+    ids = torch.tensor([input_ids], device=model.device)
+    with torch.no_grad():
+        outputs = model(
+            input_ids=ids,
+            attention_mask=torch.ones((1, cached + len(input_ids)), dtype=torch.long, device=model.device),
+            position_ids=torch.arange(cached, cached + len(input_ids), device=model.device)[None, :],
+            past_key_values=to_dynamic_cache(legacy),
+            use_cache=True
+        )
+    return to_legacy_cache(outputs.past_key_values)
+
+
+def replay_cache(model, token_ids, cache, replay_ids, run=None):
+    """
+    생성에 쓴 KV(token_ids)를 다음 턴에 다시 렌더링될 토큰(replay_ids) 기준으로 맞춤
+    일치하는 앞부분은 그대로 쓰고 달라진 뒷부분(메모 없는 메시지, 정리된 응답)만 이어서 prefill 합니다.
+    run: prefill 실행기 (PrefixKVCache와 같음). replay_ids 전체의 KV 반환 (일치하는 앞부분이 없으면 None)
+    """
+    common = min(common_prefix_length(token_ids, replay_ids), cache[0][0].shape[2])
+    if common <= 0:
+        return None
+    cache = crop_cache(cache, common)
+    tail = replay_ids[common:]
+    if not tail:
+        return cache
+    if run is not None:
+        return run(lambda: extend(model, cache, tail))
+    return extend(model, cache, tail)
+
+
+class PrefixKVCache:
+    """키별 고정 프롬프트 앞부분의 KV를 보관하는 LRU 캐시 (용량은 MB 단위)"""
+
+    def __init__(self, model, tokenizer, max_mb=1024, run=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_bytes = int(max_mb * MB)
+        # prefill 실행기 run(fn) (공유 다중 LoRA 모델이면 배칭 엔진 스레드에서 실행, None이면 호출 스레드에서)
+        self.run = run
+
+        self._entries = OrderedDict()  # key -> {"text", "ids", "cache", "nbytes"}
+        self._building = {}  # key -> threading.Event (같은 키를 동시에 중복 계산하지 않도록 대기)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "reused_tokens": 0, "bytes": 0}
+
+    def _build(self, key, prefix_text):
+        ids = self.tokenizer(prefix_text, return_token_type_ids=False)["input_ids"]
+        if self.run is not None:
+            cache = self.run(lambda: prefill(self.model, ids))
+        else:
+            cache = prefill(self.model, ids)
+        return {"text": prefix_text, "ids": ids, "cache": cache, "nbytes": cache_nbytes(cache)}
+
+    def _store(self, key, entry):
+        if entry["nbytes"] > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.stats["bytes"] -= old["nbytes"]
+        self._entries[key] = entry
+        self.stats["bytes"] += entry["nbytes"]
+        while self.stats["bytes"] > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.stats["bytes"] -= evicted["nbytes"]
+            self.stats["evictions"] += 1
+
+    def lookup(self, key, prefix_text, input_ids):
+        """input_ids 앞부분과 일치하는 캐시 KV와 재사용 토큰 수 반환 (없으면 None, 0)"""
+        if not prefix_text:
+            return None, 0
+
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry["text"] == prefix_text:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    break
+                building = self._building.get(key)
+                if building is None:
+                    # 이 요청이 계산 (같은 키의 다른 요청은 끝날 때까지 기다렸다가 다시 조회)
+                    self._building[key] = threading.Event()
+                    self.stats["misses"] += 1
+            if building is None:
+                entry = self._build_and_store(key, prefix_text)
+                break
+            building.wait()
+
+        # 토큰 경계가 달라질 수 있으므로 실제로 일치하는 길이만 재사용 (마지막 토큰은 logits 계산용으로 남김)
+        reused = min(common_prefix_length(entry["ids"], input_ids), len(input_ids) - 1)
+        if reused <= 0:
+            return None, 0
+        with self._lock:
+            self.stats["reused_tokens"] += reused
+        return crop_cache(entry["cache"], reused), reused
+
+    def _build_and_store(self, key, prefix_text):
+        try:
+            entry = self._build(key, prefix_text)
+            with self._lock:
+                self._store(key, entry)
+            return entry
+        finally:
+            with self._lock:
+                self._building.pop(key).set()
+
+    def warm(self, prefixes):
+        """{key: prefix_text} 전체를 미리 계산 (이미 있거나 다른 요청이 계산 중인 키는 건너뜀)"""
+        for key, prefix_text in prefixes.items():
+            with self._lock:
+                entry = self._entries.get(key)
+                if (entry is not None and entry["text"] == prefix_text) or key in self._building:
+                    continue
+                self._building[key] = threading.Event()
+            self._build_and_store(key, prefix_text)
+        logger.info(f"prefix KV 캐시 준비 완료: {len(self._entries)}개, {self.stats['bytes'] / MB:.1f}MB")
+
+
+def move_cache(legacy, device):
+    """device 하나 또는 레이어별 device 목록으로 이동 (device_map으로 나뉜 모델은 레이어마다 다름)"""
+    devices = device if isinstance(device, (list, tuple)) else [device] * len(legacy)
+    return tuple((k.to(d), v.to(d)) for (k, v), d in zip(legacy, devices))
+
+
+class SessionKVCache:
+    """
+    세션별 직전 턴의 KV 보관 (다음 턴에는 새로 추가된 토큰만 prefill)
+    - 최대 세션 수 초과 시 LRU, TTL 경과 시 삭제
+    - 일정 시간 사용되지 않은 세션은 CPU RAM으로 내려 GPU 메모리 확보
+    """
+
+    def __init__(self, max_sessions=64, max_mb=4096, ttl=1800, offload_after=60, max_offload_mb=16384):
+        self.max_sessions = max_sessions
+        self.max_bytes = int(max_mb * MB)
+        self.ttl = ttl
+        self.offload_after = offload_after
+        self.max_offload_bytes = int(max_offload_mb * MB)
+
+        self._entries = OrderedDict()  # session_id -> {"ids", "cache", "nbytes", "offloaded", "last_used"}
+        self._lock = threading.Lock()
+        self.stats = {
+            "hits": 0, "misses": 0, "reused_tokens": 0, "evictions": 0, "offloads": 0,
+            "device_bytes": 0, "offloaded_bytes": 0
+        }
+
+    def _account(self, entry, sign):
+        key = "offloaded_bytes" if entry["offloaded"] else "device_bytes"
+        self.stats[key] += sign * entry["nbytes"]
+
+    def _drop(self, session_id):
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self._account(entry, -1)
+        return entry
+
+    def _sweep(self, now):
+        """TTL 만료 삭제 → 유휴 세션 CPU 이동 → 용량/세션 수 상한 적용 (오래된 순)"""
+        for session_id, entry in list(self._entries.items()):
+            idle = now - entry["last_used"]
+            if idle > self.ttl:
+                self._drop(session_id)
+                self.stats["evictions"] += 1
+            elif idle > self.offload_after and not entry["offloaded"]:
+                self._offload(entry)
+
+        while len(self._entries) > self.max_sessions:
+            self._drop(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+        # 장치 메모리 상한 초과 시 오래된 세션부터 CPU로 이동
+        for entry in self._entries.values():
+            if self.stats["device_bytes"] <= self.max_bytes:
+                break
+            if not entry["offloaded"]:
+                self._offload(entry)
+
+        # CPU 메모리 상한 초과 시 오래된 세션부터 삭제
+        for session_id in [sid for sid, e in self._entries.items() if e["offloaded"]]:
+            if self.stats["offloaded_bytes"] <= self.max_offload_bytes:
+                break
+            self._drop(session_id)
+            self.stats["evictions"] += 1
+
+    def _offload(self, entry):
+        self._account(entry, -1)
+        entry["cache"] = move_cache(entry["cache"], "cpu")
+        entry["offloaded"] = True
+        self._account(entry, 1)
+        self.stats["offloads"] += 1
+
+    def lookup(self, session_id, input_ids, now=None):
+        """직전 턴 KV 중 input_ids와 일치하는 앞부분 반환 (없으면 None, 0)"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._sweep(now)
+            entry = self._entries.get(session_id)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None, 0
+
+            reused = min(common_prefix_length(entry["ids"], input_ids), len(input_ids) - 1)
+            if reused <= 0:
+                self.stats["misses"] += 1
+                return None, 0
+
+            if entry["offloaded"]:
+                self._account(entry, -1)
+                entry["cache"] = move_cache(entry["cache"], entry["devices"])
+                entry["offloaded"] = False
+                self._account(entry, 1)
+            entry["last_used"] = now
+            self._entries.move_to_end(session_id)
+            self.stats["hits"] += 1
+            self.stats["reused_tokens"] += reused
+            return crop_cache(entry["cache"], reused), reused
+
+    def store(self, session_id, ids, cache, now=None):
+        """이번 턴까지 처리된 토큰 id와 그 KV 저장 (배치 텐서와 분리된 사본)"""
+        now = time.monotonic() if now is None else now
+        cache = tuple((k.clone(), v.clone()) for k, v in cache)
+        entry = {
+            "ids": list(ids),
+            "cache": cache,
+            "nbytes": cache_nbytes(cache),
+            "devices": [k.device for k, _ in cache],
+            "offloaded": False,
+            "last_used": now
+        }
+        with self._lock:
+            self._drop(session_id)
+            if entry["nbytes"] > self.max_bytes:
+                return
+            self._entries[session_id] = entry
+            self._account(entry, 1)
+            self._sweep(now)
+
+    def discard(self, session_id):
+        with self._lock:
+            self._drop(session_id)
+
+    def __len__(self):
+        return len(self._entries)
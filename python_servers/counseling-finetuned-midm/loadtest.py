@@ -0,0 +1,546 @@
+#!/usr/bin/env python3
+"""
+상담 서버(/chat, 포트 5003)·리포트 서버(/report, 포트 5004) 부하 테스트
+
+Midm-2.0 대신 작은 로컬 causal LM + LoRA 어댑터를 만들어 환경 변수(CHAT_BASE_MODEL / REPORT_BASE_MODEL 등)로
+바꿔 끼운 뒤 각 서버를 별도 프로세스로 띄우고, 페르소나 × 상담 단계를 거치는 합성 다회차 세션을
+동시성 단계별로 재생합니다. 결과(처리량, TTFT, 지연 p50/p95/p99, tokens/s, 최대 CPU/GPU 메모리)는
+JSON으로 저장해 커밋 간 회귀를 비교합니다.
+
+- TTFT: /chat/stream의 첫 delta 이벤트까지 (서버가 문장 단위로 보내므로 첫 문장까지의 시간)
+- tokens/s: 후처리된 응답을 같은 토크나이저로 센 출력 토큰 수 ÷ 단계 전체 시간 (근삿값)
+- 메모리: 서버 프로세스 RSS (/proc), GPU는 nvidia-smi가 있을 때만
+
+사용 예:
+    python loadtest.py --concurrency 1 4 8 --sessions 16 --turns 10
+    python loadtest.py --servers chat --stream 0
+    python loadtest.py --compare loadtest_results/loadtest_abc1234.json
+    # 작은 모델 대신 실제 모델로
+    python loadtest.py --base_model K-intelligence/Midm-2.0-Base-Instruct --adapter .
+    # 병합 모델과 비교 (python export_model.py --output exported/midm-merged)
+    python loadtest.py --base_model K-intelligence/Midm-2.0-Base-Instruct --merged exported/midm-merged \
+        --compare loadtest_results/loadtest_abc1234.json
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# 서버 스크립트와 모델 교체용 환경 변수
+SERVERS = {
+    "chat": {"script": "final_server.py", "base_env": "CHAT_BASE_MODEL", "adapter_env": "CHAT_ADAPTER_PATH",
+             "port_env": "CHAT_PORT", "merged_env": "CHAT_MERGED_MODEL"},
+    "report": {"script": "report_server.py", "base_env": "REPORT_BASE_MODEL", "adapter_env": "REPORT_ADAPTER_PATH",
+               "port_env": "REPORT_PORT", "merged_env": "REPORT_MERGED_MODEL"},
+}
+
+# final_server.update_session_data의 단계 전환 시점 (turn_count 기준)
+STAGE_THRESHOLDS = [(9, "intervention"), (6, "goal_setting"), (3, "exploration"), (0, "initial")]
+
+# 단계별 합성 사용자 발화
+STAGE_MESSAGES = {
+    "initial": [
+        "요즘 잠을 잘 못 자요. 밤마다 생각이 많아져요.",
+        "회사 일 때문에 너무 지쳐서 이야기하고 싶었어요.",
+        "별일 아닌데도 자꾸 불안하고 초조해요.",
+        "친구랑 크게 싸우고 나서 마음이 계속 답답해요.",
+    ],
+    "exploration": [
+        "팀장님이 회의 때마다 제 의견을 무시해서 속상해요.",
+        "주말에도 일 생각이 나서 쉬어도 쉰 것 같지 않아요.",
+        "예전에는 좋아하던 운동도 요즘은 재미없고 의욕이 없어요.",
+        "가족한테 말하면 걱정할까 봐 혼자 참고 있어요.",
+    ],
+    "goal_setting": [
+        "잠이라도 제대로 자고 싶어요. 어떻게 시작하면 좋을까요?",
+        "감정이 올라올 때 바로 반응하지 않는 연습을 해보고 싶어요.",
+        "일과 쉬는 시간을 나누는 게 제 목표인 것 같아요.",
+        "친구에게 먼저 연락해볼 용기를 내고 싶어요.",
+    ],
+    "intervention": [
+        "오늘 알려주신 호흡법을 자기 전에 해볼게요.",
+        "퇴근 후 30분은 휴대폰을 멀리 두는 걸 시도해볼게요.",
+        "불안할 때 떠오르는 생각을 적어보는 건 어떨까요?",
+        "이번 주에 한 번은 산책을 나가보려고 해요.",
+    ],
+}
+
+ASSISTANT_REPLY = "많이 힘드셨겠어요. 조금 더 이야기해 주실 수 있을까요?"
+
+# 서버가 응답을 "<|im_start|>assistant\n" 기준으로 잘라내므로 작은 모델 토크나이저도 같은 형식 사용
+CHATML_TEMPLATE = (
+    "{% for message in messages %}<|im_start|>{{ message['role'] }}\n{{ message['content'] }}<|im_end|>\n{% endfor %}"
+    "{% if add_generation_prompt %}<|im_start|>assistant\n{% endif %}"
+)
+
+
+# -----------------------------
+# 작은 모델 + LoRA 어댑터
+# -----------------------------
+def prepare_tiny_model(workdir, hidden_size=64, layers=2, seed=0):
+    """이 디렉토리의 토크나이저를 쓰는 작은 랜덤 Llama와 LoRA 어댑터 (이미 있으면 재사용)"""
+    base_dir = os.path.join(workdir, "base")
+    adapter_dir = os.path.join(workdir, "adapter")
+    if os.path.exists(os.path.join(base_dir, "config.json")) and \
+            os.path.exists(os.path.join(adapter_dir, "adapter_config.json")):
+        return base_dir, adapter_dir
+
+    from peft import LoraConfig, get_peft_model
+    from transformers import AutoTokenizer
+
+    from benchmark import make_tiny_model
+
+    tokenizer = AutoTokenizer.from_pretrained(HERE)
+    tokenizer.chat_template = CHATML_TEMPLATE
+    model = make_tiny_model(vocab_size=len(tokenizer), hidden_size=hidden_size, layers=layers, seed=seed)
+    model.save_pretrained(base_dir)
+    tokenizer.save_pretrained(base_dir)
+
+    # 실제 어댑터와 같은 대상 모듈·rank
+    with open(os.path.join(HERE, "adapter_config.json"), encoding="utf-8") as f:
+        reference = json.load(f)
+    lora = LoraConfig(r=reference["r"], lora_alpha=reference["lora_alpha"],
+                      target_modules=reference["target_modules"], task_type="CAUSAL_LM")
+    get_peft_model(model, lora).save_pretrained(adapter_dir)
+    print(f"[loadtest] 작은 모델 생성: {base_dir} (+ LoRA {adapter_dir})", flush=True)
+    return base_dir, adapter_dir
+
+
+# -----------------------------
+# 서버 프로세스 / 메모리 측정
+# -----------------------------
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def process_memory_mb(pid, field="VmRSS"):
+    """/proc/<pid>/status의 VmRSS(현재) 또는 VmHWM(최대) (Linux 외에는 None)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def gpu_memory_mb(pid):
+    """nvidia-smi 기준 프로세스 GPU 메모리 (nvidia-smi가 없으면 None)"""
+    if not shutil.which("nvidia-smi"):
+        return None
+    try:
+        out = subprocess.run(["nvidia-smi", "--query-compute-apps=pid,used_memory", "--format=csv,noheader,nounits"],
+                             capture_output=True, text=True, timeout=5).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    used = [float(mb) for p, mb in (line.split(",") for line in out.strip().splitlines() if "," in line)
+            if int(p) == pid]
+    return sum(used) if used else 0.0
+
+
+class MemoryMonitor:
+    """서버 프로세스의 RSS·GPU 메모리를 주기적으로 샘플링해 구간별 최댓값 기록"""
+
+    def __init__(self, pid, interval=0.2, gpu_interval=1.0):
+        self.pid = pid
+        self.interval = interval
+        self.gpu_interval = gpu_interval
+        self.peak_rss = None
+        self.peak_gpu = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        last_gpu = 0.0
+        while not self._stop.wait(self.interval):
+            rss = process_memory_mb(self.pid)
+            if rss is not None:
+                self.peak_rss = max(self.peak_rss or 0.0, rss)
+            if time.monotonic() - last_gpu >= self.gpu_interval:
+                last_gpu = time.monotonic()
+                gpu = gpu_memory_mb(self.pid)
+                if gpu is not None:
+                    self.peak_gpu = max(self.peak_gpu or 0.0, gpu)
+
+    def reset(self):
+        self.peak_rss = self.peak_gpu = None
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class ServerProcess:
+    """서버 스크립트를 작은 모델 설정으로 띄우고 /health/ready가 모델 로드 완료를 알릴 때까지 대기"""
+
+    def __init__(self, name, base_model, adapter, extra_env, log_dir):
+        spec = SERVERS[name]
+        self.name = name
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.env = dict(os.environ, **extra_env, **{spec["base_env"]: base_model, spec["adapter_env"]: adapter,
+                                                   spec["port_env"]: str(self.port)})
+        self.script = spec["script"]
+        self.log_path = os.path.join(log_dir, f"{name}_server.log")
+        self.proc = None
+
+    def start(self, timeout):
+        start = time.perf_counter()
+        self.log = open(self.log_path, "w", encoding="utf-8")
+        self.proc = subprocess.Popen([sys.executable, self.script], cwd=HERE, env=self.env,
+                                     stdout=self.log, stderr=subprocess.STDOUT)
+        while time.perf_counter() - start < timeout:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"{self.name} 서버가 종료되었습니다 (코드 {self.proc.returncode}): {self.log_tail()}")
+            try:
+                status, ready, _ = request_json(f"{self.url}/health/ready", timeout=5)
+            except (urllib.error.URLError, ConnectionError, TimeoutError):
+                time.sleep(0.5)
+                continue
+            # HTTP 서버는 바로 열리고 모델은 백그라운드에서 로딩 (로딩 중에는 503)
+            if status == 503 and ready.get("live"):
+                time.sleep(0.5)
+                continue
+            if status == 200 and ready["components"]["model"]["state"] == "ready":
+                return time.perf_counter() - start
+            raise RuntimeError(f"{self.name} 서버가 모델 없이 시작되었습니다: {self.log_tail()}")
+        raise TimeoutError(f"{self.name} 서버가 {timeout:.0f}초 안에 준비되지 않았습니다: {self.log_tail()}")
+
+    def log_tail(self, lines=20):
+        try:
+            with open(self.log_path, encoding="utf-8", errors="replace") as f:
+                return "".join(f.readlines()[-lines:])
+        except OSError:
+            return ""
+
+    def stop(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        if self.proc is not None:
+            self.log.close()
+
+
+# -----------------------------
+# HTTP 클라이언트
+# -----------------------------
+def request_json(url, payload=None, timeout=600):
+    """(상태 코드, JSON 본문, 소요 초) - payload가 있으면 POST"""
+    data = None if payload is None else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            status, body = resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        status, body = e.code, e.read()
+    elapsed = time.perf_counter() - start
+    try:
+        return status, json.loads(body or b"{}"), elapsed
+    except json.JSONDecodeError:
+        return status, {"raw": body[:200].decode("utf-8", "replace")}, elapsed
+
+
+def stream_chat(url, payload, timeout=600):
+    """/chat/stream SSE 재생 → (done 이벤트 본문, 첫 delta까지 초, 전체 초)"""
+    req = urllib.request.Request(url, data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+                                 headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    ttft, event, done = None, None, None
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        for raw in resp:
+            line = raw.decode("utf-8").rstrip("\n")
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):])
+                if event == "error":
+                    raise RuntimeError(data.get("error"))
+                if event == "done":
+                    done = data
+                elif ttft is None and data.get("delta"):
+                    ttft = time.perf_counter() - start
+            elif not line:
+                event = None
+    if done is None:
+        raise RuntimeError("done 이벤트 없이 스트림이 끝났습니다")
+    elapsed = time.perf_counter() - start
+    return done, elapsed if ttft is None else ttft, elapsed
+
+
+# -----------------------------
+# 합성 세션
+# -----------------------------
+def stage_for_turn(turn):
+    return next(stage for threshold, stage in STAGE_THRESHOLDS if turn >= threshold)
+
+
+def make_sessions(n, turns, personas, seed=0):
+    """세션마다 페르소나를 돌아가며 배정하고, 턴마다 그 시점 상담 단계에 맞는 발화를 선택"""
+    rng = random.Random(seed)
+    return [{"persona": personas[i % len(personas)],
+             "messages": [rng.choice(STAGE_MESSAGES[stage_for_turn(t)]) for t in range(1, turns + 1)]}
+            for i in range(n)]
+
+
+def chat_history_text(session):
+    """리포트 요청용 채팅 내역 (index.js가 보내는 것과 같은 텍스트 형식)"""
+    return "\n".join(f"사용자: {m}\n상담사: {ASSISTANT_REPLY}" for m in session["messages"])
+
+
+# -----------------------------
+# 측정
+# -----------------------------
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(len(values) * q))]
+    return {"p50": round(1000 * pick(0.5), 1), "p95": round(1000 * pick(0.95), 1),
+            "p99": round(1000 * pick(0.99), 1), "mean": round(1000 * sum(values) / len(values), 1)}
+
+
+def count_tokens(tokenizer, text):
+    return len(tokenizer(text or "", add_special_tokens=False)["input_ids"])
+
+
+def chat_session(server, session, session_id, stream, tokenizer):
+    """세션 하나를 순서대로 재생 (턴별 측정값 목록)"""
+    samples = []
+    for message in session["messages"]:
+        payload = {"message": message, "session_id": session_id, "persona": session["persona"]}
+        try:
+            if stream:
+                body, ttft, elapsed = stream_chat(f"{server.url}/chat/stream", payload)
+            else:
+                status, body, elapsed = request_json(f"{server.url}/chat", payload)
+                ttft = None
+                if status != 200:
+                    raise RuntimeError(f"HTTP {status}: {body.get('error')}")
+        except Exception as e:
+            samples.append({"ok": False, "error": f"{type(e).__name__}: {e}"})
+            continue
+        samples.append({"ok": True, "latency": elapsed, "ttft": ttft, "stage": body.get("counseling_stage"),
+                        "tokens": count_tokens(tokenizer, body.get("response"))})
+    return samples
+
+
+def report_session(server, session, session_id, stream, tokenizer):
+    """세션 하나의 채팅 내역으로 /report 한 번"""
+    payload = {"date": "2026-01-01", "chatHistory": f"[{session_id}]\n{chat_history_text(session)}",
+               "chatCount": len(session["messages"])}
+    try:
+        status, body, elapsed = request_json(f"{server.url}/report", payload)
+        if status != 200 or not body.get("success", True):
+            raise RuntimeError(f"HTTP {status}: {body.get('error') or body.get('message')}")
+    except Exception as e:
+        return [{"ok": False, "error": f"{type(e).__name__}: {e}"}]
+    return [{"ok": True, "latency": elapsed, "ttft": None, "stage": None,
+             "tokens": count_tokens(tokenizer, body.get("professional_report"))}]
+
+
+RUNNERS = {"chat": chat_session, "report": report_session}
+
+
+def run_level(server, monitor, sessions, concurrency, stream, tokenizer):
+    """동시성 concurrency로 세션 전체 재생 후 요약"""
+    runner = RUNNERS[server.name]
+    monitor.reset()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(runner, server, session, f"loadtest-c{concurrency}-{i}", stream, tokenizer)
+                   for i, session in enumerate(sessions)]
+        samples = [s for f in futures for s in f.result()]
+    wall = time.perf_counter() - start
+
+    ok = [s for s in samples if s["ok"]]
+    errors = Counter(s["error"] for s in samples if not s["ok"])
+    tokens = sum(s["tokens"] for s in ok)
+    return {
+        "concurrency": concurrency,
+        "sessions": len(sessions),
+        "requests": len(samples),
+        "errors": sum(errors.values()),
+        "error_examples": dict(errors.most_common(3)),
+        "wall_s": round(wall, 2),
+        "throughput_rps": round(len(ok) / wall, 3),
+        "latency_ms": percentiles([s["latency"] for s in ok]),
+        "ttft_ms": percentiles([s["ttft"] for s in ok if s["ttft"] is not None]),
+        "tokens_per_s": round(tokens / wall, 1),
+        "output_tokens_mean": round(tokens / len(ok), 1) if ok else None,
+        "peak_rss_mb": None if monitor.peak_rss is None else round(monitor.peak_rss, 1),
+        "peak_gpu_mb": monitor.peak_gpu,
+        "stages": dict(Counter(s["stage"] for s in ok if s["stage"])),
+    }
+
+
+def fetch_personas(server):
+    status, body, _ = request_json(f"{server.url}/personas", timeout=30)
+    return sorted(body.get("available_personas", {})) if status == 200 else []
+
+
+def bench_server(name, args, base_model, adapter, tokenizer, personas):
+    extra_env = {}
+    if name == "chat" and not args.rag:
+        extra_env["CHAT_RAG"] = "0"
+    if name == "report" and not args.report_cache:
+        extra_env["REPORT_CACHE_PATH"] = ""
+    if args.merged:
+        extra_env[SERVERS[name]["merged_env"]] = args.merged
+
+    server = ServerProcess(name, base_model, adapter, extra_env, args.log_dir)
+    print(f"[loadtest] {name} 서버 시작 (포트 {server.port}, 로그 {server.log_path})", flush=True)
+    try:
+        boot_s = server.start(args.boot_timeout)
+        monitor = MemoryMonitor(server.proc.pid).start()
+        if name == "chat":
+            personas = fetch_personas(server) or personas
+        sessions = make_sessions(args.sessions, args.turns, personas, args.seed)
+
+        # 워밍업 (측정 제외)
+        RUNNERS[name](server, {"persona": personas[0], "messages": sessions[0]["messages"][:1]},
+                      "loadtest-warmup", args.stream, tokenizer)
+
+        levels = []
+        for concurrency in args.concurrency:
+            level = run_level(server, monitor, sessions, concurrency, args.stream, tokenizer)
+            levels.append(level)
+            latency = level["latency_ms"] or {}
+            print(f"[loadtest] {name} c={concurrency}: {level['throughput_rps']} req/s, "
+                  f"p50 {latency.get('p50')}ms, p95 {latency.get('p95')}ms, p99 {latency.get('p99')}ms, "
+                  f"{level['tokens_per_s']} tok/s, 오류 {level['errors']}", flush=True)
+        monitor.stop()
+        peak = process_memory_mb(server.proc.pid, "VmHWM")
+        return {"boot_s": round(boot_s, 2), "personas": personas if name == "chat" else None, "levels": levels,
+                "process_peak_rss_mb": None if peak is None else round(peak, 1)}
+    finally:
+        server.stop()
+
+
+# -----------------------------
+# 결과 저장 / 비교
+# -----------------------------
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+
+def environment_info():
+    import torch
+    import transformers
+
+    return {
+        "python": sys.version.split()[0],
+        "torch": torch.__version__,
+        "transformers": transformers.__version__,
+        "cpu_count": os.cpu_count(),
+        "gpu": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+    }
+
+
+COMPARE_METRICS = [("throughput_rps", None), ("latency_ms", "p50"), ("latency_ms", "p95"), ("latency_ms", "p99"),
+                   ("ttft_ms", "p95"), ("tokens_per_s", None), ("peak_rss_mb", None)]
+
+
+def compare(baseline, current):
+    """같은 서버·동시성 단계끼리 주요 지표 변화율 출력"""
+    print(f"\n=== {baseline.get('git_commit')} → {current.get('git_commit')} ===")
+    for name, result in current["servers"].items():
+        old_levels = {l["concurrency"]: l for l in baseline.get("servers", {}).get(name, {}).get("levels", [])}
+        for level in result["levels"]:
+            old = old_levels.get(level["concurrency"])
+            if old is None:
+                continue
+            parts = []
+            for metric, key in COMPARE_METRICS:
+                a, b = old.get(metric), level.get(metric)
+                if key is not None:
+                    a, b = (a or {}).get(key), (b or {}).get(key)
+                if a and b is not None:
+                    parts.append(f"{metric}{'.' + key if key else ''} {a}→{b} ({(b - a) / a * 100:+.1f}%)")
+            print(f"{name} c={level['concurrency']}: " + ", ".join(parts))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="상담/리포트 서버 부하 테스트")
+    ap.add_argument("--servers", nargs="+", choices=list(SERVERS), default=list(SERVERS))
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    ap.add_argument("--sessions", type=int, default=16, help="동시성 단계마다 재생할 세션 수")
+    ap.add_argument("--turns", type=int, default=10, help="세션당 턴 수 (10이면 네 상담 단계를 모두 거침)")
+    ap.add_argument("--stream", type=int, default=1, help="1이면 /chat/stream으로 TTFT 측정, 0이면 /chat")
+    ap.add_argument("--base_model", default="", help="비우면 작은 랜덤 모델을 만들어 사용")
+    ap.add_argument("--adapter", default="", help="--base_model과 함께 쓸 LoRA 어댑터 경로")
+    ap.add_argument("--merged", default="", help="export_model.py로 병합한 모델 경로 (베이스 + 어댑터 대신 로딩)")
+    ap.add_argument("--workdir", default=os.path.join(HERE, "loadtest_work"), help="작은 모델·서버 로그 위치")
+    ap.add_argument("--hidden_size", type=int, default=64)
+    ap.add_argument("--layers", type=int, default=2)
+    ap.add_argument("--rag", action="store_true", help="상담 서버 RAG 사용 (기본: CHAT_RAG=0)")
+    ap.add_argument("--report_cache", action="store_true", help="리포트 캐시 사용 (기본: 끔)")
+    ap.add_argument("--boot_timeout", type=float, default=600)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--output", default="", help="기본: loadtest_results/loadtest_<커밋>.json")
+    ap.add_argument("--compare", default="", help="비교할 이전 결과 JSON")
+    args = ap.parse_args()
+
+    from transformers import AutoTokenizer
+
+    os.makedirs(args.workdir, exist_ok=True)
+    args.log_dir = args.workdir
+    if args.base_model:
+        base_model, adapter = args.base_model, args.adapter or HERE
+    else:
+        base_model, adapter = prepare_tiny_model(args.workdir, args.hidden_size, args.layers, args.seed)
+    tokenizer = AutoTokenizer.from_pretrained(base_model, trust_remote_code=True)
+
+    commit = git_commit()
+    result = {
+        "git_commit": commit,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "environment": environment_info(),
+        "model": {"base_model": base_model, "adapter": adapter, "merged": args.merged or None, "tiny": not args.base_model},
+        "settings": {k: v for k, v in vars(args).items() if k not in ("compare", "output", "log_dir")},
+        "servers": {},
+    }
+    for name in args.servers:
+        result["servers"][name] = bench_server(name, args, base_model, adapter, tokenizer, ["empathetic"])
+
+    output = args.output or os.path.join(HERE, "loadtest_results", f"loadtest_{commit or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"[loadtest] 결과 저장: {output}", flush=True)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+경량 Prometheus 지표 (외부 의존성 없음)
+카운터·게이지·히스토그램을 프로세스 전역 레지스트리에 모아 /metrics에서 텍스트 형식(0.0.4)으로 내보냅니다.
+관측 한 번은 락 + 버킷 이분 탐색뿐이라 요청당 비용은 수 µs 수준입니다.
+캐시 통계처럼 다른 객체가 이미 세고 있는 값은 set_function으로 수집 시점에 읽어 옵니다.
+"""
+
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 단계별 소요 시간 버킷 (초): 정규식 정리처럼 짧은 단계부터 긴 디코딩까지
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"이미 등록된 지표입니다: {metric.name}")
+            self._metrics[metric.name] = metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "".join(metric.render() for metric in metrics)
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._function = None
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} 레이블이 다릅니다: {sorted(labels)} ≠ {list(self.labelnames)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def set_function(self, fn):
+        """수집 시점에 fn()으로 값을 읽음 (레이블이 있으면 {레이블 값 튜플: 값} 반환)"""
+        self._function = fn
+        return self
+
+    def _collect(self):
+        if self._function is None:
+            with self._lock:
+                return dict(self._values)
+        try:
+            value = self._function()
+        except Exception:
+            return {}
+        if value is None:
+            return {}
+        return value if self.labelnames else {(): value}
+
+    def _samples(self):
+        return [(self.name, _format_labels(self.labelnames, key), value) for key, value in self._collect().items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in self._samples())
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        with self._lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+        samples = []
+        for key, (counts, total, count) in values.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                samples.append((f"{self.name}_bucket",
+                                _format_labels(self.labelnames, key, ("le", _format_value(bound))), cumulative))
+            labels = _format_labels(self.labelnames, key)
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+class GenerationTimer:
+    """model.generate의 streamer 자리에 끼워 prefill / decode 시간과 생성 토큰 수를 재는 래퍼
+    (첫 put은 프롬프트, 두 번째 put부터 생성 토큰 - speculative decoding이면 put 한 번에 여러 토큰).
+    원래 streamer가 있으면 그대로 전달"""
+
+    def __init__(self, streamer=None):
+        self.streamer = streamer
+        self.started_at = time.perf_counter()
+        self.first_token_at = None
+        self.finished_at = None
+        self.new_tokens = 0
+        self.steps = 0  # 생성 토큰 put 횟수 (본 모델 forward 횟수)
+        self._prompt_seen = False
+
+    def put(self, value):
+        if not self._prompt_seen:
+            self._prompt_seen = True
+        else:
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+            self.new_tokens += value.numel() if hasattr(value, "numel") else 1
+            self.steps += 1
+        if self.streamer is not None:
+            self.streamer.put(value)
+
+    def end(self):
+        self.finished_at = time.perf_counter()
+        if self.streamer is not None:
+            self.streamer.end()
+
+    def timings(self):
+        """(prefill 초, decode 초) - 토큰을 하나도 만들지 못했으면 전체를 prefill로"""
+        finished = self.finished_at or time.perf_counter()
+        first = self.first_token_at or finished
+        return first - self.started_at, finished - first
+
+
+def cache_ratio_function(sources):
+    """{캐시 이름: (hits, misses) 반환 함수} → 캐시별 적중률 게이지 함수"""
+    def collect():
+        ratios = {}
+        for name, fn in sources.items():
+            counts = fn()
+            if counts is None:
+                continue
+            hits, misses = counts
+            ratios[(name,)] = hits / (hits + misses) if hits + misses else 0.0
+        return ratios
+    return collect
+
+
+def cache_lookup_function(sources):
+    """{캐시 이름: (hits, misses) 반환 함수} → (캐시, 결과)별 조회 수 카운터 함수"""
+    def collect():
+        counts = {}
+        for name, fn in sources.items():
+            value = fn()
+            if value is None:
+                continue
+            counts[(name, "hit")], counts[(name, "miss")] = value
+        return counts
+    return collect
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+공유 모델 호스트: 베이스 모델을 한 번만 올리고 이름 붙인 LoRA 어댑터(chat, report, ...)를 함께 등록합니다.
+같은 경로의 어댑터는 한 번만 적재해 별칭으로 공유하고, 요청별 어댑터는 PEFT adapter_names로 고릅니다.
+adapter_names는 LoRA 레이어에 forward hook을 거는 방식이라 스레드 간에 안전하지 않으므로
+공유 모델의 생성은 연속 배칭 엔진 스레드 하나에서만 실행합니다 (inference_server.py).
+"""
+
+import logging
+import os
+
+# torch·transformers·peft는 load()에서 임포트 (통합 서버가 포트를 먼저 열 수 있도록)
+
+logger = logging.getLogger(__name__)
+
+
+def parse_adapter_spec(spec):
+    """환경 변수 형식 "이름=경로,이름=경로" → {이름: 경로}"""
+    adapters = {}
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        name, sep, path = item.partition("=")
+        if not sep or not name.strip() or not path.strip():
+            raise ValueError(f"어댑터 지정 형식이 잘못되었습니다 (이름=경로): {item}")
+        adapters[name.strip()] = path.strip()
+    return adapters
+
+
+class ModelHost:
+    """베이스 모델 하나 + 이름 붙인 LoRA 어댑터 여러 개"""
+
+    def __init__(self, base_model_name, adapters, default_adapter=None):
+        if not adapters:
+            raise ValueError("어댑터를 하나 이상 지정해야 합니다.")
+        self.base_model_name = base_model_name
+        self.adapter_paths = dict(adapters)
+        self.default_adapter = default_adapter or next(iter(adapters))
+        self.model = None
+        self.tokenizer = None
+        # 별칭 → 실제로 적재한 PEFT 어댑터 이름 (같은 경로면 같은 어댑터)
+        self._aliases = {}
+
+    def load(self):
+        import torch
+        from peft import PeftModel
+        from transformers import AutoModelForCausalLM
+
+        logger.info(f"공유 베이스 모델 로딩 중: {self.base_model_name} (float16)")
+        self.tokenizer = self.load_tokenizer()
+
+        base_model = AutoModelForCausalLM.from_pretrained(
+            self.base_model_name,
+            torch_dtype=torch.float16,
+            device_map="auto",
+            trust_remote_code=True
+        )
+
+        loaded = {}  # 실제 경로 → PEFT 어댑터 이름
+        for alias, path in self.adapter_paths.items():
+            key = os.path.realpath(path)
+            if key in loaded:
+                self._aliases[alias] = loaded[key]
+                logger.info(f"LoRA 어댑터 '{alias}' → '{loaded[key]}'와 같은 경로라 공유")
+                continue
+            if self.model is None:
+                self.model = PeftModel.from_pretrained(base_model, path, adapter_name=alias, torch_dtype=torch.float16)
+            else:
+                self.model.load_adapter(path, adapter_name=alias)
+            loaded[key] = self._aliases[alias] = alias
+            logger.info(f"LoRA 어댑터 '{alias}' 로딩 완료: {path}")
+
+        # adapter_names 없이 호출하는 경로(prefix KV 사전 계산 등)는 기본 어댑터 사용
+        self.model.set_adapter(self.adapter_name(self.default_adapter))
+        self.model.eval()
+        return self
+
+    def load_tokenizer(self):
+        """새 토크나이저 인스턴스 (fast 토크나이저는 truncation/padding 설정을 바꾸는 호출이 스레드 간에 충돌하므로
+        설정이 다른 서버는 각자 하나씩 사용)"""
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(self.base_model_name, trust_remote_code=True)
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        return tokenizer
+
+    @property
+    def aliases(self):
+        return list(self._aliases)
+
+    def adapter_name(self, alias):
+        """요청에서 받은 별칭 → PEFT 어댑터 이름 (없으면 KeyError)"""
+        if alias not in self._aliases:
+            raise KeyError(f"등록되지 않은 어댑터입니다: {alias} (사용 가능: {', '.join(self._aliases)})")
+        return self._aliases[alias]
+
+    def stats(self):
+        return {
+            "base_model": self.base_model_name,
+            "default_adapter": self.default_adapter,
+            "adapters": {alias: {"path": self.adapter_paths[alias], "loaded_as": name}
+                         for alias, name in self._aliases.items()},
+            "loaded_adapters": len(set(self._aliases.values()))
+        }
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+상담 RAG 검색기
+서버 시작 시 한 번 연 Chroma 컬렉션과 질의 임베딩 함수로 검색합니다.
+- 정규화한 질문 → 임베딩 LRU 캐시 (대소문자·공백·문장부호만 다른 질문은 임베딩 재사용)
+- (질문 해시, top_k) → 검색 결과 LRU 캐시 (반복 질문은 임베딩·검색 모두 생략)
+상담 관련 여부는 적재 시 dont/ingest.py가 청크 메타데이터로 기록해 두고,
+검색할 때 Chroma where 필터로 관련 청크만 조회합니다.
+BM25 색인(bm25_index.py)을 주면 벡터 후보와 BM25 후보를 reciprocal-rank fusion으로 합치고,
+단계별(임베딩/벡터/BM25/융합) 평균 소요 시간을 stats()로 보여줍니다.
+적재에 쓴 임베딩 모델 id·차원은 컬렉션 메타데이터에 기록되어 있어, 다른 모델로는 조회하지 않습니다.
+"""
+
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, defaultdict
+
+from bm25_index import RRF_K, rrf_fuse
+
+# 메타데이터 키 (dont/utils.py와 동일해야 함)
+RELEVANCE_KEY = "counseling_relevant"
+CONTEXT_KEY = "counseling_context"
+# 컬렉션 메타데이터 키 (dont/embeddings.py와 동일해야 함)
+EMBED_MODEL_KEY = "embed_model"
+EMBED_DIM_KEY = "embed_dim"
+
+PUNCTUATION = re.compile(r"[^\w\s]+")
+
+
+class EmbeddingMismatch(ValueError):
+    """컬렉션을 적재한 임베딩 모델과 질의 임베딩 모델이 다름"""
+
+
+def recorded_embedding(collection):
+    """컬렉션에 기록된 (임베딩 모델, 차원), 기록이 없으면 (None, None)"""
+    metadata = collection.metadata or {}
+    return metadata.get(EMBED_MODEL_KEY), metadata.get(EMBED_DIM_KEY)
+
+
+def normalize_query(text):
+    """캐시 키용 질문 정규화 (NFKC, 소문자, 문장부호 제거, 공백 정리)"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return " ".join(PUNCTUATION.sub(" ", text).split())
+
+
+class LRUCache:
+    """스레드 안전 LRU (적중/미스 통계 포함)"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
+
+
+class RAGRetriever:
+    """상담 관련 청크만 조회하는 캐시 검색기"""
+
+    def __init__(self, collection, embed_query, top_k=2, embedding_cache_size=4096, result_cache_size=4096,
+                 bm25=None, candidates=10, rrf_k=RRF_K):
+        self.collection = collection
+        self.embed_query = embed_query
+        self.top_k = top_k
+        self.bm25 = bm25
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+
+        self.embeddings = LRUCache(embedding_cache_size)
+        self.results = LRUCache(result_cache_size)
+
+        self._stage_seconds = defaultdict(float)
+        self._stage_calls = defaultdict(int)
+        self._stage_lock = threading.Lock()
+
+    def _record(self, stage, start):
+        elapsed = time.perf_counter() - start
+        with self._stage_lock:
+            self._stage_seconds[stage] += elapsed
+            self._stage_calls[stage] += 1
+
+    def has_relevance_metadata(self):
+        """적재 시 상담 관련 메타데이터가 기록된 컬렉션인지 (이전 방식으로 색인했다면 False)"""
+        found = self.collection.get(where={RELEVANCE_KEY: True}, limit=1, include=[])
+        return bool(found["ids"])
+
+    def check_embedding(self, model_name):
+        """질의 임베딩 모델·차원이 적재 때와 같은지 확인 (다르면 EmbeddingMismatch, 기록이 없으면 False)"""
+        recorded_model, recorded_dim = recorded_embedding(self.collection)
+        if recorded_model is None:
+            return False
+        if recorded_model != model_name:
+            raise EmbeddingMismatch(f"컬렉션은 {recorded_model}로 적재되었습니다 (질의 모델: {model_name})")
+        dim = len(self.embed_query("차원 확인"))
+        if recorded_dim is not None and recorded_dim != dim:
+            raise EmbeddingMismatch(f"컬렉션 임베딩 차원 {recorded_dim} ≠ 질의 모델 차원 {dim}")
+        return True
+
+    def embed(self, normalized):
+        """정규화된 질문의 임베딩 (캐시 우선)"""
+        embedding = self.embeddings.get(normalized)
+        if embedding is None:
+            embedding = self.embed_query(normalized)
+            self.embeddings.put(normalized, embedding)
+        return embedding
+
+    def retrieve(self, question, top_k=None):
+        """질문과 가까운 상담 관련 발췌 튜플 (유사도 순, 캐시와 공유하므로 불변)"""
+        top_k = top_k or self.top_k
+        normalized = normalize_query(question)
+        if not normalized:
+            return ()
+
+        key = (hashlib.sha1(normalized.encode("utf-8")).hexdigest(), top_k)
+        contexts = self.results.get(key)
+        if contexts is not None:
+            return contexts
+
+        start = time.perf_counter()
+        embedding = self.embed(normalized)
+        self._record("embed", start)
+
+        start = time.perf_counter()
+        result = self.collection.query(
+            query_embeddings=[embedding],
+            n_results=max(top_k, self.candidates) if self.bm25 is not None else top_k,
+            where={RELEVANCE_KEY: True},
+            include=["metadatas"]
+        )
+        self._record("dense", start)
+        ids = result["ids"][0] if result["ids"] else []
+        metadatas = result["metadatas"][0] if result["metadatas"] else []
+
+        if self.bm25 is not None:
+            ids, metadatas = self._fuse(normalized, ids, metadatas, top_k)
+        contexts = tuple(meta[CONTEXT_KEY] for meta in metadatas[:top_k] if meta and meta.get(CONTEXT_KEY))
+
+        self.results.put(key, contexts)
+        return contexts
+
+    def _fuse(self, normalized, ids, metadatas, top_k):
+        """벡터 후보와 BM25 후보를 RRF로 합친 상위 top_k의 (id, 메타데이터)"""
+        start = time.perf_counter()
+        sparse = self.bm25.search(normalized, self.candidates)
+        self._record("bm25", start)
+
+        start = time.perf_counter()
+        by_id = dict(zip(ids, metadatas))
+        fused = [chunk_id for chunk_id, _ in rrf_fuse([ids, [chunk_id for chunk_id, _ in sparse]], top_k, self.rrf_k)]
+        missing = [chunk_id for chunk_id in fused if chunk_id not in by_id]
+        if missing:
+            found = self.collection.get(ids=missing, include=["metadatas"])
+            by_id.update(zip(found["ids"], found["metadatas"]))
+        self._record("fusion", start)
+        fused = [chunk_id for chunk_id in fused if chunk_id in by_id]
+        return fused, [by_id[chunk_id] for chunk_id in fused]
+
+    def clear(self):
+        """컬렉션을 다시 적재했을 때 캐시 비우기"""
+        self.embeddings.clear()
+        self.results.clear()
+
+    def stats(self):
+        with self._stage_lock:
+            latency = {stage: round(1000 * self._stage_seconds[stage] / calls, 3)
+                       for stage, calls in self._stage_calls.items()}
+        return {
+            "top_k": self.top_k,
+            "mode": "hybrid" if self.bm25 is not None else "dense",
+            "bm25": self.bm25.stats() if self.bm25 is not None else None,
+            "avg_stage_ms": latency,
+            "embedding_cache": self.embeddings.stats(),
+            "result_cache": self.results.stats()
+        }
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+리포트 캐시 (내용 주소 기반)
+같은 채팅 내역으로 생성한 리포트를 SQLite(WAL) 파일에 보관해, 같은 날 리포트를 다시 열면
+모델 생성 없이 바로 반환합니다.
+- 키: (채팅 내역, 상담 횟수, 이전 세션, 프롬프트 버전, 어댑터 버전)의 sha256
+- 전체 크기가 상한을 넘으면 마지막 조회가 오래된 항목부터 삭제
+- 어댑터가 바뀌면 invalidate_except()로 이전 어댑터 항목 삭제
+"""
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def adapter_fingerprint(adapter_path):
+    """어댑터 설정 내용과 가중치 파일 크기·수정 시각으로 만든 버전 문자열"""
+    digest = hashlib.sha256()
+    config_path = os.path.join(adapter_path, "adapter_config.json")
+    if os.path.exists(config_path):
+        with open(config_path, "rb") as f:
+            digest.update(f.read())
+    for path in sorted(glob.glob(os.path.join(adapter_path, "adapter_model.*"))):
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}:{stat.st_size}:{int(stat.st_mtime)}".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def report_cache_key(chat_history, chat_count, previous_session, prompt_version, adapter_version):
+    payload = json.dumps([chat_history, chat_count, previous_session, prompt_version, adapter_version],
+                         ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ReportCache:
+    """SQLite 단일 파일 리포트 캐시 (크기 상한 LRU)"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS reports (
+            key TEXT PRIMARY KEY,
+            adapter_version TEXT NOT NULL,
+            report TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            accessed_at REAL NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_reports_accessed_at ON reports(accessed_at);
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.hit_seconds = 0.0
+        self.miss_seconds = 0.0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self):
+        """스레드별 연결"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """저장된 리포트 (없으면 None)"""
+        conn = self._conn()
+        row = conn.execute("SELECT report FROM reports WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE reports SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key, report, adapter_version):
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO reports (key, adapter_version, report, size, created_at, accessed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, adapter_version, report, len(report.encode("utf-8")), now, now)
+        )
+        self._evict()
+
+    def _evict(self):
+        """전체 크기가 상한 안에 들어올 때까지 오래 조회되지 않은 항목 삭제"""
+        conn = self._conn()
+        (total,) = conn.execute("SELECT COALESCE(SUM(size), 0) FROM reports").fetchone()
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in conn.execute("SELECT key, size FROM reports ORDER BY accessed_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM reports WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        with self._lock:
+            self.evictions += evicted
+
+    def get_or_create(self, key, adapter_version, create):
+        """캐시에 있으면 반환, 없으면 create() 결과를 저장 후 반환 (None이면 저장하지 않음)"""
+        start = time.perf_counter()
+        report = self.get(key)
+        if report is not None:
+            with self._lock:
+                self.hits += 1
+                self.hit_seconds += time.perf_counter() - start
+            return report
+
+        report = create()
+        if report is not None:
+            self.put(key, report, adapter_version)
+        with self._lock:
+            self.misses += 1
+            self.miss_seconds += time.perf_counter() - start
+        return report
+
+    def invalidate_except(self, adapter_version):
+        """현재 어댑터가 아닌 버전으로 생성된 리포트 삭제 (어댑터 교체 시)"""
+        deleted = self._conn().execute(
+            "DELETE FROM reports WHERE adapter_version != ?", (adapter_version,)
+        ).rowcount
+        if deleted:
+            logger.info(f"어댑터 변경으로 리포트 캐시 {deleted}건 삭제")
+        return deleted
+
+    def clear(self):
+        self._conn().execute("DELETE FROM reports")
+
+    def stats(self):
+        entries, total = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM reports").fetchone()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "bytes": total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "avg_hit_ms": round(1000 * self.hit_seconds / self.hits, 3) if self.hits else None,
+                "avg_miss_ms": round(1000 * self.miss_seconds / self.misses, 1) if self.misses else None
+            }
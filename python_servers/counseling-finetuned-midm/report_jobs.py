@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+리포트 생성 비동기 작업 큐
+요청은 작업 id만 받고 바로 반환하고, 고정 크기 워커 풀이 리포트를 생성합니다.
+- 같은 키(날짜, 채팅 내역 해시)의 요청은 진행 중이거나 완료된 작업 하나로 합침
+- 대기열이 가득 차면 QueueFull (서버는 429로 응답해 GPU를 보호)
+- 끝난 작업은 ttl 동안 결과를 보관한 뒤 삭제
+"""
+
+import logging
+import queue
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFull(Exception):
+    """대기 중인 작업 수가 상한에 도달"""
+
+
+class ReportJob:
+    """리포트 생성 작업 하나"""
+
+    def __init__(self, key, payload):
+        self.job_id = uuid.uuid4().hex
+        self.key = key
+        self.payload = payload
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.finished = threading.Event()
+
+    def to_dict(self):
+        info = {
+            "job_id": self.job_id,
+            "status": self.status,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+        if self.status == DONE:
+            info["result"] = self.result
+        elif self.status == FAILED:
+            info["error"] = self.error
+        return info
+
+
+class ReportJobQueue:
+    """중복 제거 + 상한 있는 대기열 + 워커 풀"""
+
+    def __init__(self, handler, workers=1, max_queue=16, ttl=3600):
+        self.handler = handler  # payload -> 결과 (JSON 직렬화 가능)
+        self.max_queue = max_queue
+        self.ttl = ttl
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._jobs = {}  # job_id -> ReportJob
+        self._by_key = {}  # key -> job_id (대기/실행 중이거나 결과 보관 중인 작업)
+        self._lock = threading.Lock()
+        self._workers = []
+        self._stopped = False
+
+        self.submitted = 0
+        self.deduplicated = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+
+        for i in range(workers):
+            worker = threading.Thread(target=self._run, name=f"report-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, key, payload):
+        """작업 등록. (작업, 새로 만들었는지) 반환, 대기열이 가득 차면 QueueFull"""
+        with self._lock:
+            self._expire()
+            job_id = self._by_key.get(key)
+            if job_id is not None:
+                job = self._jobs[job_id]
+                if job.status != FAILED:
+                    self.deduplicated += 1
+                    return job, False
+
+            job = ReportJob(key, payload)
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self.rejected += 1
+                raise QueueFull(f"리포트 대기열이 가득 찼습니다 ({self.max_queue})")
+            self._jobs[job.job_id] = job
+            self._by_key[key] = job.job_id
+            self.submitted += 1
+            return job, True
+
+    def get(self, job_id):
+        with self._lock:
+            self._expire()
+            return self._jobs.get(job_id)
+
+    def _expire(self):
+        """ttl이 지난 완료/실패 작업 삭제 (lock 안에서 호출)"""
+        cutoff = time.time() - self.ttl
+        expired = [job for job in self._jobs.values() if job.finished_at is not None and job.finished_at < cutoff]
+        for job in expired:
+            del self._jobs[job.job_id]
+            if self._by_key.get(job.key) == job.job_id:
+                del self._by_key[job.key]
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            job.status = RUNNING
+            job.started_at = time.time()
+            try:
+                result = self.handler(job.payload)
+                with self._lock:
+                    job.result = result
+                    job.status = DONE
+                    job.finished_at = time.time()
+                    self.completed += 1
+            except Exception as e:
+                logger.error(f"리포트 작업 실패 ({job.job_id}): {e}")
+                with self._lock:
+                    job.error = str(e)
+                    job.status = FAILED
+                    job.finished_at = time.time()
+                    self.failed += 1
+            job.finished.set()
+
+    def stop(self):
+        """남은 작업을 처리한 뒤 워커 종료"""
+        if self._stopped:
+            return
+        self._stopped = True
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for job in self._jobs.values() if job.status == RUNNING)
+            return {
+                "workers": len(self._workers),
+                "queued": self._queue.qsize(),
+                "running": running,
+                "max_queue": self.max_queue,
+                "submitted": self.submitted,
+                "deduplicated": self.deduplicated,
+                "rejected": self.rejected,
+                "completed": self.completed,
+                "failed": self.failed
+            }
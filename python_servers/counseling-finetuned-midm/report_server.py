@@ -4,17 +4,25 @@
 채팅 내역을 분석해서 객관적이고 전문적인 심리상담 리포트를 생성합니다.
 """
 
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
-from peft import PeftModel
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import logging
 import json
+import os
 import re
+import hashlib
 from datetime import datetime, timedelta
 import random
 
+# torch·transformers·peft는 무거워서 load_model() 안에서 임포트 (모듈 임포트는 1초 미만)
+from export_model import exported_adapter_version
+from keyword_matcher import KeywordMatcher
+from metrics import (CONTENT_TYPE, REGISTRY, Counter, Gauge, GenerationTimer, Histogram, cache_lookup_function,
+                     cache_ratio_function)
+from report_cache import ReportCache, adapter_fingerprint, report_cache_key
+from report_jobs import QueueFull, ReportJobQueue
+from startup import StartupTracker
+
 # 로깅 설정
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -22,9 +30,11 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)
 
-# 모델 로드 (채팅과 동일한 모델 사용)
-model_name = "K-intelligence/Midm-2.0-Base-Instruct"
-adapter_path = "."  # 현재 디렉토리의 어댑터
+# 모델 로드 (채팅과 동일한 모델 사용, 부하 테스트 등에서는 작은 로컬 모델·어댑터로 교체)
+model_name = os.getenv("REPORT_BASE_MODEL", "K-intelligence/Midm-2.0-Base-Instruct")
+adapter_path = os.getenv("REPORT_ADAPTER_PATH", ".")  # 기본: 현재 디렉토리의 어댑터
+merged_model_path = os.getenv("REPORT_MERGED_MODEL", "")  # export_model.py로 병합한 모델 (지정하면 위 두 설정 대신 사용)
+REPORT_PORT = int(os.getenv("REPORT_PORT", "5004"))
 
 # 콘텐츠 추천 데이터베이스
 CONTENT_RECOMMENDATIONS = {
@@ -90,100 +100,192 @@ FEEDBACK_CHECKLIST = {
     ]
 }
 
-# 모델 로드 (채팅과 동일한 모델 사용)
-model_name = "K-intelligence/Midm-2.0-Base-Instruct"
-adapter_path = "."  # 현재 디렉토리의 어댑터
+model = None
+tokenizer = None
+device = None
+generation_engine = None  # 공유 모델 서버(inference_server.py)의 연속 배칭 엔진 (단독 실행이면 None)
+report_adapter = None  # 리포트용 PEFT 어댑터 이름 (공유 모델 서버에서만)
 
-logger.info("리포트 생성 모델을 로드하는 중...")
+# 시작 상태 (/health/live, /health/ready) - 모델은 필수가 아님 (실패하면 기본 리포트 모드로 ready)
+startup = StartupTracker(["model"])
 
-try:
-    # 베이스 모델 로드
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    
-    # GPU 사용 (CUDA_VISIBLE_DEVICES=1로 설정했을 때 0번으로 인식됨)
-    device = "cuda:0" if torch.cuda.is_available() else "cpu"
-    logger.info(f"사용 디바이스: {device}")
-    
-    # GPU에서 모델 로드
-    base_model = AutoModelForCausalLM.from_pretrained(
-        model_name,
-        torch_dtype=torch.float16,
-        trust_remote_code=True,
-        device_map="auto"
-    )
+def load_model():
+    """모델 로드 (채팅과 동일한 모델 사용, 실패하면 모델 없이 기본 리포트 모드)"""
+    global model, tokenizer, device
     
-    # LoRA 어댑터 적용
-    model = PeftModel.from_pretrained(base_model, adapter_path)
-    model.eval()
+    logger.info("리포트 생성 모델을 로드하는 중...")
     
-    # 패딩 토큰 설정
-    if tokenizer.pad_token is None:
-        tokenizer.pad_token = tokenizer.eos_token
+    try:
+        startup.progress("model", "torch / transformers 임포트")
+        import torch
+        from peft import PeftModel
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        
+        # GPU 사용 (CUDA_VISIBLE_DEVICES=1로 설정했을 때 0번으로 인식됨)
+        device = "cuda:0" if torch.cuda.is_available() else "cpu"
+        logger.info(f"사용 디바이스: {device}")
+        
+        # LoRA 병합 모델 (PEFT 없이 바로 로딩)
+        if merged_model_path:
+            from export_model import load_exported_model
+            
+            startup.progress("model", f"병합 모델 로딩: {merged_model_path}")
+            model, tokenizer = load_exported_model(merged_model_path)
+            logger.info(f"리포트 생성 모델 로드 완료! (병합 모델 {merged_model_path})")
+            return True
+        
+        # 베이스 모델 로드
+        startup.progress("model", "토크나이저 로딩")
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        
+        # GPU에서 모델 로드
+        startup.progress("model", f"베이스 모델 로딩: {model_name}")
+        base_model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            torch_dtype=torch.float16,
+            trust_remote_code=True,
+            device_map="auto"
+        )
+        
+        # LoRA 어댑터 적용
+        startup.progress("model", f"LoRA 어댑터 적용: {adapter_path}")
+        model = PeftModel.from_pretrained(base_model, adapter_path)
+        model.eval()
+        
+        # 패딩 토큰 설정
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        
+        logger.info("리포트 생성 모델 로드 완료!")
+        return True
     
-    logger.info("리포트 생성 모델 로드 완료!")
+    except Exception as e:
+        logger.error(f"모델 로드 실패: {e}")
+        logger.info("모델 없이 기본 리포트 모드로 실행합니다.")
+        startup.fail("model", e)
+        model = None
+        tokenizer = None
+        return False
+
+def attach_model_host(host, alias="report", engine=None):
+    """공유 모델 호스트의 모델·토크나이저와 어댑터 사용 (생성은 채팅과 같은 연속 배칭 엔진에서)"""
+    global model, tokenizer, device, generation_engine, report_adapter
+    
+    model = host.model
+    tokenizer = host.load_tokenizer()  # 채팅과 토크나이저 설정(padding 등)이 달라 별도 인스턴스
+    device = str(host.model.device)
+    generation_engine = engine
+    report_adapter = host.adapter_name(alias)
+    logger.info(f"공유 모델 사용: 리포트 어댑터 '{alias}' → '{report_adapter}'")
+
+# 리포트 캐시 (REPORT_CACHE_PATH를 비우면 사용 안 함)
+# 프롬프트나 생성 파라미터를 바꾸면 REPORT_PROMPT_VERSION을 올려 이전 리포트를 무효화
+REPORT_PROMPT_VERSION = "3.0"
+ADAPTER_VERSION = exported_adapter_version(merged_model_path) if merged_model_path else adapter_fingerprint(adapter_path)
+REPORT_CACHE_PATH = os.getenv("REPORT_CACHE_PATH", "cache/report_cache.db")
+report_cache = None
+if REPORT_CACHE_PATH:
+    try:
+        report_cache = ReportCache(REPORT_CACHE_PATH, max_bytes=int(float(os.getenv("REPORT_CACHE_MB", "256")) * 1024 * 1024))
+        report_cache.invalidate_except(ADAPTER_VERSION)
+        logger.info(f"리포트 캐시 사용: {REPORT_CACHE_PATH} (어댑터 버전 {ADAPTER_VERSION})")
+    except Exception as e:
+        logger.error(f"리포트 캐시 초기화 실패: {e}")
+        report_cache = None
+
+# Prometheus 지표 (/metrics)
+# 단계: analysis(키워드 분석), tokenize, queue(공유 엔진 대기), prefill, decode, detokenize, cleanup
+STAGE_SECONDS = Histogram("report_stage_seconds", "리포트 생성 단계별 소요 시간(초)", ["stage"])
+REQUEST_SECONDS = Histogram("report_request_seconds", "엔드포인트별 전체 처리 시간(초)", ["endpoint"])
+TOKENS = Counter("report_tokens_total", "토큰 수 (in: 프롬프트, out: 생성)", ["direction"])
+
+def _job_queue_depth():
+    stats = report_jobs.stats()
+    return {("queued",): stats["queued"], ("running",): stats["running"]}
+
+def _report_cache_counts():
+    # stats()는 SQLite 집계를 하므로 수집 시에는 카운터만 읽음
+    if report_cache is None:
+        return None
+    return report_cache.hits, report_cache.misses
+
+QUEUE_DEPTH = Gauge("report_job_queue_depth", "리포트 작업 상태별 수 (queued, running)", ["state"]).set_function(
+    _job_queue_depth)
+
+CACHE_HIT_RATIO = Gauge("report_cache_hit_ratio", "캐시별 누적 적중률", ["cache"]).set_function(
+    cache_ratio_function({"report": _report_cache_counts}))
+CACHE_LOOKUPS = Counter("report_cache_lookups_total", "캐시별 조회 수", ["cache", "result"]).set_function(
+    cache_lookup_function({"report": _report_cache_counts}))
+
+# 정서 상태 키워드
+EMOTIONAL_INDICATORS = {
+    "우울감": ["우울", "슬프", "힘들", "절망", "무기력", "의욕없", "재미없"],
+    "불안감": ["불안", "걱정", "두려", "초조", "긴장", "떨려", "무서"],
+    "스트레스": ["스트레스", "압박", "부담", "피곤", "지쳐", "답답", "숨막"],
+    "분노감": ["화나", "짜증", "분노", "억울", "속상", "열받", "빡쳐"],
+    "긍정감": ["좋", "행복", "기쁘", "만족", "편안", "감사", "희망"],
+    "혼란감": ["혼란", "모르겠", "어떻게", "갈등", "딜레마", "애매"]
+}
+
+# 위험 요인 키워드
+RISK_FACTORS = {
+    "고위험": ["죽고싶", "자살", "사라지고싶", "끝내고싶"],
+    "중위험": ["소용없", "의미없", "포기", "그만두고싶"],
+    "저위험": ["힘들지만", "그래도", "노력", "해보려"]
+}
+
+# 치료 동기 키워드
+MOTIVATION_INDICATORS = {
+    "높음": ["변화하고싶", "노력", "해보겠", "시도", "배우고싶"],
+    "보통": ["그런 것 같", "해볼게", "생각해볼게"],
+    "낮음": ["모르겠", "안될것같", "어려울것같"]
+}
+
+NEGATIVE_EMOTIONS = ["우울감", "불안감", "분노감"]
+
+# 세 사전을 하나로 컴파일 (채팅 기록을 한 번만 스캔)
+PSYCHOLOGICAL_MATCHER = KeywordMatcher({
+    **{("emotion", k): v for k, v in EMOTIONAL_INDICATORS.items()},
+    **{("risk", k): v for k, v in RISK_FACTORS.items()},
+    **{("motivation", k): v for k, v in MOTIVATION_INDICATORS.items()}
+})
 
-except Exception as e:
-    logger.error(f"모델 로드 실패: {e}")
-    logger.info("모델 없이 기본 리포트 모드로 실행합니다.")
-    model = None
-    tokenizer = None
+def emotional_intensity(negative_categories, negative_hits):
+    """부정 정서 종류 수(0~3)에 반복 언급 정도(최대 +2)를 더한 5점 척도"""
+    repetition = min(2, (negative_hits - negative_categories) // 3)
+    return min(5, negative_categories + max(0, repetition))
 
+@STAGE_SECONDS.time(stage="analysis")
 def analyze_psychological_state(chat_text):
     """채팅 내용에서 심리상태 전문 분석"""
+    hits = PSYCHOLOGICAL_MATCHER.scan(chat_text)
     
-    # 정서 상태 키워드 분석
-    emotional_indicators = {
-        "우울감": ["우울", "슬프", "힘들", "절망", "무기력", "의욕없", "재미없"],
-        "불안감": ["불안", "걱정", "두려", "초조", "긴장", "떨려", "무서"],
-        "스트레스": ["스트레스", "압박", "부담", "피곤", "지쳐", "답답", "숨막"],
-        "분노감": ["화나", "짜증", "분노", "억울", "속상", "열받", "빡쳐"],
-        "긍정감": ["좋", "행복", "기쁘", "만족", "편안", "감사", "희망"],
-        "혼란감": ["혼란", "모르겠", "어떻게", "갈등", "딜레마", "애매"]
-    }
-    
-    # 위험 요인 분석
-    risk_factors = {
-        "고위험": ["죽고싶", "자살", "사라지고싶", "끝내고싶"],
-        "중위험": ["소용없", "의미없", "포기", "그만두고싶"],
-        "저위험": ["힘들지만", "그래도", "노력", "해보려"]
-    }
-    
-    # 치료 동기 분석
-    motivation_indicators = {
-        "높음": ["변화하고싶", "노력", "해보겠", "시도", "배우고싶"],
-        "보통": ["그런 것 같", "해볼게", "생각해볼게"],
-        "낮음": ["모르겠", "안될것같", "어려울것같"]
-    }
-    
-    # 분석 결과
-    emotions = []
+    # 분석 결과 (정서는 언급 횟수가 많은 순, 같으면 사전 순서)
+    emotion_counts = {label[1]: hit["count"] for label, hit in hits.items() if label[0] == "emotion"}
+    emotions = sorted(emotion_counts, key=lambda e: -emotion_counts[e])
     risk_level = "정상"
     motivation = "보통"
     
-    for emotion, keywords in emotional_indicators.items():
-        if any(keyword in chat_text for keyword in keywords):
-            emotions.append(emotion)
-    
     # 위험도 평가
-    for level, keywords in risk_factors.items():
-        if any(keyword in chat_text for keyword in keywords):
-            if level == "고위험":
-                risk_level = "주의필요"
-            elif level == "중위험" and risk_level == "정상":
-                risk_level = "관찰필요"
+    if ("risk", "고위험") in hits:
+        risk_level = "주의필요"
+    elif ("risk", "중위험") in hits:
+        risk_level = "관찰필요"
     
     # 치료 동기 평가
-    for level, keywords in motivation_indicators.items():
-        if any(keyword in chat_text for keyword in keywords):
+    for level in MOTIVATION_INDICATORS:
+        if ("motivation", level) in hits:
             motivation = level
             break
     
+    negative = [e for e in emotions if e in NEGATIVE_EMOTIONS]
     return {
         "emotions": emotions[:3] if emotions else ["혼란감"],  # 최대 3개
         "dominant_emotion": emotions[0] if emotions else "혼란감",
         "risk_level": risk_level,
         "motivation": motivation,
-        "emotional_intensity": len([e for e in emotions if e in ["우울감", "불안감", "분노감"]])
+        "emotional_intensity": emotional_intensity(len(negative), sum(emotion_counts[e] for e in negative)),
+        "emotion_counts": emotion_counts
     }
 
 def generate_professional_report(chat_history, date, chat_count, previous_session=None):
@@ -231,46 +333,12 @@ def generate_professional_report(chat_history, date, chat_count, previous_sessio
 
     if model and tokenizer:
         try:
-            # 토크나이징 (token_type_ids 제거)
-            inputs = tokenizer(
-                system_prompt,
-                return_tensors="pt",
-                max_length=2048,
-                truncation=True,
-                padding=True,
-                return_token_type_ids=False
-            )
-            
-            # GPU로 이동
-            inputs = {k: v.to(device) for k, v in inputs.items()}
+            if report_cache is None:
+                return generate_model_report(system_prompt)
             
-            # 생성
-            with torch.no_grad():
-                outputs = model.generate(
-                    **inputs,
-                    max_new_tokens=600,
-                    temperature=0.6,
-                    top_p=0.9,
-                    top_k=40,
-                    do_sample=True,
-                    pad_token_id=tokenizer.eos_token_id,
-                    eos_token_id=tokenizer.eos_token_id
-                )
-            
-            # 디코딩
-            response = tokenizer.decode(outputs[0], skip_special_tokens=True)
-            
-            # 프롬프트 부분 제거
-            if "📋 실행계획" in response:
-                report_start = response.find("📊 정서상태 분석")
-                if report_start != -1:
-                    report = response[report_start:].strip()
-                else:
-                    report = response.split("📋 실행계획")[-1].strip()
-            else:
-                report = response[len(system_prompt):].strip()
-            
-            return clean_professional_report(report)
+            # 같은 채팅 내역·프롬프트·어댑터로 생성한 리포트는 캐시에서 바로 반환
+            key = report_cache_key(chat_history, chat_count, previous_session, REPORT_PROMPT_VERSION, ADAPTER_VERSION)
+            return report_cache.get_or_create(key, ADAPTER_VERSION, lambda: generate_model_report(system_prompt))
         
         except Exception as e:
             logger.error(f"전문 리포트 생성 오류: {e}")
@@ -278,6 +346,88 @@ def generate_professional_report(chat_history, date, chat_count, previous_sessio
     else:
         return generate_fallback_professional_report(psychological_state, date, chat_count)
 
+def generate_model_report(system_prompt):
+    """모델로 리포트 본문 생성 후 정리"""
+    import torch
+    
+    # 토크나이징 (token_type_ids 제거)
+    with STAGE_SECONDS.time(stage="tokenize"):
+        inputs = tokenizer(
+            system_prompt,
+            return_tensors="pt",
+            max_length=2048,
+            truncation=True,
+            padding=True,
+            return_token_type_ids=False
+        )
+        
+        # GPU로 이동
+        inputs = {k: v.to(device) for k, v in inputs.items()}
+    
+    # 공유 모델 서버: 채팅 요청과 같은 배치에서 리포트 어댑터로 생성
+    if generation_engine is not None:
+        output_ids = generation_engine.generate(
+            inputs["input_ids"][0].tolist(),
+            adapter=report_adapter,
+            on_finish=observe_engine_request,
+            max_new_tokens=600,
+            temperature=0.6,
+            top_p=0.9,
+            top_k=40,
+            do_sample=True,
+            eos_token_id=tokenizer.eos_token_id
+        )
+        return decode_model_report(output_ids, system_prompt)
+    
+    # 생성 (prefill / decode 시간 측정)
+    timer = GenerationTimer()
+    with torch.no_grad():
+        outputs = model.generate(
+            **inputs,
+            max_new_tokens=600,
+            temperature=0.6,
+            top_p=0.9,
+            top_k=40,
+            do_sample=True,
+            pad_token_id=tokenizer.eos_token_id,
+            eos_token_id=tokenizer.eos_token_id,
+            streamer=timer
+        )
+    prefill_seconds, decode_seconds = timer.timings()
+    STAGE_SECONDS.observe(prefill_seconds, stage="prefill")
+    STAGE_SECONDS.observe(decode_seconds, stage="decode")
+    TOKENS.inc(inputs["input_ids"].shape[1], direction="in")
+    TOKENS.inc(timer.new_tokens, direction="out")
+    return decode_model_report(outputs[0], system_prompt)
+
+def observe_engine_request(request):
+    """연속 배칭 엔진에서 끝난 리포트 요청의 대기·prefill·decode 시간과 토큰 수 기록"""
+    first_token_at = request.first_token_at or request.finished_at
+    STAGE_SECONDS.observe(request.admitted_at - request.submitted_at, stage="queue")
+    STAGE_SECONDS.observe(first_token_at - request.admitted_at, stage="prefill")
+    STAGE_SECONDS.observe(request.finished_at - first_token_at, stage="decode")
+    TOKENS.inc(len(request.input_ids), direction="in")
+    TOKENS.inc(len(request.generated), direction="out")
+
+def decode_model_report(output_ids, system_prompt):
+    """생성된 토큰 id(프롬프트 포함)를 리포트 본문으로 디코딩 후 정리"""
+    # 디코딩
+    with STAGE_SECONDS.time(stage="detokenize"):
+        response = tokenizer.decode(output_ids, skip_special_tokens=True)
+    
+    with STAGE_SECONDS.time(stage="cleanup"):
+        # 프롬프트 부분 제거
+        if "📋 실행계획" in response:
+            report_start = response.find("📊 정서상태 분석")
+            if report_start != -1:
+                report = response[report_start:].strip()
+            else:
+                report = response.split("📋 실행계획")[-1].strip()
+        else:
+            report = response[len(system_prompt):].strip()
+        
+        return clean_professional_report(report)
+
 def clean_professional_report(report):
     """전문 리포트 정리 및 형식화 (React 마크다운 최적화)"""
     # 프롬프트 부분 제거
@@ -422,9 +572,23 @@ def generate_comparison_analysis(current_state, previous_session):
 • **대처 의지**: {coping_trend} 경향 - 문제 해결에 대한 의지가 나타납니다
 • **치료 관계**: 상담사와의 신뢰 관계가 안정적으로 형성되고 있습니다"""
 
+def not_ready_response():
+    """모델 로딩 중 리포트 요청 응답 (503 + Retry-After, 로딩 중 기본 리포트가 캐시되지 않도록)"""
+    response = jsonify({
+        'success': False,
+        'message': '리포트 모델을 불러오는 중입니다. 잠시 후 다시 시도해주세요.',
+        'startup': startup.snapshot()
+    })
+    response.headers['Retry-After'] = '10'
+    return response, 503
+
 @app.route('/generate-report', methods=['POST'])
+@REQUEST_SECONDS.time(endpoint="/generate-report")
 def generate_report():
     """전문 리포트 생성 엔드포인트 (React UI 최적화)"""
+    if not startup.ready:
+        return not_ready_response()
+    
     try:
         data = request.json
         date = data.get('date', datetime.now().strftime('%Y-%m-%d'))
@@ -543,7 +707,8 @@ def generate_report():
                 'emotions': psychological_state['emotions'],
                 'risk_level': psychological_state['risk_level'],
                 'motivation': psychological_state['motivation'],
-                'intensity': psychological_state['emotional_intensity']
+                'intensity': psychological_state['emotional_intensity'],
+                'emotion_counts': psychological_state['emotion_counts']
             },
             
             # 비교 분석
@@ -596,30 +761,27 @@ def generate_report():
             'report_version': '3.0-react-optimized'
         }), 500
 
-@app.route('/report', methods=['POST'])
-def generate_report_legacy():
-    """index.js 호환 리포트 생성 엔드포인트"""
-    try:
-        data = request.json
-        date = data.get('date', datetime.now().strftime('%Y-%m-%d'))
-        chat_history = data.get('chatHistory', '')  # index.js에서 이미 텍스트로 변환해서 보냄
-        chat_count = data.get('chatCount', 0)
-        previous_session = data.get('previousSession', None)
-        
-        logger.info(f"리포트 생성 요청: 날짜={date}, 채팅수={chat_count}, 텍스트길이={len(chat_history) if chat_history else 0}")
-        
-        if not chat_history or len(chat_history.strip()) < 10:
-            return jsonify({
-                'success': False,
-                'message': '채팅 내역이 충분하지 않습니다.',
-                'date': date,
-                'session_count': 0,
-                'three_line_summary': [
-                    "💭 아직 오늘의 상담 내역이 없습니다.",
-                    "🎯 마음자리와 대화를 시작해보세요!",
-                    "📈 상담을 통해 마음을 나누고 성장할 수 있습니다."
-                ],
-                'professional_report': """📊 정서상태 분석
+def build_legacy_report(data):
+    """index.js 요청 본문(date, chatHistory, chatCount, previousSession)으로 리포트 응답 본문 생성"""
+    date = data.get('date', datetime.now().strftime('%Y-%m-%d'))
+    chat_history = data.get('chatHistory', '')  # index.js에서 이미 텍스트로 변환해서 보냄
+    chat_count = data.get('chatCount', 0)
+    previous_session = data.get('previousSession', None)
+    
+    logger.info(f"리포트 생성 요청: 날짜={date}, 채팅수={chat_count}, 텍스트길이={len(chat_history) if chat_history else 0}")
+    
+    if not chat_history or len(chat_history.strip()) < 10:
+        return {
+            'success': False,
+            'message': '채팅 내역이 충분하지 않습니다.',
+            'date': date,
+            'session_count': 0,
+            'three_line_summary': [
+                "💭 아직 오늘의 상담 내역이 없습니다.",
+                "🎯 마음자리와 대화를 시작해보세요!",
+                "📈 상담을 통해 마음을 나누고 성장할 수 있습니다."
+            ],
+            'professional_report': """📊 정서상태 분석
 아직 상담 내역이 없어 정서 상태를 분석할 수 없습니다.
 
 🎯 주요 이슈
@@ -632,76 +794,87 @@ def generate_report_legacy():
 **1단계**: 마음자리와 대화 시작하기
 **2단계**: 오늘의 감정과 상황 나누기  
 **3단계**: 전문적인 리포트와 조언 받기""",
-                'psychological_state': {
-                    'dominant_emotion': '대기중',
-                    'emotions': ['대기중'],
-                    'risk_level': '정상',
-                    'motivation': '준비중',
-                    'intensity': 0
-                },
-                'comparison_analysis': "📍 첫 상담을 시작하면 변화 분석을 제공해드리겠습니다.",
-                'recommendations': {
-                    'youtube_videos': ["📹 '마음건강 시작하기' - 마음건강TV"],
-                    'books': ["📚 '상담의 첫걸음' - 심리학 안내서"],
-                    'articles': ["📰 '상담의 효과' - 심리건강 가이드"]
-                },
-                'feedback_checklist': FEEDBACK_CHECKLIST,
-                'checklist_link': f"https://forms.gle/counseling-feedback-{date.replace('-', '')}",
-                'generated_at': datetime.now().isoformat(),
-                'report_version': '3.0-index-js-compatible'
-            })
-        
-        
-        # 심리상태 전문 분석
-        psychological_state = analyze_psychological_state(chat_history)
-        
-        # 전문 리포트 생성
-        professional_report = generate_professional_report(
-            chat_history, date, chat_count, previous_session
-        )
-        
-        # 3줄 핵심 요약
-        three_line_summary = generate_three_line_summary(chat_history, psychological_state)
-        
-        # 콘텐츠 추천
-        content_recommendations = get_content_recommendations(psychological_state)
-        
-        # 비교 분석
-        comparison_analysis = generate_comparison_analysis(
-            psychological_state, previous_session
-        )
-        
-        # 체크리스트 링크 생성 (날짜 기반)
-        checklist_link = f"https://forms.gle/counseling-feedback-{date.replace('-', '')}"
-        
-        logger.info(f"리포트 생성 완료: 주요감정={psychological_state['dominant_emotion']}, 강도={psychological_state['emotional_intensity']}")
-        
-        response_data = {
-            'success': True,
-            'date': date,
-            'session_count': chat_count,
-            'three_line_summary': three_line_summary,
-            'professional_report': professional_report,
             'psychological_state': {
-                'dominant_emotion': psychological_state['dominant_emotion'],
-                'emotions': psychological_state['emotions'],
-                'risk_level': psychological_state['risk_level'],
-                'motivation': psychological_state['motivation'],
-                'intensity': psychological_state['emotional_intensity']
+                'dominant_emotion': '대기중',
+                'emotions': ['대기중'],
+                'risk_level': '정상',
+                'motivation': '준비중',
+                'intensity': 0
             },
-            'comparison_analysis': comparison_analysis,
+            'comparison_analysis': "📍 첫 상담을 시작하면 변화 분석을 제공해드리겠습니다.",
             'recommendations': {
-                'youtube_videos': content_recommendations.get('youtube', []),
-                'books': content_recommendations.get('books', []),
-                'articles': content_recommendations.get('articles', [])
+                'youtube_videos': ["📹 '마음건강 시작하기' - 마음건강TV"],
+                'books': ["📚 '상담의 첫걸음' - 심리학 안내서"],
+                'articles': ["📰 '상담의 효과' - 심리건강 가이드"]
             },
             'feedback_checklist': FEEDBACK_CHECKLIST,
-            'checklist_link': checklist_link,
+            'checklist_link': f"https://forms.gle/counseling-feedback-{date.replace('-', '')}",
             'generated_at': datetime.now().isoformat(),
             'report_version': '3.0-index-js-compatible'
         }
-        
-        return jsonify(response_data)
+    
+    
+    # 심리상태 전문 분석
+    psychological_state = analyze_psychological_state(chat_history)
+    
+    # 전문 리포트 생성
+    professional_report = generate_professional_report(
+        chat_history, date, chat_count, previous_session
+    )
+    
+    # 3줄 핵심 요약
+    three_line_summary = generate_three_line_summary(chat_history, psychological_state)
+    
+    # 콘텐츠 추천
+    content_recommendations = get_content_recommendations(psychological_state)
+    
+    # 비교 분석
+    comparison_analysis = generate_comparison_analysis(
+        psychological_state, previous_session
+    )
+    
+    # 체크리스트 링크 생성 (날짜 기반)
+    checklist_link = f"https://forms.gle/counseling-feedback-{date.replace('-', '')}"
+    
+    logger.info(f"리포트 생성 완료: 주요감정={psychological_state['dominant_emotion']}, 강도={psychological_state['emotional_intensity']}")
+    
+    response_data = {
+        'success': True,
+        'date': date,
+        'session_count': chat_count,
+        'three_line_summary': three_line_summary,
+        'professional_report': professional_report,
+        'psychological_state': {
+            'dominant_emotion': psychological_state['dominant_emotion'],
+            'emotions': psychological_state['emotions'],
+            'risk_level': psychological_state['risk_level'],
+            'motivation': psychological_state['motivation'],
+            'intensity': psychological_state['emotional_intensity'],
+            'emotion_counts': psychological_state['emotion_counts']
+        },
+        'comparison_analysis': comparison_analysis,
+        'recommendations': {
+            'youtube_videos': content_recommendations.get('youtube', []),
+            'books': content_recommendations.get('books', []),
+            'articles': content_recommendations.get('articles', [])
+        },
+        'feedback_checklist': FEEDBACK_CHECKLIST,
+        'checklist_link': checklist_link,
+        'generated_at': datetime.now().isoformat(),
+        'report_version': '3.0-index-js-compatible'
+    }
+    
+    return response_data
+
+@app.route('/report', methods=['POST'])
+@REQUEST_SECONDS.time(endpoint="/report")
+def generate_report_legacy():
+    """index.js 호환 리포트 생성 엔드포인트"""
+    if not startup.ready:
+        return not_ready_response()
+    
+    try:
+        return jsonify(build_legacy_report(request.json))
         
     except Exception as e:
         logger.error(f"index.js 리포트 생성 오류: {e}")
@@ -710,31 +883,106 @@ def generate_report_legacy():
             'message': '리포트 생성 중 오류가 발생했습니다.',
             'error': str(e)
         }), 500
+
+def report_job_key(date, chat_history):
+    """같은 날짜·같은 채팅 내역 요청을 하나로 합치기 위한 작업 키"""
+    return (date, hashlib.sha256((chat_history or '').encode('utf-8')).hexdigest())
+
+# 리포트 생성 작업 큐 (GPU 하나를 쓰므로 기본 워커 1개, 대기열이 가득 차면 429)
+report_jobs = ReportJobQueue(
+    build_legacy_report,
+    workers=int(os.getenv("REPORT_WORKERS", "1")),
+    max_queue=int(os.getenv("REPORT_QUEUE_SIZE", "16")),
+    ttl=float(os.getenv("REPORT_JOB_TTL", "3600"))
+)
+REPORT_RETRY_AFTER = int(os.getenv("REPORT_RETRY_AFTER", "30"))
+
+@app.route('/report/jobs', methods=['POST'])
+def submit_report_job():
+    """리포트 생성 작업 등록 (/report와 같은 요청 본문, 작업 id를 바로 반환)"""
+    if not startup.ready:
+        return not_ready_response()
+    
+    try:
+        data = dict(request.json or {})
+        # 기본 날짜를 등록 시점에 고정해 작업 키와 결과 날짜를 맞춤
+        data['date'] = data.get('date') or datetime.now().strftime('%Y-%m-%d')
+        
+        try:
+            job, created = report_jobs.submit(report_job_key(data['date'], data.get('chatHistory', '')), data)
+        except QueueFull as e:
+            logger.warning(f"리포트 작업 거부: {e}")
+            response = jsonify({
+                'success': False,
+                'message': '리포트 요청이 많습니다. 잠시 후 다시 시도해주세요.',
+                'error': str(e)
+            })
+            response.headers['Retry-After'] = str(REPORT_RETRY_AFTER)
+            return response, 429
+        
+        logger.info(f"리포트 작업 {'등록' if created else '중복 요청 병합'}: {job.job_id} (날짜={data['date']})")
+        return jsonify({
+            'success': True,
+            'job_id': job.job_id,
+            'status': job.status,
+            'deduplicated': not created,
+            'status_url': f"/report/jobs/{job.job_id}"
+        }), 202
         
     except Exception as e:
-        logger.error(f"기존 리포트 생성 오류: {e}")
+        logger.error(f"리포트 작업 등록 오류: {e}")
         return jsonify({
             'success': False,
-            'message': '리포트 생성 중 오류가 발생했습니다.',
+            'message': '리포트 작업 등록 중 오류가 발생했습니다.',
             'error': str(e)
         }), 500
 
+@app.route('/report/jobs/<job_id>', methods=['GET'])
+def get_report_job(job_id):
+    """리포트 작업 상태 조회 (완료 시 /report와 같은 결과 포함)"""
+    job = report_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': '작업을 찾을 수 없습니다.'}), 404
+    return jsonify(job.to_dict())
+
 @app.route('/health', methods=['GET'])
 def health():
     return jsonify({
         'status': 'healthy',
         'service': 'professional-counseling-report-server',
         'version': '3.0-index-js-compatible',
+        'ready': startup.ready,
         'model_loaded': model is not None,
-        'gpu_device': device if 'device' in globals() else 'unknown',
-        'port': 5004,
-        'endpoints': ['/report', '/health', '/checklist'],
+        'gpu_device': device or 'unknown',
+        'adapter': report_adapter,
+        'port': REPORT_PORT,
+        'endpoints': ['/report', '/report/jobs', '/report/jobs/<job_id>', '/health', '/health/live', '/health/ready',
+                      '/metrics', '/checklist'],
+        'report_jobs': report_jobs.stats(),
+        'report_cache': report_cache.stats() if report_cache is not None else None,
         'compatible_with': 'index.js middleware server',
         'features': [
             'professional_analysis',
         ]
     })
 
+@app.route('/health/live', methods=['GET'])
+def health_live():
+    """프로세스 생존 확인 (모델 로딩 중에도 200)"""
+    snapshot = startup.snapshot()
+    return jsonify({'status': 'alive', 'uptime_s': snapshot['uptime_s']}), 200 if snapshot['live'] else 503
+
+@app.route('/health/ready', methods=['GET'])
+def health_ready():
+    """리포트 요청 처리 준비 여부 (모델 로딩이 끝나면 200, 실패해도 기본 리포트 모드로 200)"""
+    snapshot = startup.snapshot()
+    return jsonify(snapshot), 200 if snapshot['ready'] else 503
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus 텍스트 형식 지표 (단계별 시간, 토큰 수, 작업 대기열, 캐시 적중률)"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
 @app.route('/checklist', methods=['GET'])
 def get_checklist():
     """체크리스트 반환 엔드포인트"""
@@ -745,8 +993,10 @@ def get_checklist():
     })
 
 if __name__ == '__main__':
+    # 모델은 백그라운드에서 로딩하고 HTTP 서버는 바로 시작 (준비 여부는 /health/ready)
+    startup.start([("model", load_model)])
     logger.info("전문 심리상담 리포트 서버 v3.0을 시작합니다...")
     logger.info("React UI 최적화: 마크다운 지원, 섹션별 아이콘, 개선된 응답 구조")
     logger.info("업그레이드 기능: 객관적 분석, 콘텐츠 추천, 3줄 요약, 체크리스트, 감정 강도 분석")
-    logger.info("포트 5004에서 실행 중 (index.js 호환)")
-    app.run(host='0.0.0.0', port=5004, debug=False)
+    logger.info(f"포트 {REPORT_PORT}에서 실행 중 (index.js 호환)")
+    app.run(host='0.0.0.0', port=REPORT_PORT, debug=False)
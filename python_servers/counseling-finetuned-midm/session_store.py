@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+상담 세션 저장소
+세션 상태(상담 단계, 턴 수, 감정, 페르소나)와 대화 기록을 보관합니다.
+- memory: 프로세스 내 LRU + TTL (세션 수·세션당 기록 수 상한)
+- sqlite: 단일 파일 WAL 모드 (여러 gunicorn 워커가 같은 파일 공유, 재시작 후에도 유지)
+
+SESSION_STORE 환경변수 예:
+    memory
+    sqlite:///var/lib/counseling/sessions.db
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """세션 저장소 인터페이스"""
+
+    def get_session(self, session_id):
+        """세션 상태 dict 반환 (없으면 None)"""
+        raise NotImplementedError
+
+    def save_session(self, session_id, data):
+        raise NotImplementedError
+
+    def update_session(self, session_id, update, default):
+        """
+        세션 상태를 원자적으로 읽고 갱신 (동시 요청의 갱신이 유실되지 않음)
+        update(data)가 data를 고치고, 세션이 없거나 만료됐으면 default()로 시작합니다. 갱신된 상태 반환
+        """
+        raise NotImplementedError
+
+    def append_turn(self, session_id, record):
+        """대화 기록 한 턴 추가"""
+        raise NotImplementedError
+
+    def recent_turns(self, session_id, limit):
+        """최근 limit개 기록을 오래된 순으로 반환 (전체 기록을 읽지 않음)"""
+        raise NotImplementedError
+
+    def turn_count(self, session_id):
+        """지금까지 저장된 전체 기록 수"""
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class InMemorySessionStore(SessionStore):
+    """프로세스 내 LRU + TTL 저장소 (오래된 세션은 자동 삭제)"""
+
+    def __init__(self, max_sessions=10000, ttl=86400, max_turns=50):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_turns = max_turns
+
+        self._sessions = OrderedDict()  # session_id -> {"data", "turns", "turn_count", "updated_at"}
+        self._lock = threading.Lock()
+
+    def _touch(self, session_id, create=False):
+        entry = self._sessions.get(session_id)
+        now = time.time()
+        if entry is not None and now - entry["updated_at"] > self.ttl:
+            del self._sessions[session_id]
+            entry = None
+        if entry is None:
+            if not create:
+                return None
+            entry = {"data": None, "turns": deque(maxlen=self.max_turns), "turn_count": 0, "updated_at": now}
+            self._sessions[session_id] = entry
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        entry["updated_at"] = now
+        self._sessions.move_to_end(session_id)
+        return entry
+
+    def get_session(self, session_id):
+        with self._lock:
+            entry = self._touch(session_id)
+            return entry["data"] if entry is not None else None
+
+    def save_session(self, session_id, data):
+        with self._lock:
+            self._touch(session_id, create=True)["data"] = data
+
+    def update_session(self, session_id, update, default):
+        with self._lock:
+            entry = self._touch(session_id, create=True)
+            data = entry["data"] if entry["data"] is not None else default()
+            update(data)
+            entry["data"] = data
+            return data
+
+    def append_turn(self, session_id, record):
+        with self._lock:
+            entry = self._touch(session_id, create=True)
+            entry["turns"].append(record)
+            entry["turn_count"] += 1
+
+    def recent_turns(self, session_id, limit):
+        with self._lock:
+            entry = self._touch(session_id)
+            if entry is None or limit <= 0:
+                return []
+            turns = entry["turns"]
+            return [turns[i] for i in range(max(0, len(turns) - limit), len(turns))]
+
+    def turn_count(self, session_id):
+        with self._lock:
+            entry = self._touch(session_id)
+            return entry["turn_count"] if entry is not None else 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SQLiteSessionStore(SessionStore):
+    """SQLite(WAL) 단일 파일 저장소 - 여러 프로세스가 같은 파일을 공유"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            data TEXT,
+            turn_count INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS turns (
+            session_id TEXT NOT NULL,
+            turn_number INTEGER NOT NULL,
+            record TEXT NOT NULL,
+            PRIMARY KEY (session_id, turn_number)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions(updated_at);
+    """
+
+    def __init__(self, path, ttl=86400, max_turns=50, cleanup_every=1000):
+        self.path = path
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self.cleanup_every = cleanup_every
+
+        self._local = threading.local()
+        self._writes = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self):
+        """스레드별 연결 (WAL 모드에서는 읽기와 쓰기가 서로 막지 않음)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self):
+        """쓰기 트랜잭션 (BEGIN IMMEDIATE로 다른 프로세스의 쓰기와 직렬화)"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._after_write()
+
+    def _reset_expired(self, conn, session_id, now):
+        """TTL이 지났지만 아직 정리되지 않은 세션은 기록·턴 수를 지우고 새 세션으로 시작"""
+        cutoff = now - self.ttl
+        conn.execute(
+            "DELETE FROM turns WHERE session_id = ? "
+            "AND EXISTS (SELECT 1 FROM sessions WHERE session_id = ? AND updated_at < ?)",
+            (session_id, session_id, cutoff)
+        )
+        conn.execute("DELETE FROM sessions WHERE session_id = ? AND updated_at < ?", (session_id, cutoff))
+
+    def _after_write(self):
+        self._writes += 1
+        if self._writes % self.cleanup_every == 0:
+            self.expire()
+
+    def get_session(self, session_id):
+        row = self._conn().execute(
+            "SELECT data FROM sessions WHERE session_id = ? AND updated_at >= ?",
+            (session_id, time.time() - self.ttl)
+        ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(row[0])
+
+    def _upsert_data(self, conn, session_id, data, now):
+        conn.execute(
+            "INSERT INTO sessions (session_id, data, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(session_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            (session_id, json.dumps(data, ensure_ascii=False), now)
+        )
+
+    def save_session(self, session_id, data):
+        now = time.time()
+        with self._write() as conn:
+            self._reset_expired(conn, session_id, now)
+            self._upsert_data(conn, session_id, data, now)
+
+    def update_session(self, session_id, update, default):
+        now = time.time()
+        with self._write() as conn:
+            self._reset_expired(conn, session_id, now)
+            row = conn.execute("SELECT data FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            data = json.loads(row[0]) if row is not None and row[0] is not None else default()
+            update(data)
+            self._upsert_data(conn, session_id, data, now)
+        return data
+
+    def append_turn(self, session_id, record):
+        now = time.time()
+        with self._write() as conn:
+            self._reset_expired(conn, session_id, now)
+            conn.execute(
+                "INSERT INTO sessions (session_id, turn_count, updated_at) VALUES (?, 1, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET turn_count = turn_count + 1, updated_at = excluded.updated_at",
+                (session_id, now)
+            )
+            (turn_number,) = conn.execute(
+                "SELECT turn_count FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            conn.execute(
+                "INSERT INTO turns (session_id, turn_number, record) VALUES (?, ?, ?)",
+                (session_id, turn_number, json.dumps(record, ensure_ascii=False))
+            )
+            # 세션당 최근 max_turns개만 보관
+            conn.execute(
+                "DELETE FROM turns WHERE session_id = ? AND turn_number <= ?",
+                (session_id, turn_number - self.max_turns)
+            )
+
+    def recent_turns(self, session_id, limit):
+        if limit <= 0:
+            return []
+        # 만료됐지만 아직 정리되지 않은 세션의 기록은 보이지 않음 (get_session과 같은 기준)
+        rows = self._conn().execute(
+            "SELECT t.record FROM turns t JOIN sessions s ON s.session_id = t.session_id "
+            "WHERE t.session_id = ? AND s.updated_at >= ? ORDER BY t.turn_number DESC LIMIT ?",
+            (session_id, time.time() - self.ttl, limit)
+        ).fetchall()
+        return [json.loads(r[0]) for r in reversed(rows)]
+
+    def turn_count(self, session_id):
+        row = self._conn().execute(
+            "SELECT turn_count FROM sessions WHERE session_id = ? AND updated_at >= ?",
+            (session_id, time.time() - self.ttl)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def expire(self):
+        """TTL이 지난 세션과 기록 삭제"""
+        cutoff = time.time() - self.ttl
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "DELETE FROM turns WHERE session_id IN (SELECT session_id FROM sessions WHERE updated_at < ?)",
+                (cutoff,)
+            )
+            conn.execute("DELETE FROM sessions WHERE updated_at < ?", (cutoff,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+def create_session_store(url=None, **kwargs):
+    """SESSION_STORE 설정 문자열로 저장소 생성 (memory | sqlite:///경로)"""
+    url = url or os.getenv("SESSION_STORE", "memory")
+    if url == "memory":
+        kwargs.setdefault("max_sessions", int(os.getenv("SESSION_STORE_MAX_SESSIONS", "10000")))
+        return InMemorySessionStore(**kwargs)
+    if url.startswith("sqlite:"):
+        path = url[len("sqlite:"):]
+        if path.startswith("//"):
+            path = path[2:]
+        return SQLiteSessionStore(path, **kwargs)
+    raise ValueError(f"알 수 없는 SESSION_STORE 설정: {url}")
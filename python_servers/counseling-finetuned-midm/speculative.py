@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Speculative decoding (작은 draft 모델이 후보 토큰을 만들고 본 모델이 한 번의 forward로 검증)
+transformers의 assisted generation(model.generate(assistant_model=...))을 사용합니다.
+- do_sample=True면 speculative sampling(수락/기각 후 재샘플)이라 본 모델의 출력 분포가 그대로 유지되고,
+  greedy면 결과 토큰이 본 모델 단독 생성과 같습니다
+- draft는 본 모델과 토크나이저(어휘)가 같아야 합니다 (예: Midm-2.0-Base ← Midm-2.0-Mini)
+- 한 번에 한 응답만 speculative decoding으로 생성합니다 (진행 중이면 다른 요청은 일반 경로)
+- 응답마다 후보 토큰 수와 수락 토큰 수를 기록하고, 최근 수락률이 기준보다 낮으면 일반 디코딩으로 되돌린 뒤
+  retry_after개 응답마다 한 번씩 다시 측정해 기준을 넘으면 재사용합니다
+"""
+
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class SpeculativeDecoder:
+    """draft 모델 + 수락률 추적·자동 폴백"""
+
+    def __init__(self, model, draft_model, num_assistant_tokens=5, min_acceptance=0.3, window=20, min_samples=5,
+                 retry_after=50):
+        target_vocab = model.config.get_text_config().vocab_size
+        draft_vocab = draft_model.config.get_text_config().vocab_size
+        if target_vocab != draft_vocab:
+            raise ValueError(f"draft 모델의 어휘 크기({draft_vocab})가 본 모델({target_vocab})과 다릅니다. "
+                             f"같은 토크나이저를 쓰는 draft 모델이 필요합니다.")
+
+        self.draft_model = draft_model
+        self.min_acceptance = min_acceptance
+        self.min_samples = min_samples
+        self.retry_after = retry_after
+        # 후보 수는 응답 안에서만 수락 결과에 따라 조절 (모두 수락 +2, 아니면 -1, 응답마다 초기값으로 복원)
+        draft_model.generation_config.num_assistant_tokens = num_assistant_tokens
+        draft_model.generation_config.num_assistant_tokens_schedule = "heuristic_transient"
+
+        self.active = True
+        self._recent = deque(maxlen=window)  # 최근 응답별 수락률
+        self._since_fallback = 0
+        self._lock = threading.Lock()
+        self._slot = threading.Semaphore(1)  # 진행 중인 speculative 생성 (should_use가 잡고 slot 블록이 끝날 때 반환)
+        self._local = threading.local()  # 요청 스레드별 후보 토큰 수
+        self.totals = {"replies": 0, "proposed": 0, "accepted": 0, "fallbacks": 0}
+
+        # assisted generation은 매 단계 draft_model.generate로 후보를 만듦 → 생성한 후보 수를 요청 스레드별로 누적
+        generate = draft_model.generate
+
+        def counted_generate(*args, **kwargs):
+            output = generate(*args, **kwargs)
+            scores = getattr(output, "scores", None)  # 후보 생성 호출은 항상 output_scores=True
+            if scores is not None and getattr(self._local, "proposed", None) is not None:
+                self._local.proposed += len(scores)
+            return output
+
+        draft_model.generate = counted_generate
+
+    def generate_kwargs(self):
+        return {"assistant_model": self.draft_model}
+
+    def should_use(self):
+        """
+        이번 응답에 사용할지 (폴백 중에는 retry_after개 응답마다 한 번 재측정)
+        True면 생성 자리를 잡은 상태이므로 생성 전체를 slot() 블록으로 감싸야 합니다 (블록을 못 열면 release())
+        """
+        if not self._slot.acquire(blocking=False):
+            return False
+        with self._lock:
+            if self.active:
+                return True
+            self._since_fallback += 1
+            if self._since_fallback >= self.retry_after:
+                self._since_fallback = 0
+                return True
+        self._slot.release()
+        return False
+
+    def release(self):
+        """should_use()가 잡은 생성 자리 반환"""
+        self._slot.release()
+
+    @contextmanager
+    def slot(self):
+        """should_use()가 잡은 생성 자리를 블록이 끝날 때 반환 (생성 준비 중 예외가 나도 반환)"""
+        try:
+            yield
+        finally:
+            self.release()
+
+    @contextmanager
+    def measure(self, timer):
+        """model.generate 호출을 감싸 후보·수락 토큰 수 기록 (timer: GenerationTimer)"""
+        self._local.proposed = 0
+        try:
+            yield
+        finally:
+            proposed, self._local.proposed = self._local.proposed, None
+        # 본 모델 검증 1회마다 수락된 후보 + 본 모델이 고른 토큰 1개가 나옴
+        self.record(proposed, max(0, timer.new_tokens - timer.steps))
+
+    def record(self, proposed, accepted):
+        with self._lock:
+            self.totals["replies"] += 1
+            self.totals["proposed"] += proposed
+            self.totals["accepted"] += accepted
+            if proposed == 0:
+                return
+            rate = accepted / proposed
+
+            if not self.active:
+                # 재측정 응답의 수락률이 기준 이상이면 다시 사용
+                if rate >= self.min_acceptance:
+                    self.active = True
+                    self._recent.clear()
+                    self._recent.append(rate)
+                    logger.info(f"speculative decoding 재사용 (수락률 {rate:.2f})")
+                return
+
+            self._recent.append(rate)
+            if len(self._recent) >= self.min_samples and self.acceptance_rate < self.min_acceptance:
+                self.active = False
+                self._since_fallback = 0
+                self.totals["fallbacks"] += 1
+                logger.warning(f"speculative decoding 수락률 {self.acceptance_rate:.2f} < {self.min_acceptance} "
+                               f"- 일반 디코딩으로 전환 ({self.retry_after}개 응답 후 재측정)")
+                self._recent.clear()
+
+    @property
+    def acceptance_rate(self):
+        """최근 응답들의 평균 수락률 (기록이 없으면 None)"""
+        return sum(self._recent) / len(self._recent) if self._recent else None
+
+    def stats(self):
+        with self._lock:
+            totals = dict(self.totals)
+            rate = self.acceptance_rate
+            active = self.active
+        return {
+            **totals,
+            "active": active,
+            "recent_acceptance_rate": rate,
+            "acceptance_rate": totals["accepted"] / totals["proposed"] if totals["proposed"] else None,
+        }
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+서버 시작 상태 추적 (백그라운드 로딩 + /health/live, /health/ready)
+HTTP 서버는 바로 열고 모델·어댑터·토크나이저·RAG는 백그라운드 스레드에서 올리면서
+구성 요소별 상태(pending → loading → ready | failed | skipped), 진행 단계, 소요 시간을 기록합니다.
+- live: 프로세스가 응답 중이고 필수 구성 요소가 실패하지 않았음 (실패하면 재시작 대상)
+- ready: 로딩 중인 구성 요소가 없고 필수 구성 요소가 모두 ready
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+class StartupTracker:
+    """구성 요소별 로딩 상태 (여러 스레드에서 갱신)"""
+
+    def __init__(self, components, required=()):
+        self.required = set(required)
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._components = {name: {"state": PENDING, "detail": None, "seconds": None, "error": None}
+                            for name in components}
+        self._started = {}
+
+    def _update(self, name, **fields):
+        with self._lock:
+            self._components[name].update(fields)
+
+    def progress(self, name, detail):
+        """진행 단계 기록 (예: "베이스 모델 로딩 중")"""
+        self._update(name, detail=detail)
+        logger.info(f"[startup] {name}: {detail}")
+
+    def skip(self, name, reason):
+        self._update(name, state=SKIPPED, detail=reason)
+
+    def fail(self, name, error):
+        self._update(name, state=FAILED, error=str(error))
+
+    def run(self, name, fn):
+        """fn() 실행 결과로 상태 기록 후 결과 반환 (예외 또는 False면 failed, 이때 None 반환)"""
+        start = time.perf_counter()
+        self._update(name, state=LOADING)
+        try:
+            result = fn()
+        except Exception as e:
+            logger.error(f"[startup] {name} 로딩 실패: {e}")
+            self._update(name, state=FAILED, error=str(e), seconds=round(time.perf_counter() - start, 3))
+            return None
+        seconds = round(time.perf_counter() - start, 3)
+        if result is False:
+            with self._lock:
+                component = self._components[name]
+                component.update(state=FAILED, seconds=seconds, error=component["error"] or component["detail"])
+            return None
+        self._update(name, state=READY, seconds=seconds, detail=None)
+        return result
+
+    def run_chain(self, steps):
+        """(이름, fn) 단계를 순서대로 실행, 하나가 실패하면 나머지는 skipped"""
+        for i, (name, fn) in enumerate(steps):
+            if self.run(name, fn) is None and self.state(name) == FAILED:
+                for rest, _ in steps[i + 1:]:
+                    self.skip(rest, f"{name} 로딩 실패")
+                return False
+        return True
+
+    def start(self, *chains):
+        """체인마다 데몬 스레드 하나로 백그라운드 실행 (체인끼리는 병렬)"""
+        for i, steps in enumerate(chains):
+            thread = threading.Thread(target=self.run_chain, args=(steps,), name=f"startup-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def wait(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def state(self, name):
+        with self._lock:
+            return self._components[name]["state"]
+
+    @property
+    def live(self):
+        with self._lock:
+            return not any(self._components[name]["state"] == FAILED for name in self.required)
+
+    @property
+    def ready(self):
+        with self._lock:
+            states = {name: c["state"] for name, c in self._components.items()}
+        return (not any(state in (PENDING, LOADING) for state in states.values())
+                and all(states[name] == READY for name in self.required))
+
+    def snapshot(self):
+        with self._lock:
+            components = {name: dict(c) for name, c in self._components.items()}
+        return {
+            "live": self.live,
+            "ready": self.ready,
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "components": components,
+        }
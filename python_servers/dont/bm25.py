@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+BM25 희소 색인 + 하이브리드 검색 (BM25 + 벡터, reciprocal-rank fusion)
+- 토큰화: 한글은 음절 bigram (조사·어미가 붙어도 부분 일치), 영문/숫자는 단어 단위
+- 색인: ingest.py가 Chroma에 적재한 청크로 만들고, 청크 구성이 바뀔 때만 다시 생성
+- 저장: 배열 기반 포스팅 (.npy) → 조회 시 np.load(mmap_mode="r")로 바로 열림
+    terms.bin    정렬된 용어 UTF-8 바이트를 이어 붙인 것 (term_offsets.npy로 잘라 이진 탐색)
+    offsets.npy  용어별 포스팅 시작 위치 (len = 용어 수 + 1)
+    docs.npy     포스팅 문서 번호 (int32)
+    tfs.npy      포스팅 용어 빈도 (uint16)
+    norms.npy    문서별 길이 정규화 값 k1 * (1 - b + b * dl / avgdl)
+    ids.npy      문서 번호 → 청크 id (ASCII 바이트)
+- counseling-finetuned-midm/bm25_index.py가 같은 형식을 읽으므로 토큰화를 바꾸면 TOKENIZER도 올릴 것
+"""
+
+import bisect
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+FORMAT_VERSION = 1
+TOKENIZER = "hangul-bigram-v1"
+MAX_TOKEN_LENGTH = 32
+K1 = 1.2
+B = 0.75
+RRF_K = 60
+
+TOKEN_PATTERN = re.compile(r"[가-힣]+|[^\W_가-힣]+")
+
+
+# -----------------------------
+# 토큰화
+# -----------------------------
+def tokenize(text: str) -> List[str]:
+    """한글 구간은 음절 bigram, 그 외(영문·숫자)는 단어 그대로"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    tokens = []
+    for run in TOKEN_PATTERN.findall(text):
+        if "가" <= run[0] <= "힣" and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run[:MAX_TOKEN_LENGTH])
+    return tokens
+
+
+# -----------------------------
+# 색인 생성
+# -----------------------------
+def index_fingerprint(chunk_ids: Iterable[str]) -> str:
+    """청크 id 집합 해시 (같으면 색인을 다시 만들 필요 없음)"""
+    digest = hashlib.sha256()
+    for chunk_id in sorted(chunk_ids):
+        digest.update(chunk_id.encode("utf-8") + b"\0")
+    digest.update(TOKENIZER.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def current_dir(index_dir: Path) -> Optional[Path]:
+    """CURRENT 파일이 가리키는 현재 색인 폴더 (없으면 None)"""
+    pointer = Path(index_dir) / "CURRENT"
+    if not pointer.exists():
+        return None
+    path = Path(index_dir) / pointer.read_text(encoding="utf-8").strip()
+    return path if (path / "meta.json").exists() else None
+
+
+def current_fingerprint(index_dir: Path) -> Optional[str]:
+    path = current_dir(index_dir)
+    if path is None:
+        return None
+    with open(path / "meta.json", encoding="utf-8") as f:
+        return json.load(f).get("fingerprint")
+
+
+def iter_collection_documents(collection, page_size: int = 1000) -> Iterable[Tuple[str, str]]:
+    """Chroma 컬렉션의 (청크 id, 본문)을 page_size개씩 읽기"""
+    offset = 0
+    while True:
+        page = collection.get(include=["documents"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            return
+        yield from zip(page["ids"], page["documents"])
+        offset += len(page["ids"])
+
+
+def build_bm25_index(documents: Iterable[Tuple[str, str]], index_dir: Path, fingerprint: str) -> Dict:
+    """(청크 id, 본문)으로 색인을 만들어 새 폴더에 쓰고 CURRENT를 교체 (읽는 쪽은 중단 없이 계속 사용)"""
+    start = time.perf_counter()
+    postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+    ids, lengths = [], []
+    for doc, (chunk_id, text) in enumerate(documents):
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            postings[term].append((doc, min(tf, 65535)))
+        ids.append(chunk_id)
+        lengths.append(sum(counts.values()))
+
+    terms = sorted(postings)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(postings[t]) for t in terms])
+    docs = np.empty(offsets[-1], dtype=np.int32)
+    tfs = np.empty(offsets[-1], dtype=np.uint16)
+    for i, term in enumerate(terms):
+        entries = np.asarray(postings[term], dtype=np.int64).reshape(-1, 2)
+        docs[offsets[i]:offsets[i + 1]] = entries[:, 0]
+        tfs[offsets[i]:offsets[i + 1]] = entries[:, 1]
+    lengths = np.asarray(lengths, dtype=np.float32)
+    avgdl = float(lengths.mean()) if len(lengths) else 0.0
+    norms = (K1 * (1 - B + B * lengths / avgdl) if avgdl else lengths).astype(np.float32)
+
+    index_dir = Path(index_dir)
+    target = index_dir / fingerprint[:16]
+    if target.exists():
+        shutil.rmtree(target)
+    target.mkdir(parents=True)
+    encoded = [term.encode("utf-8") for term in terms]
+    (target / "terms.bin").write_bytes(b"".join(encoded))
+    term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    term_offsets[1:] = np.cumsum([len(term) for term in encoded])
+    np.save(target / "term_offsets.npy", term_offsets)
+    np.save(target / "offsets.npy", offsets)
+    np.save(target / "docs.npy", docs)
+    np.save(target / "tfs.npy", tfs)
+    np.save(target / "norms.npy", norms)
+    np.save(target / "ids.npy", np.asarray([i.encode("ascii") for i in ids], dtype=np.bytes_))
+    meta = {
+        "format": FORMAT_VERSION,
+        "tokenizer": TOKENIZER,
+        "k1": K1,
+        "b": B,
+        "n_docs": len(ids),
+        "n_terms": len(terms),
+        "n_postings": int(offsets[-1]),
+        "avgdl": avgdl,
+        "fingerprint": fingerprint,
+    }
+    with open(target / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    # 새 색인으로 교체 후 이전 폴더 삭제 (mmap으로 열려 있던 파일은 닫힐 때까지 유지됨)
+    pointer = index_dir / "CURRENT"
+    tmp = index_dir / "CURRENT.tmp"
+    tmp.write_text(target.name, encoding="utf-8")
+    os.replace(tmp, pointer)
+    for old in index_dir.iterdir():
+        if old.is_dir() and old != target:
+            shutil.rmtree(old, ignore_errors=True)
+
+    meta["seconds"] = round(time.perf_counter() - start, 2)
+    meta["bytes"] = sum(p.stat().st_size for p in target.iterdir())
+    return meta
+
+
+# -----------------------------
+# 조회
+# -----------------------------
+class TermTable:
+    """terms.bin을 메모리 매핑해 i번째 용어(UTF-8 바이트)를 돌려주는 정렬된 시퀀스 (bisect용)"""
+
+    def __init__(self, path):
+        self.offsets = np.load(Path(path) / "term_offsets.npy", mmap_mode="r")
+        size = int(self.offsets[-1])
+        self.blob = np.memmap(Path(path) / "terms.bin", dtype=np.uint8, mode="r") if size else np.zeros(0, np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+
+class BM25Index:
+    """메모리 매핑한 BM25 색인"""
+
+    def __init__(self, index_dir: Path):
+        path = current_dir(index_dir)
+        if path is None:
+            raise FileNotFoundError(f"BM25 색인이 없습니다: {index_dir} (ingest.py를 실행하세요)")
+        with open(path / "meta.json", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta["format"] != FORMAT_VERSION or self.meta["tokenizer"] != TOKENIZER:
+            raise ValueError(f"BM25 색인 형식이 다릅니다 ({self.meta['format']}, {self.meta['tokenizer']}). "
+                             f"ingest.py로 다시 만드세요.")
+        self.path = path
+        self.terms = TermTable(path)
+        self.offsets = np.load(path / "offsets.npy", mmap_mode="r")
+        self.docs = np.load(path / "docs.npy", mmap_mode="r")
+        self.tfs = np.load(path / "tfs.npy", mmap_mode="r")
+        self.norms = np.load(path / "norms.npy", mmap_mode="r")
+        self.ids = np.load(path / "ids.npy", mmap_mode="r")
+        self.n_docs = self.meta["n_docs"]
+
+    def term_id(self, term: str) -> int:
+        key = term.encode("utf-8")
+        i = bisect.bisect_left(self.terms, key)
+        return i if i < len(self.terms) and self.terms[i] == key else -1
+
+    def search(self, query: str, top_k: int) -> List[Tuple[str, float]]:
+        """(청크 id, BM25 점수) 목록 (점수 순)"""
+        if not self.n_docs:
+            return []
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        k1 = self.meta["k1"]
+        for term, qtf in Counter(tokenize(query)).items():
+            i = self.term_id(term)
+            if i < 0:
+                continue
+            start, end = self.offsets[i], self.offsets[i + 1]
+            docs = self.docs[start:end]
+            tfs = self.tfs[start:end].astype(np.float32)
+            df = end - start
+            idf = np.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5))
+            scores[docs] += qtf * idf * tfs * (k1 + 1) / (tfs + self.norms[docs])
+
+        hits = np.flatnonzero(scores)
+        if len(hits) > top_k:
+            hits = hits[np.argpartition(-scores[hits], top_k)[:top_k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [(self.ids[d].decode("ascii"), float(scores[d])) for d in hits]
+
+
+def rrf_fuse(rankings: List[List[str]], top_k: int, k: int = RRF_K) -> List[Tuple[str, float]]:
+    """reciprocal-rank fusion: 각 순위 목록에서 1 / (k + 순위)를 더해 정렬"""
+    fused: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, 1):
+            fused[chunk_id] += 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: -item[1])[:top_k]
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+스트리밍 임베딩 → Chroma 적재
+청크 → (embed_batch_size 단위) 임베딩 → 제한된 큐 → 쓰기 스레드가 배치별 upsert
+
+- 큐가 가득 차면 임베딩 단계가 기다리므로(backpressure) 메모리에 머무는 청크는
+  최대 batch_size * (queue_size + 2)개로 일정합니다.
+- 청크 id가 내용 해시라서, 중간에 멈춘 뒤 다시 실행하면 이미 적재된 청크는
+  임베딩 전에 건너뜁니다 (Chroma에 쓰인 배치가 곧 체크포인트).
+- commit(callback)은 그 전에 추가한 청크가 모두 쓰인 뒤 쓰기 스레드에서 호출됩니다
+  (파일 단위 매니페스트 저장용).
+"""
+
+import queue
+import threading
+import time
+from typing import Callable, List
+
+from llama_index.core.schema import BaseNode, MetadataMode
+from llama_index.core.vector_stores.utils import node_to_metadata_dict
+
+_STOP = object()
+
+
+class EmbeddingWriter:
+    def __init__(self, collection, embed_model, batch_size: int = 0, queue_size: int = 4,
+                 log: Callable[[str], None] = print, log_every: float = 10.0):
+        self.collection = collection
+        self.embed_model = embed_model
+        self.batch_size = batch_size or getattr(embed_model, "embed_batch_size", 64)
+        self.log = log
+        self.log_every = log_every
+
+        self._batch: List[BaseNode] = []
+        self._callbacks: List[Callable[[], None]] = []
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+
+        self.embedded = 0
+        self.written = 0
+        self.skipped = 0
+        self._started = time.perf_counter()
+        self._last_log = self._started
+
+        self._thread = threading.Thread(target=self._write_loop, name="chroma-writer", daemon=True)
+        self._thread.start()
+
+    # -----------------------------
+    # 임베딩 단계 (호출 스레드)
+    # -----------------------------
+    def add(self, node: BaseNode) -> None:
+        self._batch.append(node)
+        if len(self._batch) >= self.batch_size:
+            self._flush_batch()
+
+    def commit(self, callback: Callable[[], None]) -> None:
+        """지금까지 add한 청크가 모두 적재된 뒤 callback 실행"""
+        if self._batch:
+            self._callbacks.append(callback)
+        else:
+            self._put(([], [], [callback]))
+
+    def _flush_batch(self) -> None:
+        nodes, callbacks = self._batch, self._callbacks
+        self._batch, self._callbacks = [], []
+
+        # 이전 실행에서 이미 적재된 청크는 건너뜀
+        existing = set(self.collection.get(ids=[n.node_id for n in nodes], include=[])["ids"])
+        todo = [n for n in nodes if n.node_id not in existing]
+        self.skipped += len(nodes) - len(todo)
+
+        embeddings = []
+        if todo:
+            texts = [n.get_content(metadata_mode=MetadataMode.EMBED) for n in todo]
+            embeddings = self.embed_model.get_text_embedding_batch(texts)
+            self.embedded += len(todo)
+        self._put((todo, embeddings, callbacks))
+
+    def _put(self, item) -> None:
+        """큐가 가득 차면 쓰기 스레드가 따라올 때까지 대기"""
+        while True:
+            self._raise_if_failed()
+            try:
+                self._queue.put(item, timeout=1.0)
+                return
+            except queue.Full:
+                continue
+
+    def _raise_if_failed(self) -> None:
+        if self._error is not None:
+            raise RuntimeError(f"Chroma 적재 실패: {self._error}") from self._error
+
+    # -----------------------------
+    # 쓰기 단계 (쓰기 스레드)
+    # -----------------------------
+    def _write_loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            if self._error is not None:
+                continue  # 실패 후에는 남은 항목을 버리고 종료만 기다림
+            try:
+                nodes, embeddings, callbacks = item
+                if nodes:
+                    self._upsert(nodes, embeddings)
+                for callback in callbacks:
+                    callback()
+            except Exception as e:
+                self._error = e
+
+    def _upsert(self, nodes: List[BaseNode], embeddings: List[List[float]]) -> None:
+        """ChromaVectorStore.add와 같은 형식으로 upsert (재실행해도 중복 없음)"""
+        metadatas = []
+        for node in nodes:
+            metadata = node_to_metadata_dict(node, remove_text=True, flat_metadata=True)
+            metadatas.append({k: ("" if v is None else v) for k, v in metadata.items()})
+        self.collection.upsert(
+            ids=[n.node_id for n in nodes],
+            embeddings=embeddings,
+            metadatas=metadatas,
+            documents=[n.get_content(metadata_mode=MetadataMode.NONE) for n in nodes],
+        )
+        self.written += len(nodes)
+
+        now = time.perf_counter()
+        if now - self._last_log >= self.log_every:
+            self._last_log = now
+            self.log(f"  ... {self.progress()}")
+
+    # -----------------------------
+    # 진행 상황 / 종료
+    # -----------------------------
+    def progress(self) -> str:
+        elapsed = max(time.perf_counter() - self._started, 1e-9)
+        return (f"embedded {self.embedded}, written {self.written}, skipped {self.skipped} "
+                f"({self.written / elapsed:.1f} chunks/s, queue {self._queue.qsize()}/{self._queue.maxsize})")
+
+    def close(self) -> None:
+        """남은 배치를 적재하고 쓰기 스레드 종료 (실패가 있었으면 예외)"""
+        try:
+            if self._batch or self._callbacks:
+                self._flush_batch()
+        finally:
+            self._queue.put(_STOP)
+            self._thread.join()
+        self._raise_if_failed()
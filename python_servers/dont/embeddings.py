@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+임베딩 모델 공용 설정 (ingest.py / query.py / eval_geval.py / settings.py가 같은 모델을 쓰도록)
+- 장치 자동 선택: CUDA가 있으면 GPU, 없으면 CPU (torch 스레드 수 조정)
+- CPU 처리량용 ONNX 백엔드 (한 번 내보낸 모델 재사용, onnx-int8이면 동적 양자화)
+- Chroma 컬렉션 메타데이터에 임베딩 모델 id·차원을 기록하고, 다른 모델로는 조회하지 않음
+"""
+
+import os
+import platform
+from pathlib import Path
+from typing import Optional, Tuple
+
+EMBED_MODEL_NAME = os.getenv("EMBED_MODEL", "intfloat/multilingual-e5-large")
+# auto | cuda | cuda:0 | cpu
+EMBED_DEVICE = os.getenv("EMBED_DEVICE", "auto")
+# torch | onnx | onnx-int8 (onnx 계열은 CPU 전용, onnxruntime·optimum 필요)
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+# CPU 연산 스레드 수 (0이면 CPU 코어 수)
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "0"))
+# ONNX(int8) 모델을 내보내 둘 위치
+EMBED_ONNX_DIR = Path(os.getenv("EMBED_ONNX_DIR", "storage/onnx"))
+
+# 컬렉션 메타데이터 키 (counseling-finetuned-midm/rag_retriever.py와 동일해야 함)
+EMBED_MODEL_KEY = "embed_model"
+EMBED_DIM_KEY = "embed_dim"
+
+
+class EmbeddingMismatch(ValueError):
+    """컬렉션을 적재한 임베딩 모델과 질의 임베딩 모델이 다름"""
+
+
+# -----------------------------
+# 장치 / 백엔드
+# -----------------------------
+def select_device(device: str = EMBED_DEVICE, threads: int = EMBED_THREADS) -> str:
+    """auto면 CUDA 우선, CPU일 때는 torch 스레드 수를 맞춤"""
+    import torch
+
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    if device == "cpu":
+        torch.set_num_threads(threads or os.cpu_count() or 1)
+    return device
+
+
+def quantization_target() -> str:
+    """현재 CPU에 맞는 동적 양자화 설정 이름"""
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "arm64"
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            flags = f.read()
+    except OSError:
+        return "avx2"
+    if "avx512_vnni" in flags:
+        return "avx512_vnni"
+    if "avx512f" in flags:
+        return "avx512"
+    return "avx2"
+
+
+def export_onnx(model_name: str, quantize: bool) -> Tuple[str, str]:
+    """ONNX 내보내기(+ int8 동적 양자화)를 한 번만 수행하고 (모델 폴더, onnx 파일 경로) 반환"""
+    target = quantization_target()
+    model_dir = EMBED_ONNX_DIR / model_name.replace("/", "__")
+    file_name = f"onnx/model_qint8_{target}.onnx" if quantize else "onnx/model.onnx"
+    if not (model_dir / file_name).exists():
+        from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+        print(f"[임베딩] {model_name} → {file_name} 내보내는 중 ({model_dir})", flush=True)
+        model = SentenceTransformer(model_name, backend="onnx", device="cpu")
+        model.save(str(model_dir))
+        if quantize:
+            export_dynamic_quantized_onnx_model(model, target, str(model_dir))
+    return str(model_dir), file_name
+
+
+def onnx_session_options(threads: int = EMBED_THREADS):
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads or os.cpu_count() or 1
+    return options
+
+
+# -----------------------------
+# 팩토리
+# -----------------------------
+def create_embed_model(model_name: str = EMBED_MODEL_NAME, batch_size: int = EMBED_BATCH_SIZE,
+                       device: str = EMBED_DEVICE, backend: str = EMBED_BACKEND):
+    """설정에 맞는 HuggingFaceEmbedding 생성"""
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+    from llama_index.embeddings.huggingface.utils import (
+        get_query_instruct_for_model_name,
+        get_text_instruct_for_model_name,
+    )
+
+    device = select_device(device)
+    if backend != "torch" and device != "cpu":
+        print(f"[임베딩] {backend} 백엔드는 CPU 전용입니다. {device}에서는 torch로 실행합니다.", flush=True)
+        backend = "torch"
+
+    kwargs = {}
+    load_name = model_name
+    if backend in ("onnx", "onnx-int8"):
+        load_name, file_name = export_onnx(model_name, quantize=backend == "onnx-int8")
+        model_kwargs = {"file_name": file_name, "provider": "CPUExecutionProvider",
+                        "session_options": onnx_session_options()}
+        kwargs = {"backend": "onnx", "model_kwargs": model_kwargs}
+    elif backend != "torch":
+        raise ValueError(f"알 수 없는 임베딩 백엔드: {backend} (사용 가능: torch, onnx, onnx-int8)")
+
+    embed_model = HuggingFaceEmbedding(
+        model_name=load_name,
+        device=device,
+        embed_batch_size=batch_size,
+        # 내보낸 폴더 경로가 아니라 원래 모델 이름 기준의 질의/문서 지시문
+        query_instruction=get_query_instruct_for_model_name(model_name) or None,
+        text_instruction=get_text_instruct_for_model_name(model_name) or None,
+        **kwargs
+    )
+    embed_model.model_name = model_name
+    print(f"[임베딩] {model_name} (device={device}, backend={backend})", flush=True)
+    return embed_model
+
+
+def embedding_dimension(embed_model) -> int:
+    return len(embed_model.get_text_embedding("dimension"))
+
+
+# -----------------------------
+# 컬렉션 메타데이터
+# -----------------------------
+def recorded_embedding(collection) -> Tuple[Optional[str], Optional[int]]:
+    """컬렉션에 기록된 (임베딩 모델, 차원), 기록이 없으면 (None, None)"""
+    metadata = collection.metadata or {}
+    return metadata.get(EMBED_MODEL_KEY), metadata.get(EMBED_DIM_KEY)
+
+
+def record_collection_embedding(collection, model_name: str, dim: int) -> None:
+    """적재에 쓴 임베딩 모델 id·차원을 컬렉션 메타데이터에 기록"""
+    if recorded_embedding(collection) == (model_name, dim):
+        return
+    # hnsw 설정은 생성 후 바꿀 수 없으므로 그대로 두고 나머지만 갱신
+    metadata = {k: v for k, v in (collection.metadata or {}).items() if not k.startswith("hnsw:")}
+    metadata.update({EMBED_MODEL_KEY: model_name, EMBED_DIM_KEY: dim})
+    collection.modify(metadata=metadata)
+
+
+def check_collection_embedding(collection, model_name: str, dim: Optional[int] = None) -> None:
+    """컬렉션을 적재한 모델과 다르면 EmbeddingMismatch (기록이 없는 이전 컬렉션은 경고만)"""
+    recorded_model, recorded_dim = recorded_embedding(collection)
+    if recorded_model is None:
+        if collection.count() > 0:
+            print(f"[경고] '{collection.name}' 컬렉션에 임베딩 모델 기록이 없습니다. "
+                  f"ingest.py로 다시 적재하면 기록됩니다.", flush=True)
+        return
+    if recorded_model != model_name:
+        raise EmbeddingMismatch(f"'{collection.name}' 컬렉션은 {recorded_model}로 적재되었습니다 "
+                                f"(질의 모델: {model_name}). EMBED_MODEL을 맞추거나 다시 적재하세요.")
+    if dim is not None and recorded_dim is not None and recorded_dim != dim:
+        raise EmbeddingMismatch(f"'{collection.name}' 컬렉션 임베딩 차원 {recorded_dim} ≠ 질의 모델 차원 {dim}")
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+평가 캐시 / 체크포인트 (eval_geval.py용)
+- SUT 답변: (모델, 프롬프트, top_k, 검색 설정, 질문) 키로 저장 → 심판만 바꿔 다시 돌리면 SUT 호출 0회
+- 심판 결과: (심판 모델, 심판 프롬프트 해시) 키로 저장
+- 결과 파일: 예제가 끝날 때마다 한 줄씩 추가, --resume이면 이미 끝난 id는 건너뜀
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+
+def cache_key(*parts: Any) -> str:
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class EvalCache:
+    """SQLite(WAL) 키-값 캐시 (테이블: answers, judgments)"""
+
+    TABLES = ("answers", "judgments")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = {table: 0 for table in self.TABLES}
+        self.misses = {table: 0 for table in self.TABLES}
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        conn = self._conn()
+        for table in self.TABLES:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                         f"(key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL) WITHOUT ROWID")
+
+    def _conn(self):
+        """스레드별 연결"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, table: str, key: str) -> Optional[Any]:
+        row = self._conn().execute(f"SELECT value FROM {table} WHERE key = ?", (key,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, table: str, key: str, value: Any) -> None:
+        self._conn().execute(f"INSERT OR REPLACE INTO {table} (key, value, created_at) VALUES (?, ?, ?)",
+                             (key, json.dumps(value, ensure_ascii=False), time.time()))
+
+    def get_or_create(self, table: str, key: str, create: Callable[[], Any]) -> Any:
+        """캐시에 있으면 반환, 없으면 create() 결과를 저장 후 반환 (예외는 저장하지 않고 그대로 전달)"""
+        value = self.get(table, key)
+        with self._lock:
+            if value is None:
+                self.misses[table] += 1
+            else:
+                self.hits[table] += 1
+        if value is None:
+            value = create()
+            self.put(table, key, value)
+        return value
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {table: {"hits": self.hits[table], "misses": self.misses[table]} for table in self.TABLES}
+
+
+class NoCache:
+    """캐시를 끈 경우 (항상 새로 계산)"""
+
+    def get_or_create(self, table: str, key: str, create: Callable[[], Any]) -> Any:
+        return create()
+
+    def stats(self) -> None:
+        return None
+
+
+def open_cache(path: str):
+    return EvalCache(path) if path else NoCache()
+
+
+# -----------------------------
+# 결과 파일 (예제 단위 체크포인트)
+# -----------------------------
+def example_id(ex: Dict[str, Any], index: int) -> str:
+    return str(ex.get("id") if ex.get("id") is not None else f"#{index}")
+
+
+def load_finished(path: Path) -> Dict[str, Dict[str, Any]]:
+    """결과 파일에서 오류 없이 끝난 예제 (id → 결과). 마지막 줄이 잘렸으면 무시"""
+    finished = {}
+    if not path.exists():
+        return finished
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "error" not in result:
+                finished[str(result["id"])] = result
+    return finished
+
+
+class ResultWriter:
+    """끝난 예제를 바로 한 줄씩 추가 (여러 스레드에서 호출)"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        # 중간에 끊겨 마지막 줄이 잘렸다면 새 줄부터 이어 쓰기
+        if path.exists() and path.stat().st_size:
+            with open(path, "rb+") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+
+    def append(self, result: Dict[str, Any]) -> None:
+        line = json.dumps(result, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def rewrite(self, results: List[Dict[str, Any]]) -> None:
+        """마지막에 데이터셋 순서로 정리해 다시 쓰기"""
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(r, ensure_ascii=False) + "\n" for r in results)
+        os.replace(tmp, self.path)
@@ -3,8 +3,8 @@
 """
 G-Eval runner for RAG with LlamaIndex 0.13.x
 
-- Retrieval: Chroma (pre-built at storage/chroma, collection "midm_docs")
-- Embedding: HuggingFace (intfloat/multilingual-e5-large)  [ingest와 동일하게 설정 必]
+- Retrieval: Chroma (pre-built at storage/chroma, collection "midm_docs") + BM25 (storage/bm25), RRF 융합
+- Embedding: embeddings.py 공용 설정 (EMBED_MODEL, 기본 intfloat/multilingual-e5-large)  [ingest와 동일]
 - SUT (system under test): Ollama model (default: midm:latest)
 - Baseline (pairwise only): Ollama model (default: gemma:2b)
 - Judge: GPT(OpenAI) or Ollama (env로 선택)
@@ -20,19 +20,29 @@ Env vars you may set:
     USE_OPENAI_JUDGE=1
     OPENAI_API_KEY=sk-...
     OPENAI_JUDGE_MODEL=gpt-4o-mini  (or gpt-4o)
+    OPENAI_BASE_URL        (optional; OpenAI 호환 서버/테스트용 스텁)
+
+    EVAL_SUT_CONCURRENCY / EVAL_BASELINE_CONCURRENCY / EVAL_JUDGE_CONCURRENCY  (default: 4)
+    EVAL_RETRIES (default: 3), EVAL_BACKOFF (default: 1.0초, 지터 포함 지수 백오프)
+    EVAL_CACHE_PATH (default: cache/eval_cache.db; 답변/심판 캐시, --cache ''로 끄기)
+
+검색만 따로 (LLM 없이 recall@k / MRR / 지연 시간) 측정하려면 eval_retrieval.py를 사용하세요.
 """
 
 import os
 import re
 import json
 import argparse
+import hashlib
 import random
 import statistics
+import time
 from pathlib import Path
 from typing import List, Dict, Any
 
 # ---------- LlamaIndex core / vector store ----------
 from llama_index.core import VectorStoreIndex, StorageContext, Settings
+from llama_index.core.query_engine import RetrieverQueryEngine
 from llama_index.vector_stores.chroma import ChromaVectorStore
 from chromadb import PersistentClient
 
@@ -45,7 +55,15 @@ if USE_OPENAI_JUDGE:
     from llama_index.llms.openai import OpenAI as LIOpenAI
 
 # ---------- Embedding (ingest와 동일하게) ----------
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from embeddings import EMBED_MODEL_NAME, check_collection_embedding, create_embed_model, embedding_dimension
+from hybrid import RETRIEVAL_MODE, build_retriever  # RETRIEVAL_MODE=hybrid(기본) | dense
+
+# ---------- 동시 실행 (백엔드별 클라이언트 재사용 + 동시 호출 상한 + 재시도) ----------
+from eval_runner import Backend, run_ordered
+
+# ---------- 캐시 / 체크포인트 (SUT 답변·심판 결과 재사용, --resume) ----------
+from eval_cache import NoCache, ResultWriter, cache_key, example_id, load_finished, open_cache
+from parsers import package_version
 
 # ---------- Defaults ----------
 DB_PATH = os.getenv("CHROMA_PATH", "storage/chroma")
@@ -57,27 +75,32 @@ OLLAMA_JUDGE_MODEL = os.getenv("OLLAMA_JUDGE_MODEL", "llama3.1:8b")
 
 OPENAI_JUDGE_MODEL = os.getenv("OPENAI_JUDGE_MODEL", "gpt-4o-mini")
 
+SUT_CONCURRENCY = int(os.getenv("EVAL_SUT_CONCURRENCY", "4"))
+BASELINE_CONCURRENCY = int(os.getenv("EVAL_BASELINE_CONCURRENCY", "4"))
+JUDGE_CONCURRENCY = int(os.getenv("EVAL_JUDGE_CONCURRENCY", "4"))
+EVAL_RETRIES = int(os.getenv("EVAL_RETRIES", "3"))
+EVAL_BACKOFF = float(os.getenv("EVAL_BACKOFF", "1.0"))
+EVAL_CACHE_PATH = os.getenv("EVAL_CACHE_PATH", "cache/eval_cache.db")
+SUT_RESPONSE_MODE = "compact"
+
 # (bge-m3를 쓸 때 쿼리에 'query: ' 접두어를 붙이고 싶다면 1로 설정)
 USE_BGE_QUERY_PREFIX = os.getenv("USE_BGE_QUERY_PREFIX", "0") == "1"
 
 
 # ---------- Embedding 설정 (HF) ----------
-# ingest.py에서 사용한 임베딩과 반드시 동일해야 함
-Settings.embed_model = HuggingFaceEmbedding(
-    model_name="intfloat/multilingual-e5-large",
-    device="cuda",            # GPU: CUDA_VISIBLE_DEVICES=…로 원하는 카드만 보이게
-    embed_batch_size=64
-)
+# ingest.py와 같은 팩토리 사용 (GPU: CUDA_VISIBLE_DEVICES=…로 원하는 카드만 보이게, 없으면 CPU)
+Settings.embed_model = create_embed_model()
 
 
 # ---------- Retriever / Index ----------
 def build_index():
     client = PersistentClient(path=DB_PATH)
     col = client.get_or_create_collection(COLLECTION)
+    check_collection_embedding(col, EMBED_MODEL_NAME, embedding_dimension(Settings.embed_model))
     vs = ChromaVectorStore(chroma_collection=col)
     sc = StorageContext.from_defaults(vector_store=vs)
     idx = VectorStoreIndex.from_vector_store(vs)
-    return idx, sc
+    return idx, sc, col
 
 
 def make_query_engine(llm_model: str, top_k: int = 4, base_url: str | None = None):
@@ -85,10 +108,17 @@ def make_query_engine(llm_model: str, top_k: int = 4, base_url: str | None = Non
     kwargs = {"model": llm_model, "request_timeout": 180.0}
     if base_url := (base_url or os.getenv("OLLAMA_HOST")):
         kwargs["base_url"] = base_url
-    Settings.llm = Ollama(**kwargs)
+    llm = Ollama(**kwargs)
 
-    index, _ = build_index()
-    return index.as_query_engine(similarity_top_k=top_k, response_mode="compact")
+    index, _, collection = build_index()
+    retriever = build_retriever(index, collection, top_k=top_k)
+    return RetrieverQueryEngine.from_args(retriever, llm=llm, response_mode=SUT_RESPONSE_MODE)
+
+
+def query_with_timings(qe, question: str):
+    """(응답, 검색 단계별 시간) — 같은 스레드에서 읽어야 하므로 함께 반환"""
+    resp = qe.query(question)
+    return resp, getattr(qe.retriever, "last_timings", None)
 
 
 # ---------- Judge helpers ----------
@@ -148,7 +178,9 @@ def make_judge():
         return LIOpenAI(
             model=OPENAI_JUDGE_MODEL,
             temperature=0.0,
-            api_key=os.getenv("OPENAI_API_KEY")
+            api_key=os.getenv("OPENAI_API_KEY"),
+            api_base=os.getenv("OPENAI_BASE_URL"),
+            max_retries=0  # 재시도는 eval_runner.Backend에서
         )
     # Ollama judge (로컬 무료, 정확도는 모델에 따라 다름)
     kwargs = {"model": OLLAMA_JUDGE_MODEL, "request_timeout": 180.0}
@@ -157,22 +189,19 @@ def make_judge():
     return Ollama(**kwargs)
 
 
-def judge_pointwise(question: str, answer: str) -> Dict[str, Any]:
-    prompt = POINTWISE_PROMPT.format(question=question, answer=answer)
-    judge = make_judge()
+def judge_pointwise(judge, prompt: str) -> Dict[str, Any]:
     out = judge.complete(prompt).text
     return extract_json(out)
 
 
-def judge_pairwise(question: str, ans_a: str, ans_b: str) -> Dict[str, Any]:
-    # 순서 편향 방지: A/B 랜덤 스왑
-    order = ["A", "B"]
-    random.shuffle(order)
+def pairwise_prompt(question: str, ans_a: str, ans_b: str, order: List[str]) -> str:
+    """순서 편향 방지: order[0]이 "B"면 두 응답을 바꿔서 제시"""
     mapping = {"A": ans_a if order[0] == "A" else ans_b,
                "B": ans_b if order[0] == "A" else ans_a}
+    return PAIRWISE_PROMPT.format(question=question, a=mapping["A"], b=mapping["B"])
+
 
-    prompt = PAIRWISE_PROMPT.format(question=question, a=mapping["A"], b=mapping["B"])
-    judge = make_judge()
+def judge_pairwise(judge, prompt: str, order: List[str]) -> Dict[str, Any]:
     out = judge.complete(prompt).text
     j = extract_json(out)
 
@@ -182,22 +211,28 @@ def judge_pairwise(question: str, ans_a: str, ans_b: str) -> Dict[str, Any]:
     return j
 
 
-# ---------- Runners ----------
-def _maybe_prefix_query(q: str) -> str:
-    return ("query: " + q) if USE_BGE_QUERY_PREFIX else q
+# ---------- Cache keys ----------
+def judge_model_name() -> str:
+    return f"openai:{OPENAI_JUDGE_MODEL}" if USE_OPENAI_JUDGE else f"ollama:{OLLAMA_JUDGE_MODEL}"
 
 
-def run_pointwise(dataset: List[Dict[str, Any]], top_k=4) -> Dict[str, Any]:
-    qe = make_query_engine(SUT_MODEL, top_k=top_k)
-    results = []
-    for ex in dataset:
-        q = _maybe_prefix_query(ex["question"])
-        resp = qe.query(q)
-        score = judge_pointwise(q, str(resp))
+def answer_key(model: str, top_k: int, question: str) -> str:
+    """SUT 답변 키: (모델, 답변 프롬프트, top_k, 검색 설정, 질문)"""
+    prompt = f"{SUT_RESPONSE_MODE}@llama-index-core=={package_version('llama-index-core')}"
+    retrieval = [RETRIEVAL_MODE, EMBED_MODEL_NAME, DB_PATH, COLLECTION]
+    return cache_key("answer", model, prompt, top_k, retrieval, question)
 
-        results.append({
-            "id": ex.get("id"),
-            "question": ex["question"],
+
+def judgment_key(prompt: str) -> str:
+    """심판 결과 키: (심판 모델, 심판 프롬프트 해시)"""
+    return cache_key("judgment", judge_model_name(), hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+
+
+def cached_answer(cache, backend: Backend, model: str, top_k: int, question: str) -> Dict[str, Any]:
+    """캐시에 없을 때만 SUT 질의 (답변, 출처, 검색 시간)"""
+    def ask():
+        resp, timings = backend.call(query_with_timings, question)
+        return {
             "answer": str(resp),
             "sources": [
                 {
@@ -207,38 +242,107 @@ def run_pointwise(dataset: List[Dict[str, Any]], top_k=4) -> Dict[str, Any]:
                 }
                 for sn in getattr(resp, "source_nodes", []) or []
             ],
-            "score": score
-        })
+            "retrieval_ms": timings,
+        }
+    return cache.get_or_create("answers", answer_key(model, top_k, question), ask)
+
 
+# ---------- Runners ----------
+def _maybe_prefix_query(q: str) -> str:
+    return ("query: " + q) if USE_BGE_QUERY_PREFIX else q
+
+
+def make_backend(name: str, factory, concurrency: int) -> Backend:
+    """클라이언트는 캐시에 없는 호출이 처음 생길 때 생성"""
+    return Backend(name, factory=factory, concurrency=concurrency, retries=EVAL_RETRIES, backoff=EVAL_BACKOFF)
+
+
+def run_examples(dataset: List[Dict[str, Any]], evaluate, workers: int, label: str,
+                 writer: ResultWriter | None, finished: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    끝나지 않은 예제만 동시에 평가하고, 예제가 끝날 때마다 결과 파일에 추가.
+    evaluate(index, ex)는 예제 하나의 결과 dict를 반환. 반환값은 데이터셋 순서의 전체 결과
+    """
+    todo = [(i, ex) for i, ex in enumerate(dataset) if example_id(ex, i) not in finished]
+    if finished:
+        print(f"[{label}] 이미 끝난 예제 {len(dataset) - len(todo)}개 건너뜀", flush=True)
+
+    def on_done(item, result):
+        i, ex = item
+        if "id" not in result:
+            result.update({"id": example_id(ex, i), "question": ex["question"]})
+        if writer is not None:
+            writer.append(result)
+
+    new = run_ordered(todo, lambda item: evaluate(*item), workers, label, on_done=on_done)
+    by_index = {i: result for (i, _), result in zip(todo, new)}
+    results = [by_index[i] if i in by_index else finished[example_id(ex, i)] for i, ex in enumerate(dataset)]
+    if writer is not None:
+        writer.rewrite(results)
+    return results
+
+
+def run_pointwise(dataset: List[Dict[str, Any]], top_k=4, cache=None, writer=None, finished=None) -> Dict[str, Any]:
+    cache = cache or NoCache()
+    sut = make_backend("sut", lambda: make_query_engine(SUT_MODEL, top_k=top_k), SUT_CONCURRENCY)
+    judge = make_backend("judge", make_judge, JUDGE_CONCURRENCY)
+
+    def evaluate(i, ex):
+        q = _maybe_prefix_query(ex["question"])
+        answer = cached_answer(cache, sut, SUT_MODEL, top_k, q)
+        prompt = POINTWISE_PROMPT.format(question=q, answer=answer["answer"])
+        score = cache.get_or_create("judgments", judgment_key(prompt), lambda: judge.call(judge_pointwise, prompt))
+        return {"id": example_id(ex, i), "question": ex["question"], **answer, "score": score}
+
+    start = time.perf_counter()
+    results = run_examples(dataset, evaluate, sut.concurrency + judge.concurrency, "pointwise", writer, finished or {})
+    elapsed = time.perf_counter() - start
+
+    scored = [r for r in results if "error" not in r]
     keys = ["accuracy", "faithfulness", "instruction_following", "fluency", "safety", "overall"]
-    avg = {k: round(statistics.mean([r["score"][k] for r in results]), 3) for k in keys}
+    avg = {k: round(statistics.mean([r["score"][k] for r in scored]), 3) if scored else None for k in keys}
+    avg.update({"failed": len(results) - len(scored), "elapsed_s": round(elapsed, 1),
+                "backends": {"sut": sut.stats(), "judge": judge.stats()}, "cache": cache.stats()})
     return {"summary": avg, "results": results}
 
 
-def run_pairwise(dataset: List[Dict[str, Any]], top_k=4) -> Dict[str, Any]:
-    qe_sut = make_query_engine(SUT_MODEL, top_k=top_k)
-    qe_base = make_query_engine(BASELINE_MODEL, top_k=top_k)
-    results = []
-    for ex in dataset:
-        q = _maybe_prefix_query(ex["question"])
-        ans_a = str(qe_sut.query(q))
-        ans_b = str(qe_base.query(q))
-        j = judge_pairwise(q, ans_a, ans_b)
+def run_pairwise(dataset: List[Dict[str, Any]], top_k=4, cache=None, writer=None, finished=None) -> Dict[str, Any]:
+    cache = cache or NoCache()
+    sut = make_backend("sut", lambda: make_query_engine(SUT_MODEL, top_k=top_k), SUT_CONCURRENCY)
+    base = make_backend("baseline", lambda: make_query_engine(BASELINE_MODEL, top_k=top_k), BASELINE_CONCURRENCY)
+    judge = make_backend("judge", make_judge, JUDGE_CONCURRENCY)
+    # A/B 스왑 순서는 전체 데이터셋 기준으로 미리 뽑아 둠 (처리 순서·재개 여부와 무관하게 같은 결과)
+    orders = [random.sample(["A", "B"], 2) for _ in dataset]
 
-        results.append({
-            "id": ex.get("id"),
+    def evaluate(i, ex):
+        q = _maybe_prefix_query(ex["question"])
+        ans_a = cached_answer(cache, sut, SUT_MODEL, top_k, q)["answer"]
+        ans_b = cached_answer(cache, base, BASELINE_MODEL, top_k, q)["answer"]
+        prompt = pairwise_prompt(q, ans_a, ans_b, orders[i])
+        j = cache.get_or_create("judgments", judgment_key(prompt), lambda: judge.call(judge_pairwise, prompt, orders[i]))
+        return {
+            "id": example_id(ex, i),
             "question": ex["question"],
             "sut": ans_a,
             "baseline": ans_b,
             "judge": j
-        })
+        }
+
+    start = time.perf_counter()
+    workers = sut.concurrency + base.concurrency + judge.concurrency
+    results = run_examples(dataset, evaluate, workers, "pairwise", writer, finished or {})
+    elapsed = time.perf_counter() - start
 
-    wins = sum(1 for r in results if r["judge"]["winner"] == "A")    # SUT 승
-    losses = sum(1 for r in results if r["judge"]["winner"] == "B")  # SUT 패
-    ties = sum(1 for r in results if r["judge"]["winner"] == "tie")
+    judged = [r for r in results if "error" not in r]
+    wins = sum(1 for r in judged if r["judge"]["winner"] == "A")    # SUT 승
+    losses = sum(1 for r in judged if r["judge"]["winner"] == "B")  # SUT 패
+    ties = sum(1 for r in judged if r["judge"]["winner"] == "tie")
     denom = max(1, wins + losses)
     winrate = round(wins / denom, 3)
-    return {"summary": {"wins": wins, "losses": losses, "ties": ties, "winrate": winrate},
+    return {"summary": {"wins": wins, "losses": losses, "ties": ties, "winrate": winrate,
+                        "failed": len(results) - len(judged), "elapsed_s": round(elapsed, 1),
+                        "backends": {"sut": sut.stats(), "baseline": base.stats(), "judge": judge.stats()},
+                        "cache": cache.stats()},
             "results": results}
 
 
@@ -250,6 +354,8 @@ def main():
     ap.add_argument("--top_k", type=int, default=4)
     ap.add_argument("--limit", type=int, default=0, help="0 = use all")
     ap.add_argument("--outdir", type=str, default="results")
+    ap.add_argument("--resume", action="store_true", help="결과 파일에서 이미 끝난 id는 건너뜀")
+    ap.add_argument("--cache", type=str, default=EVAL_CACHE_PATH, help="답변/심판 캐시 경로 ('' = 사용 안 함)")
     args = ap.parse_args()
 
     ds_path = Path(args.dataset)
@@ -261,19 +367,17 @@ def main():
         dataset = dataset[:args.limit]
 
     Path(args.outdir).mkdir(exist_ok=True)
+    out_path = Path(f"{args.outdir}/geval_{args.mode}.jsonl")
+    finished = load_finished(out_path) if args.resume else {}
+    if not args.resume and out_path.exists():
+        out_path.unlink()
+    writer = ResultWriter(out_path)
+    cache = open_cache(args.cache)
 
     if args.mode == "pointwise":
-        out = run_pointwise(dataset, top_k=args.top_k)
-        Path(f"{args.outdir}/geval_pointwise.jsonl").write_text(
-            "\n".join(json.dumps(r, ensure_ascii=False) for r in out["results"]),
-            encoding="utf-8"
-        )
+        out = run_pointwise(dataset, top_k=args.top_k, cache=cache, writer=writer, finished=finished)
     else:
-        out = run_pairwise(dataset, top_k=args.top_k)
-        Path(f"{args.outdir}/geval_pairwise.jsonl").write_text(
-            "\n".join(json.dumps(r, ensure_ascii=False) for r in out["results"]),
-            encoding="utf-8"
-        )
+        out = run_pairwise(dataset, top_k=args.top_k, cache=cache, writer=writer, finished=finished)
 
     print("\n=== G-Eval Summary ===")
     print(json.dumps(out["summary"], ensure_ascii=False, indent=2))
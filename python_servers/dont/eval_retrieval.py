@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+검색 전용 벤치마크 (LLM 없이, CPU·오프라인)
+
+eval_dataset.jsonl의 질문으로 검색기만 실행해 설정 조합(임베딩 모델 × 백엔드 × 검색 방식 × 후보 수 × top_k)별로
+- 지연 시간 p50/p95/p99 (ms), 처리량 (질의/초), 단계별 평균 시간 (하이브리드일 때)
+- recall@k / hit@k / MRR: 데이터셋의 정답 출처 "gold": [{"source": 파일명, "page": 페이지}] 기준
+  (page를 생략하면 해당 문서의 아무 페이지나 정답, gold가 비어 있는 질문은 품질 지표에서 제외)
+을 results/retrieval_bench.json으로 저장합니다.
+
+예)
+    EMBED_BACKEND=onnx-int8 python eval_retrieval.py --top_k 1 3 5 10 --modes dense hybrid --candidates 10 20
+    # 모델마다 따로 적재한 Chroma 경로를 같은 순서로
+    python eval_retrieval.py --embed_models intfloat/multilingual-e5-large BAAI/bge-m3 \\
+        --db_paths storage/chroma storage/chroma_bge
+"""
+
+import argparse
+import json
+import os
+import time
+from itertools import product
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from chromadb import PersistentClient
+from llama_index.core import VectorStoreIndex
+from llama_index.vector_stores.chroma import ChromaVectorStore
+
+from embeddings import (EMBED_BACKEND, EMBED_MODEL_NAME, check_collection_embedding, create_embed_model,
+                        embedding_dimension)
+from eval_cache import example_id
+from hybrid import HYBRID_CANDIDATES, RETRIEVAL_MODE, HybridRetriever, build_retriever
+
+DB_PATH = os.getenv("CHROMA_PATH", "storage/chroma")
+COLLECTION = os.getenv("CHROMA_COLLECTION", "midm_docs")
+PERCENTILES = (50, 95, 99)
+
+
+# -----------------------------
+# 정답 매칭 / 지표
+# -----------------------------
+def gold_labels(ex: Dict[str, Any]) -> List[Tuple[str, Optional[str]]]:
+    return [(g["source"], None if g.get("page") is None else str(g["page"])) for g in ex.get("gold") or []]
+
+
+def matches(hit: Tuple[str, str], gold: Tuple[str, Optional[str]]) -> bool:
+    return hit[0] == gold[0] and (gold[1] is None or hit[1] == gold[1])
+
+
+def score_ranking(hits: List[Tuple[str, str]], gold: List[Tuple[str, Optional[str]]]) -> Dict[str, Any]:
+    """검색 결과 (source, page) 순위 목록 하나의 recall / hit / 역순위"""
+    found = [g for g in gold if any(matches(h, g) for h in hits)]
+    first = next((rank for rank, h in enumerate(hits, 1) if any(matches(h, g) for g in gold)), None)
+    return {"recall": len(found) / len(gold), "hit": int(bool(found)), "rr": 1.0 / first if first else 0.0}
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    out = {f"p{p}": round(float(np.percentile(values, p)), 2) for p in PERCENTILES}
+    out["mean"] = round(float(np.mean(values)), 2)
+    return out
+
+
+# -----------------------------
+# 실행
+# -----------------------------
+def load_index(db_path: str, embed_model) -> Tuple[VectorStoreIndex, Any]:
+    client = PersistentClient(path=db_path)
+    col = client.get_collection(COLLECTION)
+    check_collection_embedding(col, embed_model.model_name, embedding_dimension(embed_model))
+    index = VectorStoreIndex.from_vector_store(ChromaVectorStore(chroma_collection=col), embed_model=embed_model)
+    return index, col
+
+
+def run_config(retriever, dataset: List[Dict[str, Any]], repeat: int) -> Dict[str, Any]:
+    """데이터셋 전체를 repeat번 순서대로 질의 (첫 질의는 워밍업으로 측정에서 제외)"""
+    retriever.retrieve(dataset[0]["question"])
+
+    latencies, stages, per_query = [], {}, []
+    start_all = time.perf_counter()
+    for _ in range(repeat):
+        for i, ex in enumerate(dataset):
+            start = time.perf_counter()
+            nodes = retriever.retrieve(ex["question"])
+            latencies.append((time.perf_counter() - start) * 1000)
+            for stage, ms in (getattr(retriever, "last_timings", None) or {}).items():
+                stages.setdefault(stage, []).append(ms)
+            if len(per_query) < len(dataset):
+                hits = [(n.node.metadata.get("source"), str(n.node.metadata.get("page"))) for n in nodes]
+                per_query.append({"id": example_id(ex, i), "hits": hits})
+    elapsed = time.perf_counter() - start_all
+
+    scored = []
+    for ex, row in zip(dataset, per_query):
+        gold = gold_labels(ex)
+        if gold:
+            row.update(score_ranking(row["hits"], gold))
+            scored.append(row)
+
+    out = {
+        "queries": len(latencies),
+        "latency_ms": percentiles(latencies),
+        "qps": round(len(latencies) / elapsed, 2),
+        "stage_ms": {stage: round(float(np.mean(v)), 2) for stage, v in stages.items()},
+        "labeled": len(scored),
+    }
+    if scored:
+        out.update({"recall": round(float(np.mean([r["recall"] for r in scored])), 4),
+                    "hit_rate": round(float(np.mean([r["hit"] for r in scored])), 4),
+                    "mrr": round(float(np.mean([r["rr"] for r in scored])), 4)})
+    out["per_query"] = per_query
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="검색 전용 벤치마크 (recall@k / MRR / 지연 시간)")
+    ap.add_argument("--dataset", type=str, default="eval_dataset.jsonl", help="JSONL with {'id','question','gold'}")
+    ap.add_argument("--top_k", type=int, nargs="+", default=[1, 3, 5, 10])
+    ap.add_argument("--modes", nargs="+", choices=["dense", "hybrid"], default=[RETRIEVAL_MODE])
+    ap.add_argument("--candidates", type=int, nargs="+", default=[HYBRID_CANDIDATES], help="하이브리드 융합 전 후보 수")
+    ap.add_argument("--embed_models", nargs="+", default=[EMBED_MODEL_NAME])
+    ap.add_argument("--db_paths", nargs="+", default=[DB_PATH], help="--embed_models와 같은 순서의 Chroma 경로")
+    ap.add_argument("--backends", nargs="+", default=[EMBED_BACKEND], help="torch | onnx | onnx-int8")
+    ap.add_argument("--repeat", type=int, default=3, help="지연 시간 측정용 반복 횟수")
+    ap.add_argument("--limit", type=int, default=0, help="0 = use all")
+    ap.add_argument("--outdir", type=str, default="results")
+    args = ap.parse_args()
+
+    if len(args.db_paths) != len(args.embed_models):
+        raise SystemExit("--db_paths는 --embed_models와 개수가 같아야 합니다.")
+    ds_path = Path(args.dataset)
+    if not ds_path.exists():
+        raise SystemExit(f"Dataset not found: {ds_path}")
+    dataset = [json.loads(l) for l in ds_path.read_text(encoding="utf-8").splitlines() if l.strip()]
+    if args.limit and args.limit < len(dataset):
+        dataset = dataset[:args.limit]
+
+    runs = []
+    for (model_name, db_path), backend in product(zip(args.embed_models, args.db_paths), args.backends):
+        embed_model = create_embed_model(model_name, device="cpu", backend=backend)
+        index, collection = load_index(db_path, embed_model)
+        bm25_dir = Path(db_path).parent / "bm25"
+        for mode, candidates, top_k in product(args.modes, args.candidates, args.top_k):
+            if mode == "dense" and candidates != args.candidates[0]:
+                continue  # 후보 수는 하이브리드에만 의미가 있음
+            retriever = build_retriever(index, collection, top_k=top_k, mode=mode,
+                                        bm25_dir=bm25_dir, candidates=candidates)
+            hybrid = isinstance(retriever, HybridRetriever)  # BM25 색인이 없으면 벡터 검색으로 대체됨
+            config = {"embed_model": model_name, "backend": backend, "db_path": db_path,
+                      "mode": "hybrid" if hybrid else "dense", "candidates": candidates if hybrid else None,
+                      "top_k": top_k}
+            result = run_config(retriever, dataset, args.repeat)
+            runs.append({"config": config, **result})
+            print(f"[retrieval] {config['mode']:6} {backend:9} cand={config['candidates']} k={top_k:<3} "
+                  f"p50={result['latency_ms']['p50']}ms p95={result['latency_ms']['p95']}ms "
+                  f"qps={result['qps']} recall={result.get('recall')} mrr={result.get('mrr')}", flush=True)
+
+    Path(args.outdir).mkdir(exist_ok=True)
+    out_path = Path(args.outdir) / "retrieval_bench.json"
+    out_path.write_text(json.dumps({"dataset": str(ds_path), "repeat": args.repeat, "runs": runs},
+                                   ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\n저장: {out_path}")
+
+
+if __name__ == "__main__":
+    main()
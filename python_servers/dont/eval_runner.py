@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+평가 동시 실행기 (eval_geval.py용)
+- 백엔드(SUT / 기준 모델 / 심판)마다 클라이언트 하나를 재사용하고 동시 호출 수를 따로 제한
+  (factory를 주면 첫 호출 때 생성 → 캐시로 모두 해결되면 클라이언트를 만들지 않음)
+- 실패한 호출은 지터를 준 지수 백오프로 재시도
+- 예제는 스레드 풀에서 동시에 처리하되 결과는 데이터셋 순서 그대로 반환
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+
+class Backend:
+    """백엔드 하나: 재사용 클라이언트 + 동시 호출 상한 + 재시도"""
+
+    def __init__(self, name: str, client: Any = None, concurrency: int = 4, retries: int = 3,
+                 backoff: float = 1.0, max_backoff: float = 30.0, factory: Optional[Callable[[], Any]] = None):
+        self.name = name
+        self._client = client
+        self._factory = factory
+        self.concurrency = max(1, concurrency)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retried = 0
+        self.failed = 0
+        self.seconds = 0.0
+
+    @property
+    def client(self) -> Any:
+        if self._client is None and self._factory is not None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """fn(client, *args, **kwargs)를 동시 호출 상한 안에서 실행 (실패 시 재시도 후 마지막 예외)"""
+        for attempt in range(self.retries + 1):
+            try:
+                with self._slots:
+                    start = time.perf_counter()
+                    result = fn(self.client, *args, **kwargs)
+                    elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.calls += 1
+                    self.seconds += elapsed
+                return result
+            except Exception as e:
+                if attempt == self.retries:
+                    with self._lock:
+                        self.failed += 1
+                    raise
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.5)
+                print(f"[{self.name}] 호출 실패 ({attempt + 1}/{self.retries + 1}): {e} → {delay:.1f}s 후 재시도",
+                      flush=True)
+                with self._lock:
+                    self.retried += 1
+                time.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "concurrency": self.concurrency,
+                "calls": self.calls,
+                "retried": self.retried,
+                "failed": self.failed,
+                "avg_s": round(self.seconds / self.calls, 3) if self.calls else None,
+            }
+
+
+def run_ordered(items: List[Any], worker: Callable[[Any], Dict[str, Any]], workers: int,
+                label: str = "eval", on_done: Optional[Callable[[Any, Dict[str, Any]], None]] = None
+                ) -> List[Dict[str, Any]]:
+    """
+    items를 동시에 처리하고 입력 순서대로 결과 반환 (실패한 예제는 {"error": ...}).
+    on_done(item, result)은 예제가 끝나는 즉시 (끝난 순서대로) 호출
+    """
+    done = 0
+    lock = threading.Lock()
+
+    def run(item):
+        nonlocal done
+        try:
+            result = worker(item)
+        except Exception as e:
+            result = {"error": f"{type(e).__name__}: {e}"}
+        if on_done is not None:
+            on_done(item, result)
+        with lock:
+            done += 1
+            print(f"[{label}] {done}/{len(items)}", flush=True)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=label) as executor:
+        return list(executor.map(run, items))
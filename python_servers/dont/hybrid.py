@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+하이브리드 검색기 (query.py / eval_geval.py 공용)
+벡터(Chroma) 후보와 BM25 후보를 각각 뽑아 reciprocal-rank fusion으로 합칩니다.
+단계별 소요 시간(ms)은 last_timings(호출한 스레드 기준)에 남기고 로그로 출력합니다.
+"""
+
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+
+from bm25 import RRF_K, BM25Index, rrf_fuse
+
+logger = logging.getLogger(__name__)
+
+BM25_DIR = Path(os.getenv("BM25_DIR", "storage/bm25"))
+# dense: 벡터만 | hybrid: 벡터 + BM25 (색인이 없으면 벡터만)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# 융합 전에 각 검색기에서 가져올 후보 수
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+
+
+class HybridRetriever(BaseRetriever):
+    """벡터 검색 + BM25 → RRF"""
+
+    def __init__(self, vector_retriever: BaseRetriever, bm25: BM25Index, collection,
+                 top_k: int = 4, candidates: int = HYBRID_CANDIDATES, rrf_k: int = RRF_K):
+        super().__init__()
+        self.vector_retriever = vector_retriever
+        self.bm25 = bm25
+        self.collection = collection
+        self.top_k = top_k
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self._local = threading.local()  # 평가 실행기가 여러 스레드에서 동시에 질의
+
+    @property
+    def last_timings(self) -> Dict[str, float]:
+        return getattr(self._local, "timings", {})
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        timings = {}
+        start = time.perf_counter()
+        dense = self.vector_retriever.retrieve(query_bundle)
+        timings["dense_ms"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        sparse = self.bm25.search(query_bundle.query_str, self.candidates)
+        timings["bm25_ms"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        nodes = {n.node.node_id: n.node for n in dense}
+        fused = rrf_fuse([list(nodes), [chunk_id for chunk_id, _ in sparse]], self.top_k, self.rrf_k)
+        timings["fusion_ms"] = (time.perf_counter() - start) * 1000
+
+        # BM25에서만 나온 청크는 Chroma에서 본문/메타데이터를 가져와 노드로 복원
+        start = time.perf_counter()
+        missing = [chunk_id for chunk_id, _ in fused if chunk_id not in nodes]
+        if missing:
+            found = self.collection.get(ids=missing, include=["documents", "metadatas"])
+            for chunk_id, text, metadata in zip(found["ids"], found["documents"], found["metadatas"]):
+                node = metadata_dict_to_node(metadata, text=text)
+                node.id_ = chunk_id
+                nodes[chunk_id] = node
+        timings["fetch_ms"] = (time.perf_counter() - start) * 1000
+
+        self._local.timings = {k: round(v, 2) for k, v in timings.items()}
+        logger.info(f"hybrid retrieval: dense {len(dense)}, bm25 {len(sparse)}, {self.last_timings}")
+        return [NodeWithScore(node=nodes[chunk_id], score=score) for chunk_id, score in fused if chunk_id in nodes]
+
+
+def build_retriever(index, collection, top_k: int = 4, mode: str = RETRIEVAL_MODE,
+                    bm25_dir: Path = BM25_DIR, candidates: int = HYBRID_CANDIDATES) -> BaseRetriever:
+    """RETRIEVAL_MODE에 맞는 검색기 (BM25 색인이 없으면 벡터 검색으로 대체)"""
+    if mode == "hybrid":
+        try:
+            bm25 = BM25Index(bm25_dir)
+        except (FileNotFoundError, ValueError) as e:
+            logger.warning(f"{e} → 벡터 검색만 사용합니다.")
+        else:
+            vector_retriever = index.as_retriever(similarity_top_k=max(top_k, candidates))
+            return HybridRetriever(vector_retriever, bm25, collection, top_k=top_k, candidates=candidates)
+    elif mode != "dense":
+        raise ValueError(f"알 수 없는 RETRIEVAL_MODE: {mode} (dense | hybrid)")
+    return index.as_retriever(similarity_top_k=top_k)
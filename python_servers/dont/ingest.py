@@ -1,28 +1,42 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import functools
+import hashlib
+import json
 import os
 from pathlib import Path
-from typing import List
-
-# ✅ LlamaParse SDK 직접 사용 (Reader 아님)
-from llama_parse import LlamaParse
+from typing import Dict, Iterator, List, Tuple
 
 # LlamaIndex (0.13.x)
-from llama_index.core import Document, VectorStoreIndex, StorageContext, Settings
+from llama_index.core import Document, Settings
 from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import TextNode
 
 # Chroma
 from chromadb import PersistentClient
-from llama_index.vector_stores.chroma import ChromaVectorStore
 
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from bm25 import build_bm25_index, current_fingerprint, index_fingerprint, iter_collection_documents
+from embed_writer import EmbeddingWriter
+from embeddings import (EMBED_MODEL_NAME, create_embed_model, embedding_dimension, record_collection_embedding,
+                        recorded_embedding)
+from parsers import backend_version, parse_files
+from utils import CONTEXT_KEY, RELEVANCE_KEY, counseling_metadata
 
 # 경로/파라미터
 # -----------------------------
 DATA_DIR = Path("data")
 DB_DIR = Path("storage/chroma")
 COLLECTION_NAME = "midm_docs"
+# 파일/청크 해시와 파서·임베딩 버전을 기록해 바뀐 부분만 다시 처리
+MANIFEST_PATH = Path("storage/ingest_manifest.json")
+# BM25 희소 색인 (하이브리드 검색용, 청크 구성이 바뀔 때만 다시 생성)
+BM25_DIR = Path(os.getenv("BM25_DIR", "storage/bm25"))
+
+# 파싱 백엔드: pypdf (로컬, 오프라인 기본값) | llamaparse (클라우드)
+PARSER_BACKEND = os.getenv("INGEST_PARSER", "pypdf")
+# 동시에 파싱할 파일 수 (0이면 CPU 코어 수)
+PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", "0"))
 
 # 청킹 파라미터
 CHUNK_SIZE = 1200
@@ -37,13 +51,34 @@ CHUNK_OVERLAP = 150
 # Settings.embed_model = OllamaEmbedding(model_name="nomic-embed-text")
 
 # node parser(청킹) 설정
-Settings.node_parser = SentenceSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+# (청크 id를 내용 해시로 다시 매기므로 임의 id를 가리키는 prev/next 관계는 만들지 않음)
+Settings.node_parser = SentenceSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+                                        include_prev_next_rel=False)
+
+# 임베딩 모델/장치/백엔드는 embeddings.py (EMBED_MODEL, EMBED_DEVICE, EMBED_BACKEND)
+EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "64"))  # 메모리 여유에 맞춰 조절
+# 임베딩 단계와 Chroma 쓰기 단계 사이 큐에 쌓아둘 최대 배치 수
+WRITE_QUEUE_SIZE = int(os.getenv("INGEST_WRITE_QUEUE_SIZE", "4"))
+
+
+_embed_model_ready = False
+
 
-Settings.embed_model = HuggingFaceEmbedding(
-    model_name="intfloat/multilingual-e5-large",
-    device="cuda",                 # 또는 "cuda:0"
-    embed_batch_size=64            # 메모리 여유에 맞춰 조절
-)
+def init_embed_model():
+    """임베딩 모델은 새로 임베딩할 청크가 있을 때만 로드 (변경 없는 재실행은 빠르게)"""
+    global _embed_model_ready
+    if _embed_model_ready:
+        return
+    _embed_model_ready = True
+    Settings.embed_model = create_embed_model(batch_size=EMBED_BATCH_SIZE)
+
+
+# 파싱 결과(청크)에 영향을 주는 설정: 바뀌면 모든 파일을 다시 파싱 (같은 내용의 청크는 재임베딩하지 않음)
+PARSER_VERSION = {
+    "parser": backend_version(PARSER_BACKEND),
+    "chunk_size": CHUNK_SIZE,
+    "chunk_overlap": CHUNK_OVERLAP,
+}
 # -----------------------------
 # 유틸
 # -----------------------------
@@ -60,85 +95,185 @@ def ensure_data_files() -> List[Path]:
     return files
 
 
-def normalize_docs(docs: List[Document], source_name: str) -> List[Document]:
-    """Document 리스트의 메타데이터에 source/page 보강."""
-    out = []
-    for i, d in enumerate(docs, 1):
-        text = d.text or ""
-        meta = dict(d.metadata or {})
-        # page/filename 보강 (이미 있으면 유지)
-        meta.setdefault("source", source_name)
-        meta.setdefault("page", meta.get("page", i))
-        out.append(Document(text=text, metadata=meta))
-    return out
+# -----------------------------
+# 1) 매니페스트 (파싱 단계는 parsers.py)
+# -----------------------------
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest() -> Dict:
+    if MANIFEST_PATH.exists():
+        with open(MANIFEST_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    return {"embed_model": None, "parser": None, "files": {}}
+
+
+def save_manifest(manifest: Dict) -> None:
+    """파일 하나 처리할 때마다 저장 (중간에 멈춰도 처리한 파일까지는 유지)"""
+    MANIFEST_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = MANIFEST_PATH.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, MANIFEST_PATH)
 
 
 # -----------------------------
-# 1) 파싱: LlamaParseReader (권장)
+# 2) 청킹: 결정적 청크 id
 # -----------------------------
-def parse_with_llamaparse(files: List[Path]) -> List[Document]:
+def iter_chunks(pages: Iterator[Dict], path: Path, rel_path: str) -> Iterator[Tuple[TextNode, str]]:
     """
-    LlamaParse SDK 직접 사용.
-    result_type="markdown" 권장 (표/레이아웃에 유리)
+    파싱된 페이지를 한 장씩 받아 청킹 + 상담 서버용 메타데이터 계산, (노드, 청크 해시)를 차례로 반환.
+    청크 id = (파일 경로, 청크 내용·메타데이터 해시, 같은 내용 반복 순번)의 해시라서
+    내용이 그대로인 청크는 다시 실행해도 같은 id가 됩니다.
     """
-    parser = LlamaParse(result_type="markdown")  # wait 파라미터 없음
-
-    all_docs: List[Document] = []
-    for f in files:
-        print(f"Started parsing: {f.name}", flush=True)
-        out = parser.load_data(str(f))  # 보통 'list'로 반환됨
-        if not out:
-            continue
-
-        # out의 원소 타입이 케이스별로 다를 수 있어 안전 처리
-        first = out[0]
-
-        def add_doc(text: str, page_no: int):
-            all_docs.append(
-                Document(text=text or "",
-                         metadata={"source": f.name, "page": page_no})
-            )
-
-        if hasattr(first, "pages"):
-            # 케이스 1: [Result] 객체 리스트, .pages 보유
-            for p in first.pages:
-                text = getattr(p, "md", None) or getattr(p, "text", "")
-                page_no = getattr(p, "page", None) or 1
-                add_doc(text, page_no)
-        elif hasattr(first, "text") and not hasattr(first, "metadata"):
-            # 케이스 2: [Page] 형태
-            for i, p in enumerate(out, 1):
-                text = getattr(p, "md", None) or getattr(p, "text", "")
-                page_no = getattr(p, "page", i)
-                add_doc(text, page_no)
-        else:
-            # 케이스 3: 이미 LlamaIndex Document 리스트
-            for i, d in enumerate(out, 1):
-                text = getattr(d, "text", "")
-                meta = dict(getattr(d, "metadata", {}) or {})
-                page_no = meta.get("page", i)
-                meta.setdefault("source", f.name)
-                meta.setdefault("page", page_no)
-                all_docs.append(Document(text=text, metadata=meta))
-
-    return all_docs
-
+    seen: Dict[str, int] = {}
+    for i, page in enumerate(pages):
+        metadata = {**page["metadata"], "source": path.name, "page": page["page"]}
+        doc = Document(id_=f"{rel_path}#{i}", text=page["text"], metadata=metadata)
+        for node in Settings.node_parser.get_nodes_from_documents([doc]):
+            node.metadata.update(counseling_metadata(node.get_content()))
+            # 필터용 메타데이터는 임베딩/LLM 입력에서 제외
+            node.excluded_embed_metadata_keys = [*node.excluded_embed_metadata_keys, RELEVANCE_KEY, CONTEXT_KEY]
+            node.excluded_llm_metadata_keys = [*node.excluded_llm_metadata_keys, RELEVANCE_KEY, CONTEXT_KEY]
+
+            payload = json.dumps([node.get_content(), node.metadata], ensure_ascii=False, sort_keys=True)
+            chunk_hash = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+            occurrence = seen.get(chunk_hash, 0)
+            seen[chunk_hash] = occurrence + 1
+            node.id_ = hashlib.sha256(f"{rel_path}\0{chunk_hash}\0{occurrence}".encode("utf-8")).hexdigest()[:32]
+            yield node, chunk_hash
 
 
 # -----------------------------
-# 2) 색인 적재: Chroma
+# 3) 색인 동기화: Chroma
 # -----------------------------
-def build_chroma_index(docs: List[Document]) -> None:
+def open_collection(reset: bool):
     DB_DIR.mkdir(parents=True, exist_ok=True)
     client = PersistentClient(path=str(DB_DIR))
-    collection = client.get_or_create_collection(COLLECTION_NAME)
-    vector_store = ChromaVectorStore(chroma_collection=collection)
-    storage_context = StorageContext.from_defaults(vector_store=vector_store)
-
-    log("Building index (this writes embeddings to Chroma)...")
-    # Settings.node_parser가 세팅돼 있으면 자동 청킹 후 임베딩 저장
-    _ = VectorStoreIndex.from_documents(docs, storage_context=storage_context)
-    log(f"Done. Index stored at: {DB_DIR}")
+    if reset:
+        try:
+            client.delete_collection(COLLECTION_NAME)
+        except Exception:
+            pass  # 컬렉션이 아직 없음
+    return client.get_or_create_collection(COLLECTION_NAME)
+
+
+def entry_parser(manifest: Dict, entry: Dict):
+    """파일을 파싱한 파서 설정 (파일별 기록이 없는 이전 매니페스트는 최상위 값)"""
+    return entry.get("parser", manifest["parser"])
+
+
+def commit_file(collection, manifest: Dict, rel_path: str, entry: Dict, stale_ids) -> None:
+    if stale_ids:
+        collection.delete(ids=list(stale_ids))
+    manifest["files"][rel_path] = entry
+    save_manifest(manifest)
+
+
+def sync_chroma_index(files: List[Path]) -> None:
+    """새 파일/바뀐 파일만 파싱, 새 청크만 임베딩, 사라진 청크는 삭제"""
+    manifest_found = MANIFEST_PATH.exists()
+    manifest = load_manifest()
+    collection = open_collection(reset=False)
+
+    # 임베딩 모델이 바뀌었거나, 매니페스트 없이 만든(임의 id) 컬렉션이면 처음부터 다시 적재
+    # (매니페스트가 있으면 완료된 파일이 없어도 중간에 멈춘 실행 - 이미 쓰인 배치를 그대로 이어서 사용)
+    legacy = not manifest_found and collection.count() > 0
+    recorded_model, _ = recorded_embedding(collection)
+    if manifest["embed_model"] != EMBED_MODEL_NAME or legacy or recorded_model not in (None, EMBED_MODEL_NAME):
+        if manifest["files"] or legacy:
+            log(f"[재색인] 임베딩 모델 변경 또는 이전 방식 컬렉션 → '{COLLECTION_NAME}' 컬렉션을 새로 만듭니다.")
+        collection = open_collection(reset=True)
+        manifest = {"embed_model": EMBED_MODEL_NAME, "parser": PARSER_VERSION, "files": {}}
+        save_manifest(manifest)
+
+    # 파서 버전은 파일마다 기록 (재파싱 중 멈추면 다음 실행에서 아직 다시 파싱하지 않은 파일만 이어서 처리)
+    outdated = sum(entry_parser(manifest, entry) != PARSER_VERSION for entry in manifest["files"].values())
+    if outdated:
+        log(f"[재파싱] 파서/청킹 설정이 바뀌어 {outdated}개 파일을 다시 파싱합니다 (같은 청크는 재임베딩하지 않음).")
+
+    current = {f.relative_to(DATA_DIR).as_posix(): f for f in files}
+    added = deleted = unchanged = 0
+
+    # 삭제된 파일의 청크 제거
+    for rel_path in sorted(set(manifest["files"]) - set(current)):
+        chunk_ids = list(manifest["files"].pop(rel_path)["chunks"])
+        if chunk_ids:
+            collection.delete(ids=chunk_ids)
+        deleted += len(chunk_ids)
+        log(f"Removed: {rel_path} ({len(chunk_ids)} chunks)")
+        save_manifest(manifest)
+
+    # 새 파일/바뀐 파일만 파싱 (동시 파싱, 끝나는 순서대로 청킹·임베딩)
+    to_parse = []
+    for rel_path, path in current.items():
+        digest = file_sha256(path)
+        entry = manifest["files"].get(rel_path)
+        if entry and entry["sha256"] == digest and entry_parser(manifest, entry) == PARSER_VERSION:
+            unchanged += 1
+        else:
+            to_parse.append((path, digest))
+
+    # 청크 → 배치 임베딩 → Chroma upsert (새 청크가 처음 나올 때 임베딩 모델과 쓰기 스레드 시작)
+    writer = None
+    for path, digest, pages in parse_files(to_parse, PARSER_BACKEND, PARSE_WORKERS):
+        rel_path = path.relative_to(DATA_DIR).as_posix()
+        entry = manifest["files"].get(rel_path)
+        old_ids = set(entry["chunks"]) if entry else set()
+        chunk_hashes: Dict[str, str] = {}
+        new = relevant = 0
+        for node, chunk_hash in iter_chunks(pages, path, rel_path):
+            chunk_hashes[node.node_id] = chunk_hash
+            relevant += node.metadata[RELEVANCE_KEY]
+            if node.node_id not in old_ids:
+                if writer is None:
+                    init_embed_model()
+                    record_collection_embedding(collection, EMBED_MODEL_NAME,
+                                                embedding_dimension(Settings.embed_model))
+                    writer = EmbeddingWriter(collection, Settings.embed_model, batch_size=EMBED_BATCH_SIZE,
+                                             queue_size=WRITE_QUEUE_SIZE, log=log)
+                writer.add(node)
+                new += 1
+        stale_ids = old_ids - set(chunk_hashes)
+
+        # 이 파일의 새 청크가 모두 적재된 뒤 오래된 청크 삭제 + 매니페스트 기록
+        commit = functools.partial(commit_file, collection, manifest, rel_path,
+                                   {"sha256": digest, "parser": PARSER_VERSION, "chunks": chunk_hashes}, stale_ids)
+        if writer is None:
+            commit()
+        else:
+            writer.commit(commit)
+        added += new
+        deleted += len(stale_ids)
+        log(f"Chunked: {rel_path} (chunks {len(chunk_hashes)}, 상담 관련 {relevant}, new {new}, removed {len(stale_ids)})")
+
+    if writer is not None:
+        writer.close()
+        log(f"Embedding: {writer.progress()}")
+    elif recorded_embedding(collection)[0] is None and collection.count() > 0:
+        # 모델 기록 전에 적재한 컬렉션: 매니페스트의 모델과 저장된 벡터 길이로 기록
+        sample = collection.get(limit=1, include=["embeddings"])["embeddings"]
+        record_collection_embedding(collection, EMBED_MODEL_NAME, len(sample[0]))
+    manifest["parser"] = PARSER_VERSION  # 모든 파일이 현재 파서로 기록된 뒤에만 갱신
+    save_manifest(manifest)
+    sync_bm25_index(collection, manifest)
+    log(f"Done. unchanged files {unchanged}, new chunks {added}, removed chunks {deleted}, "
+        f"collection size {collection.count()} (index: {DB_DIR})")
+
+
+def sync_bm25_index(collection, manifest: Dict) -> None:
+    """매니페스트의 청크 구성이 색인과 다르면 (중간에 멈췄던 실행 포함) BM25 색인 재생성"""
+    fingerprint = index_fingerprint(chunk_id for entry in manifest["files"].values() for chunk_id in entry["chunks"])
+    if current_fingerprint(BM25_DIR) == fingerprint:
+        return
+    meta = build_bm25_index(iter_collection_documents(collection), BM25_DIR, fingerprint)
+    log(f"BM25: docs {meta['n_docs']}, terms {meta['n_terms']}, postings {meta['n_postings']}, "
+        f"{meta['bytes'] / 1024:.0f} KiB, {meta['seconds']}s ({BM25_DIR})")
 
 
 # -----------------------------
@@ -146,20 +281,14 @@ def build_chroma_index(docs: List[Document]) -> None:
 # -----------------------------
 def main():
     files = ensure_data_files()
-    log(f"Parsing {len(files)} files...")
+    log(f"Checking {len(files)} files...")
 
     # LlamaParse 키가 없을 때 경고(파싱 품질에 영향)
-    if not os.getenv("LLAMA_CLOUD_API_KEY"):
+    if PARSER_BACKEND == "llamaparse" and not os.getenv("LLAMA_CLOUD_API_KEY"):
         log("[경고] LLAMA_CLOUD_API_KEY가 설정되지 않았습니다. "
             "복잡한 PDF(표/레이아웃) 파싱 품질이 떨어질 수 있어요.")
 
-    docs = parse_with_llamaparse(files)
-    log(f"Parsed pages (docs): {len(docs)}")
-
-    if not docs:
-        raise SystemExit("파싱 결과가 비어 있습니다. 파일/키/네트워크를 확인하세요.")
-
-    build_chroma_index(docs)
+    sync_chroma_index(files)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+문서 파싱 단계
+- 백엔드: pypdf (로컬 순수 파이썬, 오프라인 기본값) / llamaparse (클라우드, 표·레이아웃에 유리)
+- 파일 여러 개를 제한된 크기의 풀에서 동시에 파싱 (pypdf는 프로세스, llamaparse는 스레드)
+- 파싱 결과는 (파일 해시, 백엔드, 백엔드 버전) 기준으로 디스크에 캐시
+- 파일 하나가 끝날 때마다 페이지를 캐시 파일에서 한 장씩 읽어 청킹 단계로 넘김
+"""
+
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+PARSE_CACHE_DIR = Path("storage/parse_cache")
+
+
+def package_version(name: str) -> str:
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return "unknown"
+
+
+# -----------------------------
+# 백엔드: 파일 → 페이지 dict ({"page", "text", "metadata"}) 목록
+# -----------------------------
+def parse_pypdf(path: str) -> List[Dict]:
+    """pypdf 텍스트 추출 (네트워크 불필요)"""
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    return [{"page": i, "text": page.extract_text() or "", "metadata": {}}
+            for i, page in enumerate(reader.pages, 1)]
+
+
+def parse_llamaparse(path: str) -> List[Dict]:
+    """
+    LlamaParse SDK 직접 사용.
+    result_type="markdown" 권장 (표/레이아웃에 유리)
+    """
+    from llama_parse import LlamaParse
+
+    parser = LlamaParse(result_type="markdown")  # wait 파라미터 없음
+    out = parser.load_data(path)  # 보통 'list'로 반환됨
+    if not out:
+        return []
+
+    # out의 원소 타입이 케이스별로 다를 수 있어 안전 처리
+    first = out[0]
+    pages = []
+    if hasattr(first, "pages"):
+        # 케이스 1: [Result] 객체 리스트, .pages 보유
+        for p in first.pages:
+            text = getattr(p, "md", None) or getattr(p, "text", "")
+            pages.append({"page": getattr(p, "page", None) or 1, "text": text or "", "metadata": {}})
+    elif hasattr(first, "text") and not hasattr(first, "metadata"):
+        # 케이스 2: [Page] 형태
+        for i, p in enumerate(out, 1):
+            text = getattr(p, "md", None) or getattr(p, "text", "")
+            pages.append({"page": getattr(p, "page", i), "text": text or "", "metadata": {}})
+    else:
+        # 케이스 3: 이미 LlamaIndex Document 리스트
+        for i, d in enumerate(out, 1):
+            meta = dict(getattr(d, "metadata", {}) or {})
+            pages.append({"page": meta.pop("page", i), "text": getattr(d, "text", "") or "", "metadata": meta})
+    return pages
+
+
+# 이름 → (파싱 함수, 풀 종류, 버전 확인용 패키지)
+BACKENDS = {
+    "pypdf": (parse_pypdf, "process", "pypdf"),
+    "llamaparse": (parse_llamaparse, "thread", "llama-parse"),
+}
+
+
+def backend_version(backend: str) -> str:
+    if backend not in BACKENDS:
+        raise ValueError(f"알 수 없는 파서 백엔드: {backend} (사용 가능: {', '.join(BACKENDS)})")
+    return f"{backend}=={package_version(BACKENDS[backend][2])}"
+
+
+# -----------------------------
+# 파싱 캐시
+# -----------------------------
+def cache_path(digest: str, backend: str) -> Path:
+    return PARSE_CACHE_DIR / backend_version(backend) / digest[:2] / f"{digest}.jsonl"
+
+
+def _parse_to_cache(backend: str, path: str, target: str) -> int:
+    """워커: 파일 하나를 파싱해 페이지별 JSON 줄로 캐시에 기록 (페이지 수 반환)"""
+    pages = BACKENDS[backend][0](path)
+    target = Path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        for page in pages:
+            f.write(json.dumps(page, ensure_ascii=False) + "\n")
+    os.replace(tmp, target)
+    return len(pages)
+
+
+def read_pages(target: Path) -> Iterator[Dict]:
+    """캐시 파일에서 페이지를 한 장씩 읽기"""
+    with open(target, encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def parse_files(jobs: List[Tuple[Path, str]], backend: str, workers: int = 0) -> Iterator[Tuple[Path, str, Iterator[Dict]]]:
+    """
+    (경로, 파일 해시) 목록을 동시에 파싱하고, 끝나는 순서대로 (경로, 해시, 페이지 이터레이터) 반환.
+    캐시에 있는 파일은 바로 반환하고, 동시에 진행 중인 파일 수는 workers * 2로 제한합니다.
+    """
+    workers = workers or os.cpu_count() or 1
+    pending = []
+    for path, digest in jobs:
+        target = cache_path(digest, backend)
+        if target.exists():
+            yield path, digest, read_pages(target)
+        else:
+            pending.append((path, digest, target))
+    if not pending:
+        return
+
+    pool_kind = BACKENDS[backend][1]
+    executor_cls = ProcessPoolExecutor if pool_kind == "process" else ThreadPoolExecutor
+    with executor_cls(max_workers=min(workers, len(pending))) as executor:
+        remaining = iter(pending)
+        in_flight = {}
+
+        def submit_next():
+            item = next(remaining, None)
+            if item is not None:
+                path, digest, target = item
+                print(f"Started parsing: {path.name}", flush=True)
+                in_flight[executor.submit(_parse_to_cache, backend, str(path), str(target))] = item
+
+        for _ in range(workers * 2):
+            submit_next()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, digest, target = in_flight.pop(future)
+                submit_next()
+                try:
+                    future.result()
+                except Exception as e:
+                    # 실패한 파일은 건너뛰고 (매니페스트에 반영되지 않아) 다음 실행 때 다시 시도
+                    print(f"[파싱 실패] {path.name}: {e}", flush=True)
+                    continue
+                yield path, digest, read_pages(target)
@@ -5,19 +5,19 @@ import os
 from chromadb import PersistentClient
 from llama_index.vector_stores.chroma import ChromaVectorStore
 from llama_index.core import VectorStoreIndex, StorageContext, Settings
+from llama_index.core.query_engine import RetrieverQueryEngine
 
 # ✅ 답변 LLM: Ollama (midm:latest)
 from llama_index.llms.ollama import Ollama
 MODEL_NAME = os.getenv("OLLAMA_LLM_MODEL", "midm:latest")
 Settings.llm = Ollama(model=MODEL_NAME, request_timeout=180.0)
 
-# ✅ 질의 임베딩: ingest와 동일(HF E5)
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-Settings.embed_model = HuggingFaceEmbedding(
-    model_name="intfloat/multilingual-e5-large",
-    device="cuda",
-    embed_batch_size=64
-)
+# ✅ 질의 임베딩: ingest와 동일 (embeddings.py, GPU 없으면 CPU)
+from embeddings import EMBED_MODEL_NAME, check_collection_embedding, create_embed_model, embedding_dimension
+Settings.embed_model = create_embed_model()
+
+# ✅ 검색: 벡터 + BM25 하이브리드 (RETRIEVAL_MODE=dense면 벡터만)
+from hybrid import build_retriever
 
 DB_PATH = "storage/chroma"
 COLLECTION_NAME = "midm_docs"
@@ -25,10 +25,13 @@ COLLECTION_NAME = "midm_docs"
 def get_query_engine(top_k=4):
     client = PersistentClient(path=DB_PATH)
     collection = client.get_or_create_collection(COLLECTION_NAME)
+    # 적재한 모델과 다른 임베딩으로는 조회하지 않음
+    check_collection_embedding(collection, EMBED_MODEL_NAME, embedding_dimension(Settings.embed_model))
     vector_store = ChromaVectorStore(chroma_collection=collection)
     storage_context = StorageContext.from_defaults(vector_store=vector_store)
     index = VectorStoreIndex.from_vector_store(vector_store)
-    return index.as_query_engine(similarity_top_k=top_k, response_mode="compact")
+    retriever = build_retriever(index, collection, top_k=top_k)
+    return RetrieverQueryEngine.from_args(retriever, response_mode="compact")
 
 if __name__ == "__main__":
     qe = get_query_engine(top_k=4)
@@ -39,3 +42,5 @@ if __name__ == "__main__":
     for sn in resp.source_nodes:
         meta = sn.node.metadata or {}
         print(f"- {meta.get('source')} (p.{meta.get('page')}), score={sn.score:.3f}")
+    if getattr(qe.retriever, "last_timings", None):
+        print("\n=== 검색 단계별 시간(ms) ===\n", qe.retriever.last_timings)
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+색인 공통 유틸
+상담 서버(counseling-finetuned-midm/rag_retriever.py)가 검색 시 필터로 쓰는
+청크 메타데이터를 적재 시점에 한 번 계산합니다.
+"""
+
+import re
+
+# 메타데이터 키 (rag_retriever.py와 동일해야 함)
+RELEVANCE_KEY = "counseling_relevant"
+CONTEXT_KEY = "counseling_context"
+
+# 학술적 내용 (상담 응답 참고 자료로 부적합)
+ACADEMIC_MARKERS = ['참고문헌', '출처:', '연구', '논문', '년도', 'p.']
+# 상담 관련 핵심 내용
+COUNSELING_KEYWORDS = ['상담', '치료', '심리', '감정', '대처', '방법']
+# 인용이나 저자 정보
+CITATION_PATTERN = re.compile(r'\d{4}년?|\d{4}\s*,\s*p.*|저자.*|출처.*')
+
+HEAD_CHARS = 300
+CONTEXT_CHARS = 200
+MIN_CONTEXT_CHARS = 50
+
+
+def counseling_metadata(text: str) -> dict:
+    """청크 앞부분 기준 상담 관련 여부와 프롬프트에 넣을 정리된 발췌"""
+    head = (text or "")[:HEAD_CHARS]
+    if any(marker in head for marker in ACADEMIC_MARKERS):
+        return {RELEVANCE_KEY: False, CONTEXT_KEY: ""}
+    if not any(keyword in head for keyword in COUNSELING_KEYWORDS):
+        return {RELEVANCE_KEY: False, CONTEXT_KEY: ""}
+
+    context = CITATION_PATTERN.sub('', head).strip()
+    if len(context) <= MIN_CONTEXT_CHARS:
+        return {RELEVANCE_KEY: False, CONTEXT_KEY: ""}
+    return {RELEVANCE_KEY: True, CONTEXT_KEY: context[:CONTEXT_CHARS]}